@@ -1,84 +1,253 @@
 # -*- coding: utf-8 -*-
 """
 
-some code for comparing contents of drives 
+some code for comparing contents of drives
+
+The drives are scanned with os.scandir (which returns the stat data with the
+directory listing) in parallel threads, and the result of each scan is saved
+into a manifest file. On the next run, only the directories whose mtime has
+changed are listed again; for the others, the files are taken from the
+manifest, so a rescan costs about one stat call per directory instead of one
+per file.
+
+NB: modifying a file in place does not change the mtime of its directory, so
+an incremental scan (the default) only finds added and deleted files, and
+modtime_differs is then incomplete. To also find files modified in place, set
+FULL_SCAN = True: all the directories are then listed again (one stat per
+file), but the manifest is still used for the hashes of unchanged files.
 
 @author: Jussi (jnu@iki.fi)
 """
 
 
+import hashlib
+import json
 import os
 import os.path as op
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
 
 
-# %% scan two drives, Z: and Y:
-# Y is supposed to equal Z (except for excluded dirs)
-
-
-def _all_files(path):
-    """Recursively yield all files (not dirs) under a subdir"""
-    for dir, _, files in os.walk(path):
-        for filename in files:
-            yield op.join(dir, filename)
-
-
-def _filter_exclude(paths, strings):
-    """Exclude strings from paths; case insensitive"""
-    if not isinstance(strings, list):
-        strings = [strings]
-    for path in paths:
-        if not any(str.lower() in path.lower() for str in strings):
-            yield path
+# concurrent directory listings; mostly waiting for the network
+SCAN_WORKERS = 16
+# where to keep the manifests
+MANIFEST_DIR = Path.home() / 'compare_drives'
 
 
-def _filter_rm_drive_letter(paths):
-    """Remove first character (drive letter)"""
-    for path in paths:
-        yield path[2:]
+# %% scan two drives, Z: and Y:
+# Y is supposed to equal Z (except for excluded dirs)
 
 
-def _filter_n(vals, n):
-    """Return n first values from an iterator"""
-    for k, val in enumerate(vals):
-        if k < n:
-            yield val
-        else:
-            break
+def _file_hash(path):
+    """SHA-1 of a file"""
+    sha = hashlib.sha1()
+    with open(path, 'rb') as f:
+        while block := f.read(1024 * 1024):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def _is_excluded(path, strings):
+    """Check path against excluded strings; case insensitive"""
+    return any(str.lower() in path.lower() for str in strings)
+
+
+def _can_reuse(old, dir_mtime, with_hash):
+    """Whether an old directory record is still valid"""
+    return (
+        old is not None
+        and old['mtime_ns'] == dir_mtime
+        and (old['hashed'] or not with_hash)
+    )
+
+
+def _scan_dir(root, reldir, dir_mtime, old, with_hash, full=False):
+    """List a single directory.
+
+    If the directory mtime matches the old manifest record (and full is
+    False), the files are taken from the record, and only the subdirs are
+    stat'ed (for their mtimes). Otherwise the directory is listed; hashes
+    are reused from the old record for files whose size and mtime match.
+    Returns the new record and a list of (subdir, mtime).
+    """
+    path = op.join(root, reldir)
+    if not full and _can_reuse(old, dir_mtime, with_hash):
+        subdirs = list()
+        for name in old['subdirs']:
+            try:
+                subdirs.append((name, os.stat(op.join(path, name)).st_mtime_ns))
+            except FileNotFoundError:  # race with a concurrent delete
+                pass
+        return dict(old, subdirs=[name for name, _ in subdirs]), subdirs
+
+    old_files = old['files'] if old is not None else dict()
+    files, subdirs = dict(), list()
+    try:
+        it = os.scandir(path)
+    except OSError:  # e.g. no permission; skipped like os.walk does
+        # no mtime, so it will be listed again on the next scan
+        return {'mtime_ns': None, 'hashed': False, 'files': files, 'subdirs': []}, subdirs
+    with it:
+        for entry in it:
+            if entry.is_dir(follow_symlinks=False):
+                mtime = entry.stat(follow_symlinks=False).st_mtime_ns
+                subdirs.append((entry.name, mtime))
+            elif entry.is_file():
+                st = entry.stat()
+                rec = [st.st_size, st.st_mtime_ns]
+                if with_hash:
+                    prev = old_files.get(entry.name)
+                    if prev is not None and prev[:2] == rec and len(prev) > 2:
+                        rec.append(prev[2])
+                    else:
+                        rec.append(_file_hash(entry.path))
+                files[entry.name] = rec
+    record = {
+        'mtime_ns': dir_mtime,
+        'hashed': with_hash,
+        'files': files,
+        'subdirs': [name for name, _ in subdirs],
+    }
+    return record, subdirs
+
+
+def scan_tree(root, manifest=None, exclude=None, with_hash=False, full=False):
+    """Scan a directory tree, reusing an old manifest for unchanged dirs.
+
+    Parameters
+    ----------
+    root : str
+        The root directory (e.g. 'Z:\\').
+    manifest : dict, optional
+        Manifest from a previous scan of the same root.
+    exclude : list, optional
+        Skip directories whose path contains any of these strings (case
+        insensitive).
+    with_hash : bool
+        Also record a SHA-1 hash of each file (only computed for new or
+        changed files).
+    full : bool
+        If True, list all dirs again, also those whose mtime has not changed
+        (finds files modified in place). Hashes of unchanged files are still
+        taken from the old manifest.
+
+    Returns
+    -------
+    tuple
+        Tuple of (manifest, n_listed): the new manifest (dict of relative dir:
+        record) and the number of directories that were listed.
+    """
+    exclude = exclude or list()
+    old_dirs = manifest or dict()
+    new_dirs = dict()
+    n_listed = 0
+    with ThreadPoolExecutor(max_workers=SCAN_WORKERS) as executor:
+
+        def _submit(reldir, mtime):
+            old = old_dirs.get(reldir)
+            fut = executor.submit(_scan_dir, root, reldir, mtime, old, with_hash, full)
+            pending[fut] = (reldir, not full and _can_reuse(old, mtime, with_hash))
+
+        pending = dict()
+        _submit('', os.stat(root).st_mtime_ns)
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                reldir, reused = pending.pop(fut)
+                record, subdirs = fut.result()
+                n_listed += not reused
+                new_dirs[reldir] = record
+                for name, mtime in subdirs:
+                    subdir = op.join(reldir, name)
+                    if not _is_excluded(subdir, exclude):
+                        _submit(subdir, mtime)
+    return new_dirs, n_listed
+
+
+def _manifest_file(name):
+    return MANIFEST_DIR / f'manifest_{name}.json'
+
+
+def load_manifest(name):
+    """Load a saved manifest, or None if there is none"""
+    fname = _manifest_file(name)
+    if not fname.is_file():
+        return None
+    with open(fname, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_manifest(name, manifest):
+    """Save a manifest (atomically, so an interrupted save does not lose the old one)"""
+    MANIFEST_DIR.mkdir(parents=True, exist_ok=True)
+    fname = _manifest_file(name)
+    tmpname = fname.with_name(fname.name + '.tmp')
+    with open(tmpname, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+    os.replace(tmpname, fname)
+
+
+def _manifest_files(manifest):
+    """Return dict of file path (relative to root, with leading separator): record"""
+    return {
+        op.join(os.sep, reldir, name): rec
+        for reldir, record in manifest.items()
+        for name, rec in record['files'].items()
+    }
+
+
+def compare_manifests(manifest_z, manifest_y):
+    """Compare two manifests.
+
+    Returns
+    -------
+    tuple
+        Tuple of (not_on_y, not_on_z, modtime_differs).
+    """
+    files_z, files_y = _manifest_files(manifest_z), _manifest_files(manifest_y)
+    # missing from y drive - should be copied from z
+    not_on_y = files_z.keys() - files_y.keys()
+    # were deleted from z after copy - should be deleted from y
+    not_on_z = files_y.keys() - files_z.keys()
+    # modified after copy - should be re-copied from z
+    on_both = files_z.keys() & files_y.keys()
+    print(f'{len(on_both)} items on both drives')
+    modtime_differs = [f for f in on_both if files_z[f][1] != files_y[f][1]]
+    return not_on_y, not_on_z, modtime_differs
+
+
+def scan_drive(name, root, exclude=None, with_hash=False, full=False):
+    """Scan a drive incrementally, using and updating its saved manifest"""
+    t0 = time.perf_counter()
+    manifest, n_listed = scan_tree(
+        root, load_manifest(name), exclude=exclude, with_hash=with_hash, full=full
+    )
+    save_manifest(name, manifest)
+    print(
+        f'{root}: {len(manifest)} dirs, {n_listed} listed, '
+        f'{time.perf_counter() - t0:.1f} s'
+    )
+    return manifest
 
 
 # find all files
-# remove drive letter from names so we can compare
+# paths are relative to the drive root, so we can compare
 
-gz = _all_files('Z:\\')
-gz = _filter_exclude(gz, 'userdata_vicon_server')
-# gz = _filter_n(gz, 20)
-gz = _filter_rm_drive_letter(gz)
-lz0 = list(gz)
+# True = list all dirs again, to also find files modified in place (slower)
+FULL_SCAN = False
 
-
-gy = _all_files('Y:\\')
-# gy = _filter_n(gy, 20)
-gy = _filter_rm_drive_letter(gy)
-ly0 = list(gy)
+if __name__ == '__main__':
+    mz = scan_drive('Z', 'Z:\\', exclude=['userdata_vicon_server'], full=FULL_SCAN)
+    my = scan_drive('Y', 'Y:\\', full=FULL_SCAN)
 
 
 # %% find the differences between the file sets
 
-# missing from y drive - should be copied from z
-not_on_y = set(lz0) - set(ly0)
-
-# were deleted from z after copy - should be deleted from y
-not_on_z = set(ly0) - set(lz0)
-
-# modified after copy - should be re-copied from z
-# this takes a while
-on_both = set.intersection(set(lz0), set(ly0))
-
-print(f'{len(on_both)} items on both drives')
-
-modtime_differs = list()
-for i, f in enumerate(on_both):
-    if i % 500 == 0:
-        print(f'{i} files checked')
-    if os.path.getmtime('Z:' + f) != os.path.getmtime('Y:' + f):
-        modtime_differs.append(f)
+if __name__ == '__main__':
+    not_on_y, not_on_z, modtime_differs = compare_manifests(mz, my)
+    if not FULL_SCAN:
+        print(
+            'WARNING: incremental scan; files modified in place are not found, '
+            'so modtime_differs is incomplete (set FULL_SCAN = True)'
+        )
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for compare_drives.py, using two local directory trees.
+
+requires: pytest
+"""
+
+import os
+import os.path as op
+import shutil
+
+import pytest
+
+import compare_drives
+from compare_drives import compare_manifests, scan_drive, scan_tree
+
+
+def _set_mtime(path, mtime_ns):
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+@pytest.fixture
+def drives(tmp_path, monkeypatch):
+    """Two equal trees, z and y, with the same file mtimes"""
+    monkeypatch.setattr(compare_drives, 'MANIFEST_DIR', tmp_path / 'manifests')
+    z = tmp_path / 'z'
+    for k in range(3):
+        sessiondir = z / 'patients' / f'p{k}' / 'session'
+        sessiondir.mkdir(parents=True)
+        for n in range(4):
+            fname = sessiondir / f'trial{n}.c3d'
+            fname.write_bytes(b'x' * (n + 1))
+            _set_mtime(fname, 1_600_000_000_000_000_000 + n)
+    (z / 'userdata_vicon_server').mkdir()
+    (z / 'userdata_vicon_server' / 'skip.txt').write_text('x')
+    y = tmp_path / 'y'
+    shutil.copytree(z, y, ignore=shutil.ignore_patterns('userdata_vicon_server'))
+    return z, y
+
+
+def _scan_both(z, y, full=False):
+    mz = scan_drive('Z', str(z), exclude=['userdata_vicon_server'], full=full)
+    my = scan_drive('Y', str(y), full=full)
+    return compare_manifests(mz, my)
+
+
+def test_equal_trees(drives):
+    z, y = drives
+    not_on_y, not_on_z, modtime_differs = _scan_both(z, y)
+    assert not not_on_y and not not_on_z and not modtime_differs
+
+
+def test_added_and_deleted_files_found_incrementally(drives):
+    z, y = drives
+    _scan_both(z, y)
+    (z / 'patients' / 'p0' / 'session' / 'new.c3d').write_text('new')
+    (y / 'patients' / 'p1' / 'session' / 'trial0.c3d').unlink()
+    (y / 'patients' / 'p2' / 'session' / 'extra.avi').write_text('extra')
+    not_on_y, not_on_z, _ = _scan_both(z, y)
+    sep = os.sep
+    assert not_on_y == {
+        op.join(sep, 'patients', 'p0', 'session', 'new.c3d'),
+        op.join(sep, 'patients', 'p1', 'session', 'trial0.c3d'),
+    }
+    assert not_on_z == {op.join(sep, 'patients', 'p2', 'session', 'extra.avi')}
+
+
+def test_unchanged_dirs_are_reused(drives):
+    z, _ = drives
+    manifest, n_listed = scan_tree(str(z))
+    assert n_listed == len(manifest)
+    (z / 'patients' / 'p1' / 'session' / 'new.c3d').write_text('new')
+    manifest2, n_listed = scan_tree(str(z), manifest)
+    assert n_listed == 1
+    assert 'new.c3d' in manifest2[op.join('patients', 'p1', 'session')]['files']
+
+
+def test_modified_in_place_needs_full_scan(drives):
+    z, y = drives
+    _scan_both(z, y)
+    fname = z / 'patients' / 'p2' / 'session' / 'trial3.c3d'
+    fname.write_bytes(b'modified')
+    _set_mtime(fname, 1_700_000_000_000_000_000)
+    # the directory mtime does not change, so an incremental scan misses it
+    *_, modtime_differs = _scan_both(z, y)
+    assert modtime_differs == []
+    *_, modtime_differs = _scan_both(z, y, full=True)
+    assert modtime_differs == [op.join(os.sep, 'patients', 'p2', 'session', 'trial3.c3d')]
+
+
+def test_hashes(drives):
+    z, _ = drives
+    manifest, _ = scan_tree(str(z), with_hash=True)
+    rec = manifest[op.join('patients', 'p0', 'session')]['files']['trial0.c3d']
+    assert len(rec) == 3 and len(rec[2]) == 40
+    # a manifest without hashes is not reused for a hashed scan
+    manifest, _ = scan_tree(str(z))
+    _, n_listed = scan_tree(str(z), manifest, with_hash=True)
+    assert n_listed == len(manifest)
+
+
+def test_full_scan_reuses_hashes(drives, monkeypatch):
+    z, _ = drives
+    manifest, _ = scan_tree(str(z), with_hash=True)
+    fname = z / 'patients' / 'p0' / 'session' / 'trial1.c3d'
+    fname.write_bytes(b'modified')
+    hashed = list()
+    file_hash = compare_drives._file_hash
+    monkeypatch.setattr(
+        compare_drives, '_file_hash', lambda path: hashed.append(path) or file_hash(path)
+    )
+    manifest2, n_listed = scan_tree(str(z), manifest, with_hash=True, full=True)
+    assert n_listed == len(manifest)
+    assert hashed == [str(fname)]
+    rec = manifest2[op.join('patients', 'p0', 'session')]['files']['trial1.c3d']
+    assert rec[0] == len(b'modified')
@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+"""
+Nexus-free processing stages for global_autoproc.py.
+
+The stages that drive Nexus (autoprocessing, postprocessing pipelines) have
+to run serially, but the rest (Eclipse tagging, video conversion, web/PDF
+reports, copying) are independent for each session. run_stages() runs them
+for all sessions in parallel:
+
+    run_stages(['videos', 'reports'], session_dirs)
+
+Each session is processed in a separate Python process running this file
+(python autoproc_stages.py STAGE [STAGE ...] --session SESSIONDIR), so the
+stages can be started from the interactive cells of global_autoproc.py
+without the worker processes re-running the cells. The output of the worker
+processes is printed as it arrives, prefixed by the session name. The stages
+of one session run in the given order. The reports stage reads the patient info from the
+session (saved by sessionutils.save_info).
+
+requires: gaitutils
+"""
+
+import argparse
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# how many trials to tag per context
+MAX_TAGS_PER_CONTEXT = 3
+
+# serializes the output lines of the concurrent workers
+_print_lock = threading.Lock()
+
+
+# Eclipse forceplate values written by autoprocessing (other values, e.g.
+# 'Auto', mean that the contacts have not been determined)
+FP_CONTACT_VALUES = {'Left', 'Right'}
+FP_DECIDED_VALUES = FP_CONTACT_VALUES | {'Invalid'}
+
+
+def _count_fp_contacts(trial):
+    """Return n of valid forceplate contacts"""
+    return len(trial.fp_events['L_strikes']) + len(trial.fp_events['R_strikes'])
+
+
+def _count_fp_contacts_enf(eclipse_keys):
+    """Return n of valid forceplate contacts from the Eclipse keys.
+
+    Returns None if the enf does not have the forceplate info (it is written
+    by autoprocessing, if cfg.autoproc.write_eclipse_fp_info == 'write').
+    """
+    from gaitutils import eclipse
+
+    fp_info = eclipse._eclipse_forceplate_keys(eclipse_keys)
+    if not fp_info or not set(fp_info.values()) <= FP_DECIDED_VALUES:
+        return None
+    return len([val for val in fp_info.values() if val in FP_CONTACT_VALUES])
+
+
+def _gait_direction(eclipse_keys):
+    """Quick and dirty gait direction from the Eclipse keys, after autoprocessing.
+
+    XXX: fragile, relies on certain description string.
+    """
+    thedesc = eclipse_keys['DESCRIPTION']
+    for dir in 'ET':
+        if dir in thedesc:
+            return dir
+    return None
+
+
+def _autotag(sessiondir):
+    """Automatically tag trials in a session dir.
+
+    Each enf file is read only once. The forceplate contacts are counted from
+    the Eclipse forceplate info written by autoprocessing; the c3d file is
+    loaded only for trials that do not have it.
+    """
+    from gaitutils import eclipse, sessionutils
+    from trial_loader import load_trial
+
+    t0 = time.perf_counter()
+    ranked = {direction: list() for direction in 'ET'}
+    n_loaded = 0
+    for enffile in sessionutils._get_session_enfs(sessiondir):
+        keys = eclipse.get_eclipse_keys(enffile)
+        if 'DYNAMIC' not in keys['TYPE'].upper():
+            continue
+        if (direction := _gait_direction(keys)) not in ranked:
+            continue
+        c3dfile = sessionutils.enf_to_trialfile(enffile, 'c3d')
+        if not c3dfile.is_file():
+            continue
+        if (n_contacts := _count_fp_contacts_enf(keys)) is None:
+            n_contacts = _count_fp_contacts(load_trial(c3dfile).trial)
+            n_loaded += 1
+        ranked[direction].append((n_contacts, enffile))
+
+    for direction, trials in ranked.items():
+        # stable sort, so ties are resolved by file order
+        bestfiles = [enffile for _, enffile in sorted(trials, key=lambda t: -t[0])]
+        for k, enffile in enumerate(bestfiles[:MAX_TAGS_PER_CONTEXT], 1):
+            eclipse.set_eclipse_keys(
+                enffile, {'NOTES': direction + str(k)}, update_existing=True
+            )
+    ntrials = sum(len(trials) for trials in ranked.values())
+    print(
+        f'tagged {ntrials} trials in {time.perf_counter() - t0:.1f} s '
+        f'({n_loaded} c3d files loaded)'
+    )
+
+
+def _convert_videos(sessiondir, redo=False, nworkers=None):
+    """Convert the session videos, if needed"""
+    from gaitutils import cfg, videos
+    from video_convert import convert_videos
+
+    vidfiles = videos._collect_session_videos(sessiondir, tags=cfg.eclipse.tags)
+    if not vidfiles:
+        raise RuntimeError(f'Cannot find any video files for session {sessiondir}')
+    convert_videos(vidfiles, nworkers=nworkers, redo=redo)
+
+
+def _create_reports(sessiondir):
+    """Create the web and PDF reports, using the saved patient info.
+
+    The report figures are reused if the session data has not changed (see
+    report_cache.py).
+    """
+    from gaitutils import sessionutils
+    from report_cache import create_reports
+
+    info = sessionutils.load_info(sessiondir)
+    create_reports(sessiondir, info)
+
+
+def _copy_session(sessiondir, dest_root):
+    """Copy the session dir under dest_root, with verification.
+
+    The checksums are computed while writing, so the copies are not read
+    back over the network (see session_copy.py for verification by reading).
+    """
+    from session_copy import copy_session
+
+    copy_session(sessiondir, Path(dest_root) / Path(sessiondir).name)
+
+
+def _run_session_stages(
+    stages, sessiondir, dest_root=None, redo_videos=False, video_workers=None
+):
+    """Run the given stages for a session (in the worker process)"""
+    for stage in stages:
+        print(f'{stage}: starting')
+        if stage == 'autotag':
+            _autotag(sessiondir)
+        elif stage == 'videos':
+            _convert_videos(sessiondir, redo=redo_videos, nworkers=video_workers)
+        elif stage == 'reports':
+            _create_reports(sessiondir)
+        elif stage == 'copy':
+            if dest_root is None:
+                raise ValueError('copy stage needs a destination')
+            _copy_session(sessiondir, dest_root)
+        else:
+            raise ValueError(f'unknown stage {stage}')
+        print(f'{stage}: done')
+
+
+def _run_worker(stages, sessiondir, dest_root=None, redo_videos=False, video_workers=None):
+    """Run stages for a session in a separate process; returns the return code.
+
+    The output of the process is printed line by line as it arrives.
+    """
+    # unbuffered, so that progress messages come through immediately
+    args = [sys.executable, '-u', __file__, *stages, '--session', str(sessiondir)]
+    if video_workers is not None:
+        args += ['--video-workers', str(video_workers)]
+    if dest_root is not None:
+        args += ['--dest', str(dest_root)]
+    if redo_videos:
+        args.append('--redo-videos')
+    prefix = f'[{Path(sessiondir).name}]'
+    with subprocess.Popen(
+        args,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+        bufsize=1,
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+    ) as proc:
+        for line in proc.stdout:
+            with _print_lock:
+                print(f'{prefix} {line.rstrip()}', flush=True)
+    return proc.returncode
+
+
+def run_stages(stages, session_dirs, nworkers=None, dest_root=None, redo_videos=False):
+    """Run Nexus-free stages for all sessions, sessions in parallel.
+
+    Parameters
+    ----------
+    stages : list
+        The stages to run for each session, in order. Supported stages:
+        'autotag', 'videos', 'reports', 'copy'.
+    session_dirs : list
+        The session directories.
+    nworkers : int, optional
+        Max. number of sessions processed at the same time. By default, all
+        sessions (up to the number of cores).
+    dest_root : Path, optional
+        Destination for the 'copy' stage; the sessions are copied into
+        subdirectories of dest_root.
+    redo_videos : bool
+        If True, convert the videos even if the converted files are up to date.
+
+    Raises
+    ------
+    RuntimeError
+        If the stages failed for any of the sessions (after all the sessions
+        have been processed).
+    """
+    if nworkers is None:
+        nworkers = os.cpu_count()
+    nworkers = max(min(nworkers, len(session_dirs)), 1)
+    # share the cores between the video converters of the concurrent sessions
+    video_workers = max(os.cpu_count() // nworkers, 1)
+    desc = ', '.join(stages)
+    failed = list()
+    with ThreadPoolExecutor(max_workers=nworkers) as executor:
+        futures = {
+            executor.submit(
+                _run_worker, stages, sessiondir, dest_root, redo_videos, video_workers
+            ): sessiondir
+            for sessiondir in session_dirs
+        }
+        for n, future in enumerate(as_completed(futures), 1):
+            sessiondir = futures[future]
+            if future.result() != 0:
+                failed.append(sessiondir)
+            with _print_lock:
+                print(f'{desc}: {n} of {len(session_dirs)} sessions done')
+    if failed:
+        raise RuntimeError(f'{desc} failed for sessions: {[str(s) for s in failed]}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run Nexus-free stages for a session')
+    parser.add_argument('stages', nargs='+', help='stages to run')
+    parser.add_argument('--session', required=True, help='session directory')
+    parser.add_argument('--dest', help='destination root for the copy stage')
+    parser.add_argument('--redo-videos', action='store_true', help='force video conversion')
+    parser.add_argument('--video-workers', type=int, help='max. concurrent video converters')
+    args = parser.parse_args()
+    _run_session_stages(
+        args.stages,
+        Path(args.session),
+        dest_root=args.dest,
+        redo_videos=args.redo_videos,
+        video_workers=args.video_workers,
+    )
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""
+Process-pool batch driver for per-file (e.g. per-c3d) processing.
+
+Usage:
+
+    results, failures = run_batch(func, c3dfiles, nworkers=8)
+
+func is called once for each file and must be picklable, i.e. defined at module
+level (use functools.partial to pass extra arguments). Since worker processes
+import the main script, scripts that use a pool must keep their top level code
+under an if __name__ == '__main__' guard. With nworkers=1, everything runs
+serially in the calling process, which also works for functions defined
+interactively.
+
+If a ResultCache is given, cached results are used for unchanged files and only
+the remaining files are processed.
+
+requires: gaitutils
+"""
+
+import os
+import logging
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from gaitutils.envutils import GaitDataError
+
+logger = logging.getLogger(__name__)
+
+
+def _print_progress(n_done, n_total, desc):
+    print(f'{desc}: {n_done} of {n_total} files done')
+
+
+def run_batch(
+    func,
+    files,
+    nworkers=None,
+    skip_exceptions=(GaitDataError,),
+    desc='Processing',
+    cache=None,
+    cache_params=None,
+):
+    """Apply func to each file, using a pool of worker processes.
+
+    Parameters
+    ----------
+    func : callable
+        Function taking a filename as its only argument. Must be picklable if
+        nworkers > 1.
+    files : iterable
+        The files to process. They are processed and returned in sorted order.
+    nworkers : int, optional
+        Number of worker processes. By default, use all cores. If 1, process
+        the files serially in the calling process.
+    skip_exceptions : tuple of exception classes
+        If func raises one of these, the file is logged as failed and skipped.
+        Other exceptions are raised.
+    desc : str
+        Description for progress messages.
+    cache : ResultCache, optional
+        Cache for the results. Results must be cacheable (see result_cache).
+    cache_params : dict, optional
+        Parameters that affect the results, used as part of the cache key.
+
+    Returns
+    -------
+    tuple
+        A tuple of (results, failures). results is a list of (file, result)
+        tuples for the files that were processed successfully, and failures is a
+        list of (file, exception) tuples. Both are in sorted file order.
+    """
+    files = sorted(files)
+    results = dict()
+    failures = dict()
+    if cache is not None:
+        for fn in files:
+            if (result := cache.get(fn, cache_params)) is not None:
+                results[fn] = result
+        if results:
+            print(f'{desc}: using cached results for {len(results)} of {len(files)} files')
+    todo = [fn for fn in files if fn not in results]
+    if nworkers is None:
+        nworkers = os.cpu_count()
+    nworkers = max(min(nworkers, len(todo)), 1)
+
+    if nworkers == 1:
+        for n, fn in enumerate(todo, 1):
+            try:
+                results[fn] = func(fn)
+            except skip_exceptions as e:
+                logger.warning(f'cannot process {fn}, skipping: {e}')
+                failures[fn] = e
+            _print_progress(n, len(todo), desc)
+
+    else:
+        with ProcessPoolExecutor(max_workers=nworkers) as executor:
+            futures = {executor.submit(func, fn): fn for fn in todo}
+            for n, future in enumerate(as_completed(futures), 1):
+                fn = futures[future]
+                try:
+                    results[fn] = future.result()
+                except skip_exceptions as e:
+                    logger.warning(f'cannot process {fn}, skipping: {e}')
+                    failures[fn] = e
+                except Exception:
+                    for fut in futures:
+                        fut.cancel()
+                    raise
+                _print_progress(n, len(todo), desc)
+
+    if cache is not None:
+        for fn in todo:
+            if fn in results:
+                cache.put(fn, cache_params, results[fn])
+
+    results = [(fn, results[fn]) for fn in files if fn in results]
+    failures = [(fn, failures[fn]) for fn in files if fn in failures]
+    return results, failures
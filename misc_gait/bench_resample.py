@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark the EMG downsampling backends in emg_envelope.py.
+
+Compares FFT resampling against the polyphase path for typical trial lengths
+(2 kHz analog data, 100 Hz marker data, 16 channels). Frame counts include
+primes, which are the slow case for FFT resampling of cropped trials.
+
+requires: numpy, scipy
+"""
+
+import timeit
+import numpy as np
+
+from emg_envelope import resample
+
+EMGRATE = 2000
+FRAMERATE = 100
+NCHANNELS = 16
+NREPEAT = 5
+# frame counts; primes and numbers with large prime factors are included on
+# purpose
+NFRAMES = [500, 997, 1000, 1201, 2003, 3001, 6000, 6007, 12007]
+
+
+def _bench(data, nframes, method):
+    """Return best-of-NREPEAT time for one resampling call (in ms)"""
+    timer = timeit.Timer(lambda: resample(data, nframes, method=method))
+    return 1e3 * min(timer.repeat(repeat=NREPEAT, number=1))
+
+
+if __name__ == '__main__':
+    rng = np.random.default_rng(0)
+    spf = EMGRATE // FRAMERATE
+    print(
+        '%8s %10s %10s %10s %8s %12s %6s'
+        % ('frames', 'samples', 'fft (ms)', 'poly (ms)', 'speedup', 'max rel diff', 'auto')
+    )
+    for nframes in NFRAMES:
+        data = rng.standard_normal((NCHANNELS, nframes * spf))
+        # smooth the data, similar to an envelope
+        data = np.cumsum(data, axis=1) / spf
+        t_fft = _bench(data, nframes, 'fft')
+        t_poly = _bench(data, nframes, 'poly')
+        res_fft, _ = resample(data, nframes, method='fft')
+        res_poly, _ = resample(data, nframes, method='poly')
+        _, auto_method = resample(data, nframes)
+        # compare away from the edges, where the methods handle padding differently
+        sl = slice(10, -10)
+        reldiff = np.abs(res_fft[:, sl] - res_poly[:, sl]).max() / np.abs(res_fft).max()
+        print(
+            '%8d %10d %10.2f %10.2f %8.1f %12.2e %6s'
+            % (nframes, data.shape[1], t_fft, t_poly, t_fft / t_poly, reldiff, auto_method)
+        )
@@ -13,12 +13,18 @@ import logging
 import numpy as np
 import scipy
 import itertools
-from collections import defaultdict
 
 from gaitutils.stats import collect_trial_data
 from gaitutils.envutils import GaitDataError
 from gaitutils.config import cfg
 
+from batch import run_batch
+from c3d_catalog import C3DCatalog
+from cycle_dataset import CycleDataset
+from derived_vars import DerivedVars
+from cycle_store import CycleStore
+from result_cache import ResultCache, cfg_params
+
 
 DATA_FLDR = 'Z:/Misc/0_Mika/CP-projekti/HP/H0188_AJ/2022_06_20_seur_AJ/'
 MODEL_VAR_NAMES = {'RAnkleAnglesX', 'LAnkleAnglesX',
@@ -72,60 +78,163 @@ VALID_ECLIPSE_TAGS = {'E2', 'E3', 'E4', 'T2', 'T3', 'T4'}
 # VALID_ECLIPSE_TAGS = {'T1', 'E1'}
 MODEL_OUT_FNAME = 'C:/Users/vicon123/model_exported.mat'
 EMG_OUT_FNAME = 'C:/Users/vicon123/emg_exported.mat'
+# output format: 'mat' writes the files with scipy.io.savemat (all data in
+# memory, rewritten on each run); 'mat73' and 'hdf5' write chunked HDF5 files
+# (see cycle_dataset.py), which also contain the per-cycle metadata. 'mat73'
+# files can be loaded in MATLAB. With the HDF5 formats, new trials are
+# appended to existing files, and trials already in the file are skipped;
+# delete the files to re-export everything.
+EXPORT_FORMAT = 'mat'
+# number of worker processes; None = use all cores, 1 = no multiprocessing
+NWORKERS = None
+# cache for the per-trial data, so that reruns only read new or changed files;
+# set to None to disable. Increase CACHE_VERSION when changing _read_trial().
+CACHE_DIR = 'C:/Users/vicon123/c3d_export_cache'
+CACHE_VERSION = 4
+# trial catalog (see c3d_catalog.py); if set, only the trials with a valid
+# eclipse tag are read, instead of reading all the c3d files in DATA_FLDR
+CATALOG_DB = None
 
 
 logger = logging.getLogger(__name__)
 
 
-def main():
-    model_res = defaultdict(lambda: np.zeros((101,0)))
-    emg_res = defaultdict(lambda: np.zeros((1000,0)))
-    model_delta_t = defaultdict(lambda: [])
-
-    fnames = os.listdir(DATA_FLDR)
-    for fname in fnames:
-        if fname[-4:] == '.c3d':
-            print('Reading file %s ...' % fname)
-            full_name = DATA_FLDR + '/' + fname
+def _read_trial(full_name):
+    """Read normalized model and EMG data for a single c3d file.
+
+    Returns a dict with keys 'model', 'emg', 'duration', 'context', 'start',
+    'eclipse_tag', 'messages' and 'failed'. model and emg are dicts of (ncycles x
+    npoints) arrays for the variables with a valid eclipse tag. duration,
+    context and start are dicts (keyed by 'model' and 'emg', then by variable)
+    giving the duration (in seconds), context and start frame of each cycle. messages is a list
+    of progress messages to print. failed is True if the trial could not be
+    read (e.g. a locked file); such results are not cached.
+    """
+    fname = os.path.basename(full_name)
+    model = dict()
+    emg = dict()
+    duration = {'model': dict(), 'emg': dict()}
+    context = {'model': dict(), 'emg': dict()}
+    start = {'model': dict(), 'emg': dict()}
+    eclipse_tag = ''
+    messages = list()
+    failed = False
+    try:
+        data, cycles = collect_trial_data(full_name, analog_envelope=False, force_collect_all_cycles=False, fp_cycles_only=True)
+
+        for var_name in MODEL_VAR_NAMES:
             try:
-                data, cycles = collect_trial_data(full_name, analog_envelope=False, force_collect_all_cycles=False, fp_cycles_only=True)
-
-                for var_name in MODEL_VAR_NAMES:
-                    try:
-                        if cycles['model'][var_name][0].trial.eclipse_tag in VALID_ECLIPSE_TAGS:
-                            # Append normalized trial data
-                            model_res[var_name] = np.hstack((model_res[var_name], data['model'][var_name].T))
-
-                            # Compute and append the new sample duration after normalization
-                            for cyc in cycles['model'][var_name]:
-                                delta_t = ((cyc.end - cyc.start) / cyc.trial.framerate) / data['model'][var_name].shape[1]
-                                model_delta_t[var_name].append(delta_t)
-
-                            print('\t ... added %i cycles for variable \'%s\' (eclipse label \'%s\')' % (data['model'][var_name].shape[0], var_name, cycles['model'][var_name][0].trial.eclipse_tag))
-                        else:
-                            print('\t ... no data imported for variable \'%s\' from file %s (wrong eclipse label)' % (var_name, fname))
-                    except:
-                        print('\t ... no data imported for variable \'%s\' from file %s' % (var_name, fname))
-
-                for var_name in EMG_VAR_NAMES:
-                    try:
-                        if cycles['emg'][var_name][0].trial.eclipse_tag in VALID_ECLIPSE_TAGS:
-                            emg_res[var_name] = np.hstack((emg_res[var_name], data['emg'][var_name].T))
-                            print('\t ... added %i cycles for variable \'%s\' (eclipse label \'%s\')' % (data['emg'][var_name].shape[0], var_name, cycles['emg'][var_name][0].trial.eclipse_tag))
-                        else:
-                            print('\t ... no data imported for variable \'%s\' from file %s (wrong eclipse label)' % (var_name, fname))
-                    except:
-                        print('\t ... no data imported for variable \'%s\' from file %s' % (var_name, fname))
+                if cycles['model'][var_name][0].trial.eclipse_tag in VALID_ECLIPSE_TAGS:
+                    # Normalized trial data
+                    model[var_name] = data['model'][var_name]
+                    eclipse_tag = cycles['model'][var_name][0].trial.eclipse_tag
+
+                    # Cycle durations and contexts
+                    duration['model'][var_name] = np.array([(cyc.end - cyc.start) / cyc.trial.framerate for cyc in cycles['model'][var_name]])
+                    context['model'][var_name] = np.array([cyc.context for cyc in cycles['model'][var_name]])
+                    start['model'][var_name] = np.array([cyc.start for cyc in cycles['model'][var_name]])
+
+                    messages.append('\t ... added %i cycles for variable \'%s\' (eclipse label \'%s\')' % (data['model'][var_name].shape[0], var_name, cycles['model'][var_name][0].trial.eclipse_tag))
+                else:
+                    messages.append('\t ... no data imported for variable \'%s\' from file %s (wrong eclipse label)' % (var_name, fname))
             except:
-                print('\t ... failed!')
+                messages.append('\t ... no data imported for variable \'%s\' from file %s' % (var_name, fname))
 
+        for var_name in EMG_VAR_NAMES:
+            try:
+                if cycles['emg'][var_name][0].trial.eclipse_tag in VALID_ECLIPSE_TAGS:
+                    emg[var_name] = data['emg'][var_name]
+                    eclipse_tag = cycles['emg'][var_name][0].trial.eclipse_tag
+                    duration['emg'][var_name] = np.array([(cyc.end - cyc.start) / cyc.trial.framerate for cyc in cycles['emg'][var_name]])
+                    context['emg'][var_name] = np.array([cyc.context for cyc in cycles['emg'][var_name]])
+                    start['emg'][var_name] = np.array([cyc.start for cyc in cycles['emg'][var_name]])
+                    messages.append('\t ... added %i cycles for variable \'%s\' (eclipse label \'%s\')' % (data['emg'][var_name].shape[0], var_name, cycles['emg'][var_name][0].trial.eclipse_tag))
+                else:
+                    messages.append('\t ... no data imported for variable \'%s\' from file %s (wrong eclipse label)' % (var_name, fname))
+            except:
+                messages.append('\t ... no data imported for variable \'%s\' from file %s' % (var_name, fname))
+    except Exception as e:
+        messages.append('\t ... failed! (%s)' % e)
+        failed = True
 
-    # Compute the derivatives
-    for var_name in MODEL_VAR_NAMES_TO_DIFF:
-        model_res[var_name + '_dt'] = np.diff(model_res[var_name], axis=0) / np.array(model_delta_t[var_name])
+    return {'model': model, 'emg': emg, 'duration': duration, 'context': context,
+            'start': start, 'eclipse_tag': eclipse_tag, 'messages': messages, 'failed': failed}
 
-    scipy.io.savemat(MODEL_OUT_FNAME, model_res)
-    scipy.io.savemat(EMG_OUT_FNAME, emg_res)
+
+def _export_hdf5(fname, data, meta, matlab):
+    """Append cycles to a CycleDataset, skipping trials already in the file"""
+    with CycleDataset(fname, matlab=matlab) as ds:
+        exported = list(ds.trials())
+        for var_name, var_data in data.items():
+            new = ~np.isin(meta[var_name]['trial'], exported)
+            if new.any():
+                ds.append(var_name, var_data[new],
+                          **{col: vals[new] for col, vals in meta[var_name].items()})
+        print('%s: %d trials already exported' % (fname, len(exported)))
+
+
+def main():
+    # cycles are accumulated into growable stores, which avoids copying all the
+    # data for every trial
+    model_store = CycleStore()
+    emg_store = CycleStore()
+
+    if CATALOG_DB is not None:
+        with C3DCatalog(CATALOG_DB) as catalog:
+            catalog.refresh(DATA_FLDR)
+            full_names = catalog.select(rootdir=DATA_FLDR, tags=VALID_ECLIPSE_TAGS)
+    else:
+        full_names = [DATA_FLDR + '/' + fname for fname in os.listdir(DATA_FLDR) if fname[-4:] == '.c3d']
+    if CACHE_DIR is not None:
+        cache = ResultCache(CACHE_DIR)
+        cache_params = {'version': CACHE_VERSION,
+                        'model_vars': sorted(MODEL_VAR_NAMES),
+                        'emg_vars': sorted(EMG_VAR_NAMES),
+                        'tags': sorted(VALID_ECLIPSE_TAGS),
+                        **cfg_params('emg', 'trial')}
+    else:
+        cache = cache_params = None
+    results, _ = run_batch(_read_trial, full_names, nworkers=NWORKERS, desc='Reading files',
+                           cache=cache, cache_params=cache_params)
+
+    for full_name, res in results:
+        print('Read file %s' % os.path.basename(full_name))
+        for msg in res['messages']:
+            print(msg)
+
+        fname = os.path.basename(full_name)
+        for kind, store in (('model', model_store), ('emg', emg_store)):
+            for var_name, var_data in res[kind].items():
+                # Append normalized trial data
+                store.append(var_name, var_data, trial=fname,
+                             context=res['context'][kind][var_name],
+                             eclipse_tag=res['eclipse_tag'],
+                             duration=res['duration'][kind][var_name],
+                             start=res['start'][kind][var_name])
+
+    # (ncycles x npoints) arrays and per-cycle metadata
+    model_data, model_meta = model_store.finalize()
+    emg_data, emg_meta = emg_store.finalize()
+
+    # Compute the derivatives, using the duration of each cycle
+    derived = DerivedVars()
+    for var_name in MODEL_VAR_NAMES_TO_DIFF:
+        derived.derivative(var_name)
+    model_vars = derived.bind(model_data, model_meta)
+    for var_name, var_data in model_vars.derived().items():
+        model_data[var_name] = var_data
+        model_meta[var_name] = model_vars.meta(var_name)
+
+    if EXPORT_FORMAT == 'mat':
+        # the output arrays are (npoints x ncycles)
+        scipy.io.savemat(MODEL_OUT_FNAME, {var_name: var_data.T for var_name, var_data in model_data.items()})
+        scipy.io.savemat(EMG_OUT_FNAME, {var_name: var_data.T for var_name, var_data in emg_data.items()})
+    elif EXPORT_FORMAT in ('mat73', 'hdf5'):
+        matlab = EXPORT_FORMAT == 'mat73'
+        _export_hdf5(MODEL_OUT_FNAME, model_data, model_meta, matlab)
+        _export_hdf5(EMG_OUT_FNAME, emg_data, emg_meta, matlab)
+    else:
+        raise ValueError('Unknown export format %s' % EXPORT_FORMAT)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,317 @@
+# -*- coding: utf-8 -*-
+"""
+SQLite catalog of the c3d trials under a directory tree.
+
+Scanning a network drive and opening every c3d/enf file to find the relevant
+trials is slow. The catalog stores header level metadata for each trial
+(Eclipse fields and tag, trial type, frame and analog rates, analog channel
+names, number of forceplate contacts) in a SQLite database. Only the c3d
+header and parameter section are read (see c3d_mmap.py). refresh() scans the
+tree and re-reads only the files whose modification time has changed, so
+trials can then be selected by queries in milliseconds:
+
+    catalog = C3DCatalog('Y:/catalog.db')
+    catalog.refresh('Y:/Userdata_Vicon_Server')
+    c3dfiles = catalog.select(
+        tags=['E2', 'E3', 'E4'], trial_type='dynamic', channels=['RGas'], min_fp_contacts=2
+    )
+
+From the command line:
+
+    python c3d_catalog.py catalog.db ROOTDIR
+
+Forceplate contacts are counted from the Eclipse FP1, FP2, ... fields (the
+plates marked 'Left' or 'Right'), which are written by autoprocessing.
+
+requires: gaitutils
+"""
+
+import argparse
+import logging
+import os
+import os.path as op
+import sqlite3
+from collections import defaultdict
+
+from gaitutils import cfg, eclipse
+from gaitutils.envutils import GaitDataError
+
+from batch import run_batch
+from c3d_mmap import C3DFormatError, LazyC3D
+from emg_envelope import _strip_voltage_prefix
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS trials (
+    c3dfile TEXT PRIMARY KEY,
+    sessionpath TEXT,
+    trialname TEXT,
+    enffile TEXT,
+    c3d_mtime REAL,
+    enf_mtime REAL,
+    eclipse_tag TEXT,
+    description TEXT,
+    notes TEXT,
+    trial_type TEXT,
+    framerate REAL,
+    analograte REAL,
+    nframes INTEGER,
+    fp_contacts INTEGER
+);
+CREATE TABLE IF NOT EXISTS channels (
+    c3dfile TEXT REFERENCES trials(c3dfile) ON DELETE CASCADE,
+    channel TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_trials_sessionpath ON trials(sessionpath);
+CREATE INDEX IF NOT EXISTS idx_trials_eclipse_tag ON trials(eclipse_tag);
+CREATE INDEX IF NOT EXISTS idx_channels_channel ON channels(channel);
+CREATE INDEX IF NOT EXISTS idx_channels_c3dfile ON channels(c3dfile);
+"""
+
+# the columns of the trials table, in order
+_TRIAL_COLUMNS = [
+    'c3dfile',
+    'sessionpath',
+    'trialname',
+    'enffile',
+    'c3d_mtime',
+    'enf_mtime',
+    'eclipse_tag',
+    'description',
+    'notes',
+    'trial_type',
+    'framerate',
+    'analograte',
+    'nframes',
+    'fp_contacts',
+]
+
+
+def _eclipse_tag(eclipse_data):
+    """Return the first matching Eclipse tag, as gaitutils Trial.eclipse_tag"""
+    for tag in cfg.eclipse.tags:
+        if any(tag in eclipse_data[fld] for fld in cfg.eclipse.tag_keys):
+            return tag
+    return None
+
+
+def _scan_trials(rootdir):
+    """Yield (c3dfile, c3d_mtime, enffile, enf_mtime) for trials under rootdir.
+
+    enffile and enf_mtime are None if the trial has no .enf file.
+    """
+    for dirpath, _, filenames in os.walk(rootdir):
+        # the .enf files are named like trialname.Trial.enf or trialname.Trial01.enf
+        enfs = {
+            fn.split('.Trial')[0]: fn
+            for fn in filenames
+            if fn.lower().endswith('.enf') and '.Trial' in fn
+        }
+        for fn in filenames:
+            if not fn.lower().endswith('.c3d'):
+                continue
+            c3dfile = op.join(dirpath, fn)
+            trialname = op.splitext(fn)[0]
+            if (enf := enfs.get(trialname)) is not None:
+                enffile = op.join(dirpath, enf)
+                enf_mtime = os.stat(enffile).st_mtime
+            else:
+                enffile = enf_mtime = None
+            yield c3dfile, os.stat(c3dfile).st_mtime, enffile, enf_mtime
+
+
+def _read_trial_info(c3dfile, enffile=None):
+    """Read header level metadata for a trial.
+
+    Returns a dict with the trials table columns (except mtimes) and the list
+    of analog channel names under 'channels'.
+    """
+    if enffile is not None:
+        eclipse_data = eclipse.get_eclipse_keys(enffile)
+    else:
+        eclipse_data = defaultdict(lambda: '')
+    fp_keys = eclipse._eclipse_forceplate_keys(eclipse_data)
+    # only the c3d header and parameters are read, not the data
+    with LazyC3D(c3dfile) as c:
+        framerate, analograte, nframes = c.point_rate, c.analog_rate, c.nframes
+        channels = c.analog_labels
+    return {
+        'c3dfile': c3dfile,
+        'sessionpath': op.dirname(c3dfile),
+        'trialname': op.splitext(op.basename(c3dfile))[0],
+        'enffile': enffile,
+        'eclipse_tag': _eclipse_tag(eclipse_data),
+        'description': eclipse_data['DESCRIPTION'],
+        'notes': eclipse_data['NOTES'],
+        'trial_type': eclipse_data['TYPE'],
+        'framerate': framerate,
+        'analograte': analograte,
+        'nframes': nframes,
+        'fp_contacts': sum(val in ('Left', 'Right') for val in fp_keys.values()),
+        'channels': [_strip_voltage_prefix(ch) for ch in channels],
+    }
+
+
+def _under_dir(rootdir):
+    """SQL condition and parameters for selecting trials under rootdir"""
+    prefix = op.join(op.abspath(rootdir), '')
+    return 'substr(c3dfile, 1, ?) = ?', (len(prefix), prefix)
+
+
+def _read_trial_info_args(args):
+    """Wrapper for run_batch, which passes a single argument"""
+    return _read_trial_info(*args)
+
+
+class C3DCatalog:
+    """SQLite catalog of c3d trials.
+
+    Parameters
+    ----------
+    db_file : str
+        The database file. Created if it does not exist.
+    """
+
+    def __init__(self, db_file):
+        self.db_file = db_file
+        self.conn = sqlite3.connect(db_file)
+        self.conn.execute('PRAGMA foreign_keys = ON;')
+        self.conn.executescript(_SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.conn.close()
+
+    def refresh(self, rootdir, nworkers=None):
+        """Update the catalog for all trials under rootdir.
+
+        Only new trials and trials whose c3d or enf file has been modified are
+        read. Trials that no longer exist are removed from the catalog.
+
+        Returns
+        -------
+        tuple
+            Tuple of (n_updated, n_removed).
+        """
+        rootdir = op.abspath(rootdir)
+        cond, params = _under_dir(rootdir)
+        known = {
+            c3dfile: (c3d_mtime, enf_mtime)
+            for c3dfile, c3d_mtime, enf_mtime in self.conn.execute(
+                'SELECT c3dfile, c3d_mtime, enf_mtime FROM trials WHERE ' + cond, params
+            )
+        }
+        found = set()
+        todo = dict()
+        for c3dfile, c3d_mtime, enffile, enf_mtime in _scan_trials(rootdir):
+            found.add(c3dfile)
+            if known.get(c3dfile) != (c3d_mtime, enf_mtime):
+                todo[(c3dfile, enffile)] = (c3d_mtime, enf_mtime)
+        removed = set(known) - found
+
+        results, _ = run_batch(
+            _read_trial_info_args,
+            todo,
+            nworkers=nworkers,
+            skip_exceptions=(GaitDataError, C3DFormatError, OSError),
+            desc='Updating catalog',
+        )
+        with self.conn:
+            self.conn.executemany(
+                'DELETE FROM trials WHERE c3dfile = ?', [(fn,) for fn in removed]
+            )
+            for args, info in results:
+                info['c3d_mtime'], info['enf_mtime'] = todo[args]
+                self._insert(info)
+        return len(results), len(removed)
+
+    def _insert(self, info):
+        """Insert or replace a trial"""
+        self.conn.execute('DELETE FROM trials WHERE c3dfile = ?', (info['c3dfile'],))
+        self.conn.execute(
+            'INSERT INTO trials (%s) VALUES (%s)'
+            % (', '.join(_TRIAL_COLUMNS), ', '.join('?' * len(_TRIAL_COLUMNS))),
+            [info[col] for col in _TRIAL_COLUMNS],
+        )
+        self.conn.executemany(
+            'INSERT INTO channels (c3dfile, channel) VALUES (?, ?)',
+            [(info['c3dfile'], ch) for ch in info['channels']],
+        )
+
+    def query(self, sql, params=()):
+        """Run a SQL query on the catalog and return the rows"""
+        return list(self.conn.execute(sql, params))
+
+    def select(
+        self,
+        rootdir=None,
+        tags=None,
+        trial_type=None,
+        channels=None,
+        min_fp_contacts=None,
+    ):
+        """Select c3d files from the catalog.
+
+        Parameters
+        ----------
+        rootdir : str, optional
+            Only select trials under this directory.
+        tags : list, optional
+            Eclipse tags to select, e.g. ['E1', 'T1'].
+        trial_type : str, optional
+            Trial type (Eclipse TYPE field, case insensitive), e.g. 'dynamic'.
+        channels : list, optional
+            Analog channels that must be present, e.g. ['RGas', 'LGas'].
+        min_fp_contacts : int, optional
+            Minimum number of valid forceplate contacts.
+
+        Returns
+        -------
+        list
+            The c3d files, sorted.
+        """
+        conds = list()
+        params = list()
+        if rootdir is not None:
+            cond, cond_params = _under_dir(rootdir)
+            conds.append(cond)
+            params.extend(cond_params)
+        if tags:
+            tags = list(tags)
+            conds.append('eclipse_tag IN (%s)' % ', '.join('?' * len(tags)))
+            params.extend(tags)
+        if trial_type is not None:
+            conds.append('lower(trial_type) = lower(?)')
+            params.append(trial_type)
+        for ch in channels or list():
+            conds.append(
+                'EXISTS (SELECT 1 FROM channels WHERE channels.c3dfile = trials.c3dfile '
+                'AND channel = ?)'
+            )
+            params.append(ch)
+        if min_fp_contacts is not None:
+            conds.append('fp_contacts >= ?')
+            params.append(min_fp_contacts)
+        sql = 'SELECT c3dfile FROM trials'
+        if conds:
+            sql += ' WHERE ' + ' AND '.join(conds)
+        sql += ' ORDER BY c3dfile'
+        return [row[0] for row in self.conn.execute(sql, params)]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Update the c3d catalog')
+    parser.add_argument('db_file', help='catalog database file')
+    parser.add_argument('rootdir', help='directory tree to scan')
+    args = parser.parse_args()
+
+    with C3DCatalog(args.db_file) as catalog:
+        n_updated, n_removed = catalog.refresh(args.rootdir)
+        ntrials = catalog.query('SELECT COUNT(*) FROM trials')[0][0]
+    print(f'{n_updated} trials updated, {n_removed} removed, {ntrials} in catalog')
@@ -0,0 +1,355 @@
+# -*- coding: utf-8 -*-
+"""
+Lazy, memory-mapped c3d reader.
+
+Full c3d readers (btk, ezc3d) read and convert the whole data block, even if
+only one marker or a few EMG channels are needed. LazyC3D parses only the
+header and the parameter section when opened, and memory-maps the data block.
+Points and analog channels are returned as zero-copy strided views into the
+file (if the selected labels are evenly spaced in the file, e.g. consecutive;
+other selections are copied), and converted (scaled) only for the requested
+frame range:
+
+    with LazyC3D(c3dfile) as c:
+        print(c.point_rate, c.analog_rate, c.nframes, c.analog_labels)
+        rtio = c.points(['RTIO'], frames=(100, 200))['RTIO']  # (100 x 3)
+        emg = c.analog(['RGas', 'LGas'])  # dict of 1-D arrays
+        raw = c.analog_view(['RGas'])  # (nframes x samples_per_frame x 1) view
+
+Supports Intel (little-endian) and MIPS (big-endian) files with integer or
+floating point data. Analog labels can be given with or without the device
+prefix (e.g. 'Voltage.RGas' or 'RGas').
+
+requires: numpy
+"""
+
+import logging
+import struct
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_BLOCK_SIZE = 512
+# processor types in the parameter section header
+_PROC_INTEL, _PROC_DEC, _PROC_MIPS = 84, 85, 86
+# parameter data types
+_PARAM_DTYPES = {-1: 'S1', 1: 'i1', 2: 'i2', 4: 'f4'}
+
+
+class C3DFormatError(Exception):
+    """The file is not a valid (or supported) c3d file"""
+
+
+def _parse_param_value(buf, pos, dtype, dims, endian):
+    """Parse a parameter value; returns (value, new position)"""
+    n = int(np.prod(dims)) if dims else 1
+    if dtype == 'S1':
+        raw = buf[pos : pos + n]
+        pos += n
+        if not dims:
+            return raw.decode('latin-1'), pos
+        # 2-D char arrays are lists of strings (first dim is the string length)
+        strlen = dims[0]
+        if strlen == 0:
+            strs = [''] * int(np.prod(dims[1:]))
+        else:
+            strs = [
+                raw[k : k + strlen].decode('latin-1').strip()
+                for k in range(0, len(raw), strlen)
+            ]
+        if len(dims) > 1:
+            return strs, pos
+        return strs[0] if strs else '', pos
+    val = np.frombuffer(buf, dtype=endian + dtype, count=n, offset=pos)
+    pos += val.nbytes
+    if not dims:
+        return val[0].item(), pos
+    # c3d arrays are stored in Fortran order
+    return val.reshape(dims, order='F'), pos
+
+
+def _parse_parameters(buf, endian):
+    """Parse the parameter section into a dict of group: {param: value}"""
+    groups = dict()
+    group_names = dict()
+    params = list()  # (group id, name, value)
+    pos = 4
+    while pos < len(buf):
+        nchars = abs(struct.unpack_from('b', buf, pos)[0])
+        if nchars == 0:
+            break
+        gid = struct.unpack_from('b', buf, pos + 1)[0]
+        name = buf[pos + 2 : pos + 2 + nchars].decode('latin-1').upper()
+        pos_next = pos + 2 + nchars
+        offset = struct.unpack_from(endian + 'h', buf, pos_next)[0]
+        if gid < 0:
+            group_names[-gid] = name
+        else:
+            p = pos_next + 2
+            dtype = _PARAM_DTYPES[struct.unpack_from('b', buf, p)[0]]
+            ndims = buf[p + 1]
+            dims = tuple(buf[p + 2 : p + 2 + ndims])
+            value, _ = _parse_param_value(buf, p + 2 + ndims, dtype, dims, endian)
+            params.append((gid, name, value))
+        if offset == 0:
+            break
+        pos = pos_next + offset
+    for gid, name in group_names.items():
+        groups[name] = dict()
+    for gid, name, value in params:
+        groups.setdefault(group_names.get(gid, str(gid)), dict())[name] = value
+    return groups
+
+
+def _as_list(val):
+    """Convert a parameter value into a list"""
+    if isinstance(val, str):
+        return [val]
+    return list(np.atleast_1d(val))
+
+
+def _uint16(val):
+    """Interpret a (possibly negative) int16 parameter as unsigned"""
+    return int(val) % 2**16
+
+
+class LazyC3D:
+    """Lazy memory-mapped c3d file.
+
+    Parameters
+    ----------
+    filename : str
+        The c3d file.
+
+    Attributes
+    ----------
+    parameters : dict
+        The c3d parameters as a dict of group: {parameter: value}.
+    point_labels, analog_labels : list
+        The labels of the points and analog channels.
+    point_rate, analog_rate : float
+        The frame rate and analog sampling rate.
+    nframes : int
+        Number of frames.
+    first_frame : int
+        Number of the first frame (as in the file header, starting from 1).
+    samples_per_frame : int
+        Number of analog samples per frame.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as f:
+            header = f.read(_BLOCK_SIZE)
+            if len(header) < _BLOCK_SIZE or header[1] != 0x50:
+                raise C3DFormatError(f'{filename} is not a c3d file')
+            f.seek((header[0] - 1) * _BLOCK_SIZE)
+            param_header = f.read(4)
+            proctype = param_header[3]
+            if proctype == _PROC_MIPS:
+                self._endian = '>'
+            elif proctype == _PROC_INTEL:
+                self._endian = '<'
+            else:
+                raise C3DFormatError(f'{filename}: unsupported processor type {proctype}')
+            param_buf = param_header + f.read(param_header[2] * _BLOCK_SIZE - 4)
+        self.parameters = _parse_parameters(param_buf, self._endian)
+        hdr = struct.unpack_from(self._endian + 'BBhhHHhfhhf', header, 0)
+        _, _, _, _, first_frame, last_frame, _, scale, data_start, spf, rate = hdr
+
+        point = self.parameters.get('POINT', dict())
+        analog = self.parameters.get('ANALOG', dict())
+        self.point_scale = point.get('SCALE', scale)
+        self.is_float = self.point_scale < 0
+        self.point_rate = point.get('RATE', rate)
+        self.first_frame = first_frame
+        npoints = _uint16(point.get('USED', 0))
+        nanalog = _uint16(analog.get('USED', 0))
+        self.analog_rate = analog.get('RATE', 0.0)
+        self.samples_per_frame = int(round(self.analog_rate / self.point_rate)) if nanalog else 0
+        if nanalog and self.samples_per_frame == 0:
+            self.samples_per_frame = spf
+        self.point_labels = self._labels(point, 'LABELS', npoints)
+        self.analog_labels = self._labels(analog, 'LABELS', nanalog)
+        self._analog_scale = self._analog_param(analog, 'SCALE', nanalog, 1.0)
+        self._analog_offset = self._analog_param(analog, 'OFFSET', nanalog, 0.0)
+        self._analog_gen_scale = analog.get('GEN_SCALE', 1.0)
+        # integer analog data may be stored as unsigned
+        self._analog_unsigned = (
+            not self.is_float and str(analog.get('FORMAT', '')).upper() == 'UNSIGNED'
+        )
+        if self._analog_unsigned:
+            self._analog_offset %= 2**16
+
+        # the frame count in the header is limited to 16 bits; prefer the
+        # 32-bit frame numbers in the TRIAL group if present
+        trial = self.parameters.get('TRIAL', dict())
+        if 'ACTUAL_START_FIELD' in trial and 'ACTUAL_END_FIELD' in trial:
+            start = [_uint16(v) for v in _as_list(trial['ACTUAL_START_FIELD'])]
+            end = [_uint16(v) for v in _as_list(trial['ACTUAL_END_FIELD'])]
+            nframes = (end[0] + end[1] * 2**16) - (start[0] + start[1] * 2**16) + 1
+        else:
+            nframes = last_frame - first_frame + 1
+
+        # memory map the data block, one record per frame
+        fmt = self._endian + ('f4' if self.is_float else 'i2')
+        frame_dtype = np.dtype(
+            [
+                ('points', fmt, (npoints, 4)),
+                ('analog', fmt, (self.samples_per_frame, nanalog)),
+            ]
+        )
+        data_start = point.get('DATA_START', data_start)
+        offset = (_uint16(data_start) - 1) * _BLOCK_SIZE
+        filesize = self._filesize()
+        nframes = max(min(nframes, (filesize - offset) // max(frame_dtype.itemsize, 1)), 0)
+        self.nframes = nframes
+        if nframes and frame_dtype.itemsize:
+            self._data = np.memmap(
+                filename, dtype=frame_dtype, mode='r', offset=offset, shape=(nframes,)
+            )
+        else:
+            self._data = np.zeros(0, dtype=frame_dtype)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """Release the memory map.
+
+        The file stays mapped as long as any returned views exist.
+        """
+        self._data = None
+
+    def _filesize(self):
+        with open(self.filename, 'rb') as f:
+            f.seek(0, 2)
+            return f.tell()
+
+    def _labels(self, group, name, n):
+        """Read labels, including the continuation parameters (LABELS2 etc.)"""
+        labels = list()
+        k = 1
+        while len(labels) < n and (name if k == 1 else f'{name}{k}') in group:
+            labels.extend(_as_list(group[name if k == 1 else f'{name}{k}']))
+            k += 1
+        return [label.strip() for label in labels[:n]]
+
+    def _analog_param(self, group, name, n, default):
+        vals = np.array(_as_list(group.get(name, [])), dtype=float)
+        if len(vals) < n:
+            vals = np.concatenate([vals, np.full(n - len(vals), default)])
+        return vals[:n]
+
+    @staticmethod
+    def _indices(labels, wanted):
+        """Indices of wanted labels; also matches labels without device prefix"""
+        short = [label.split('.', 1)[-1] for label in labels]
+        inds = list()
+        for label in wanted:
+            if label in labels:
+                inds.append(labels.index(label))
+            elif label in short:
+                inds.append(short.index(label))
+            else:
+                raise KeyError(f'{label} not found in {labels}')
+        return inds
+
+    def _frame_slice(self, frames):
+        if frames is None:
+            return slice(0, self.nframes)
+        return slice(*frames)
+
+    @staticmethod
+    def _index_slice(inds):
+        """Slice equivalent to a list of indices, or None if there is none.
+
+        Indices in increasing order with a constant step (e.g. consecutive
+        labels) can be selected with a slice, which gives a view.
+        """
+        step = inds[1] - inds[0] if len(inds) > 1 else 1
+        if step > 0 and inds == list(range(inds[0], inds[-1] + 1, step)):
+            return slice(inds[0], inds[-1] + 1, step)
+        return None
+
+    def point_view(self, labels):
+        """Return a (nframes x npoints x 4) view of raw point data.
+
+        The view is zero-copy if the labels are at evenly spaced positions in
+        increasing order in the file (e.g. consecutive labels); otherwise the
+        selected points are copied.
+        """
+        inds = self._indices(self.point_labels, labels)
+        sl = self._index_slice(inds)
+        return self._data['points'][:, sl if sl is not None else inds, :]
+
+    def analog_view(self, labels):
+        """Return a (nframes x samples_per_frame x nchannels) view of raw analog data.
+
+        The view is zero-copy if the channels are at evenly spaced positions
+        in increasing order in the file (e.g. consecutive channels);
+        otherwise the selected channels are copied.
+        """
+        inds = self._indices(self.analog_labels, labels)
+        sl = self._index_slice(inds)
+        return self._data['analog'][:, :, sl if sl is not None else inds]
+
+    def points(self, labels, frames=None):
+        """Return point coordinates for the given labels.
+
+        Parameters
+        ----------
+        labels : list
+            The point labels.
+        frames : tuple, optional
+            Frame range (start, stop) to convert, as indices into the data
+            (starting from 0). By default, all frames.
+
+        Returns
+        -------
+        dict
+            Dict of label: (nframes x 3) array. Invalid samples are NaN.
+        """
+        sl = self._frame_slice(frames)
+        mdata = dict()
+        for label, ind in zip(labels, self._indices(self.point_labels, labels)):
+            raw = self._data['points'][sl, ind, :]
+            xyz = raw[:, :3].astype(float)
+            if not self.is_float:
+                xyz *= self.point_scale
+            resid = raw[:, 3].astype(float) if self.is_float else raw[:, 3]
+            xyz[resid < 0] = np.nan
+            mdata[label] = xyz
+        return mdata
+
+    def analog(self, labels, frames=None):
+        """Return scaled analog data for the given channels.
+
+        Parameters
+        ----------
+        labels : list
+            The channel labels, with or without device prefix.
+        frames : tuple, optional
+            Frame range (start, stop) to convert, as indices into the data
+            (starting from 0). By default, all frames.
+
+        Returns
+        -------
+        dict
+            Dict of label: 1-D array of analog samples.
+        """
+        sl = self._frame_slice(frames)
+        data = dict()
+        for label, ind in zip(labels, self._indices(self.analog_labels, labels)):
+            raw = self._data['analog'][sl, :, ind].ravel()
+            if self._analog_unsigned:
+                raw = raw.astype(float) % 2**16
+            data[label] = (
+                (raw - self._analog_offset[ind])
+                * self._analog_scale[ind]
+                * self._analog_gen_scale
+            )
+        return data
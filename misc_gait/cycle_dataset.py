@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+"""
+Chunked, compressed and appendable HDF5 dataset of normalized gait cycles.
+
+Each variable is stored as a (ncycles x npoints) dataset that is chunked by
+cycles, compressed and resizable, so new trials can be appended without
+rewriting the file. Per-cycle metadata (trial file, eclipse tag, context,
+duration and start frame) is stored in parallel columns, and reads can be restricted to one
+variable and e.g. one eclipse tag, without loading the rest of the file:
+
+    with CycleDataset('export.h5') as ds:
+        if 'foo.c3d' not in ds.trials():
+            ds.append('RKneeAnglesX', data, trial='foo.c3d', eclipse_tag='E1',
+                      context='R', duration=durations)
+        data, meta = ds.read('RKneeAnglesX', eclipse_tag='E1')
+
+With matlab=True, the file is also a MATLAB v7.3 MAT-file: in MATLAB,
+load('export.mat') gives each variable as a (npoints x ncycles) matrix, as
+with the scipy.io.savemat export, and the metadata in the struct cycle_meta
+(e.g. cycle_meta.RKneeAnglesX.trial is a char matrix with one column per
+cycle; use cellstr(x') to convert).
+
+requires: h5py, numpy
+"""
+
+import datetime
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# group for the per-cycle metadata
+META_GROUP = 'cycle_meta'
+# string metadata columns; stored as fixed width char matrices
+STR_COLUMNS = ['trial', 'eclipse_tag', 'context']
+STR_LEN = 64
+# number of cycles per chunk
+CHUNK_CYCLES = 64
+
+
+def _matlab_header():
+    """Return the 128 byte header of a MATLAB v7.3 MAT-file"""
+    created = datetime.datetime.now().strftime('%a %b %d %H:%M:%S %Y')
+    text = f'MATLAB 7.3 MAT-file, Platform: GLNXA64, Created on: {created} HDF5 schema 1.00 .'
+    return text.ljust(116).encode('ascii') + b' ' * 8 + b'\x00\x02IM'
+
+
+def _encode_strs(vals, n):
+    """Encode strings as a (n x STR_LEN) uint16 char matrix (MATLAB style)"""
+    vals = [vals] * n if isinstance(vals, str) else list(vals)
+    if len(vals) != n:
+        raise ValueError(f'need {n} values, got {len(vals)}')
+    out = np.zeros((n, STR_LEN), dtype=np.uint16)
+    for k, val in enumerate(vals):
+        codes = [ord(c) for c in str(val)[:STR_LEN]]
+        out[k, : len(codes)] = codes
+    return out
+
+
+def _decode_strs(arr):
+    """Inverse of _encode_strs()"""
+    return np.array(
+        [''.join(chr(c) for c in row if c) for row in np.asarray(arr)], dtype=str
+    )
+
+
+class CycleDataset:
+    """HDF5 dataset of normalized cycles.
+
+    Parameters
+    ----------
+    filename : str
+        The file. Created if it does not exist, otherwise opened for
+        appending.
+    matlab : bool
+        If True, create the file as a MATLAB v7.3 MAT-file. Has no effect on
+        existing files.
+    compression : str
+        HDF5 compression filter.
+    """
+
+    def __init__(self, filename, matlab=False, compression='gzip'):
+        try:
+            import h5py
+        except ImportError:
+            raise RuntimeError('HDF5 output requires h5py')
+        self.filename = filename
+        self.compression = compression
+        try:
+            self.f = h5py.File(filename, 'r+')
+        except FileNotFoundError:
+            self.f = h5py.File(filename, 'w', userblock_size=512 if matlab else 0)
+            if matlab:
+                self.f.close()
+                with open(filename, 'r+b') as f:
+                    f.write(_matlab_header())
+                self.f = h5py.File(filename, 'r+')
+        if META_GROUP not in self.f:
+            self._struct_group(self.f, META_GROUP)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.f.close()
+
+    def __contains__(self, var):
+        return var in self.f and var != META_GROUP
+
+    def keys(self):
+        """Return the variable names"""
+        return [var for var in self.f if var != META_GROUP]
+
+    @staticmethod
+    def _struct_group(parent, name):
+        grp = parent.create_group(name)
+        grp.attrs['MATLAB_class'] = np.bytes_('struct')
+        return grp
+
+    def _create_dataset(self, grp, name, shape_tail, dtype, matlab_class):
+        ds = grp.create_dataset(
+            name,
+            shape=(0,) + shape_tail,
+            maxshape=(None,) + shape_tail,
+            chunks=(CHUNK_CYCLES,) + shape_tail,
+            dtype=dtype,
+            compression=self.compression,
+        )
+        ds.attrs['MATLAB_class'] = np.bytes_(matlab_class)
+        if matlab_class == 'char':
+            ds.attrs['MATLAB_int_decode'] = np.int32(2)
+        return ds
+
+    @staticmethod
+    def _append_rows(ds, rows):
+        n = ds.shape[0]
+        ds.resize(n + len(rows), axis=0)
+        ds[n:] = rows
+
+    def _start_column(self, var):
+        """Return the start frame column of a variable, creating it if needed.
+
+        Files written before the column was added get -1 (unknown) for the
+        existing cycles.
+        """
+        meta = self.f[META_GROUP][var]
+        if 'start' not in meta:
+            ds = self._create_dataset(meta, 'start', (), np.int64, 'int64')
+            self._append_rows(ds, np.full(self.f[var].shape[0], -1, dtype=np.int64))
+        return meta['start']
+
+    def append(
+        self, var, data, trial='', eclipse_tag='', context='', duration=np.nan, start=-1
+    ):
+        """Append cycles of a variable.
+
+        Parameters
+        ----------
+        var : str
+            The variable name.
+        data : ndarray
+            A (ncycles x npoints) array of normalized cycles.
+        trial, eclipse_tag, context : str or sequence of str
+            Metadata for the cycles; a single value for all the cycles, or one
+            value per cycle.
+        duration : float or array
+            Cycle durations in seconds; a single value or one per cycle.
+        start : int or array
+            Cycle start frames (-1 if not known); a single value or one per
+            cycle.
+        """
+        data = np.atleast_2d(np.asarray(data, dtype=float))
+        ncycles, npts = data.shape
+        if var not in self.f:
+            self._create_dataset(self.f, var, (npts,), float, 'double')
+            meta = self._struct_group(self.f[META_GROUP], var)
+            for col in STR_COLUMNS:
+                self._create_dataset(meta, col, (STR_LEN,), np.uint16, 'char')
+            self._create_dataset(meta, 'duration', (), float, 'double')
+        if self.f[var].shape[1] != npts:
+            raise ValueError(f'{var}: expected {self.f[var].shape[1]} points per cycle, got {npts}')
+        meta = self.f[META_GROUP][var]
+        start_col = self._start_column(var)
+        self._append_rows(self.f[var], data)
+        cols = {'trial': trial, 'eclipse_tag': eclipse_tag, 'context': context}
+        for col, vals in cols.items():
+            self._append_rows(meta[col], _encode_strs(vals, ncycles))
+        duration = np.broadcast_to(np.asarray(duration, dtype=float), (ncycles,))
+        self._append_rows(meta['duration'], duration)
+        start = np.broadcast_to(np.asarray(start, dtype=np.int64), (ncycles,))
+        self._append_rows(start_col, start)
+
+    def append_store(self, store):
+        """Append all the cycles from a CycleStore"""
+        data, meta = store.finalize()
+        for var in data:
+            self.append(var, data[var], **meta[var])
+
+    def ncycles(self, var):
+        """Number of cycles stored for a variable"""
+        return self.f[var].shape[0] if var in self else 0
+
+    def metadata(self, var):
+        """Return the per-cycle metadata of a variable as a dict of arrays"""
+        meta = self.f[META_GROUP][var]
+        res = {col: _decode_strs(meta[col][()]) for col in STR_COLUMNS}
+        res['duration'] = meta['duration'][()]
+        if 'start' in meta:
+            res['start'] = meta['start'][()]
+        else:
+            res['start'] = np.full(len(res['duration']), -1, dtype=np.int64)
+        return res
+
+    def trials(self):
+        """Return the set of trials stored in the dataset (for any variable)"""
+        trials = set()
+        for var in self.keys():
+            trials.update(self.metadata(var)['trial'])
+        return trials
+
+    def read(self, var, **selection):
+        """Read cycles of a variable, optionally selected by metadata.
+
+        Only the matching cycles are read from the file.
+
+        Parameters
+        ----------
+        var : str
+            The variable name.
+        **selection
+            Metadata values to select, e.g. eclipse_tag='E1', context='R'.
+            Values can also be lists of accepted values.
+
+        Returns
+        -------
+        tuple
+            Tuple of (data, meta): the (ncycles x npoints) data array and the
+            per-cycle metadata for the selected cycles.
+        """
+        meta = self.metadata(var)
+        mask = np.ones(len(meta['duration']), dtype=bool)
+        for col, vals in selection.items():
+            if col not in meta:
+                raise ValueError(f'unknown metadata column {col}')
+            mask &= np.isin(meta[col], [vals] if isinstance(vals, str) else vals)
+        inds = np.flatnonzero(mask)
+        if len(inds) == len(mask):
+            data = self.f[var][()]
+        elif len(inds):
+            data = self.f[var][inds, :]
+        else:
+            data = np.zeros((0, self.f[var].shape[1]))
+        return data, {col: vals[inds] for col, vals in meta.items()}
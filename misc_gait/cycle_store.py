@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""
+Growable store for normalized gait cycle data.
+
+Accumulates cycles of each variable (e.g. from many trials) into buffers that
+grow by doubling, so appending N cycles takes O(N) time in total, instead of
+the O(N^2) of repeated np.hstack / np.concatenate. Per-cycle metadata (trial,
+context, eclipse tag, cycle duration and start frame) is kept in parallel
+arrays.
+
+Usage:
+
+    store = CycleStore()
+    for trial in trials:
+        store.append('LKneeAnglesX', data, trial='foo.c3d', context='L',
+                     eclipse_tag='E1', duration=durations)
+    data, meta = store.finalize()
+    data['LKneeAnglesX']  # (ncycles x npoints) array
+    meta['LKneeAnglesX']['duration']  # (ncycles,) array
+
+requires: numpy
+"""
+
+import numpy as np
+
+# per-cycle metadata fields and their dtypes
+META_FIELDS = {
+    'trial': str,
+    'context': str,
+    'eclipse_tag': str,
+    'duration': float,
+    'start': int,
+}
+
+
+class _GrowableArray:
+    """Array that grows along its first axis by doubling its capacity"""
+
+    def __init__(self, tail_shape=(), dtype=float, capacity=16):
+        self._buf = np.empty((capacity,) + tuple(tail_shape), dtype=dtype)
+        self.n = 0
+
+    def extend(self, rows):
+        rows = np.asarray(rows)
+        n_new = self.n + len(rows)
+        if n_new > len(self._buf):
+            capacity = max(n_new, 2 * len(self._buf))
+            buf = np.empty((capacity,) + self._buf.shape[1:], dtype=self._buf.dtype)
+            buf[: self.n] = self._buf[: self.n]
+            self._buf = buf
+        self._buf[self.n : n_new] = rows
+        self.n = n_new
+
+    def to_array(self):
+        """Return the data as a contiguous array (a copy)"""
+        return self._buf[: self.n].copy()
+
+
+class _VarStore:
+    """Cycles and metadata of a single variable"""
+
+    def __init__(self, npts):
+        self.npts = npts
+        self.data = _GrowableArray((npts,))
+        self.duration = _GrowableArray()
+        self.start = _GrowableArray(dtype=int)
+        self.str_meta = {field: list() for field, type_ in META_FIELDS.items() if type_ is str}
+
+
+class CycleStore:
+    """Accumulate normalized cycles and their metadata for multiple variables"""
+
+    def __init__(self):
+        self._vars = dict()
+
+    def __contains__(self, var):
+        return var in self._vars
+
+    def keys(self):
+        return self._vars.keys()
+
+    def ncycles(self, var):
+        """Number of cycles stored for a variable"""
+        return self._vars[var].data.n if var in self._vars else 0
+
+    def append(
+        self, var, data, trial='', context='', eclipse_tag='', duration=np.nan, start=-1
+    ):
+        """Append cycles of a variable.
+
+        Parameters
+        ----------
+        var : str
+            The variable name.
+        data : ndarray
+            A (ncycles x npoints) array of normalized cycles, or a 1-D array
+            for a single cycle. npoints must be the same for all appended
+            cycles of a variable.
+        trial, context, eclipse_tag : str or sequence of str
+            Metadata for the cycles; either a single value for all the cycles,
+            or one value per cycle.
+        duration : float or array
+            Cycle durations in seconds; a single value or one per cycle.
+        start : int or array
+            Cycle start frames (-1 if not known); a single value or one per
+            cycle. Identifies the cycles within a trial.
+        """
+        data = np.atleast_2d(data)
+        ncycles, npts = data.shape
+        if var not in self._vars:
+            self._vars[var] = _VarStore(npts)
+        vs = self._vars[var]
+        if npts != vs.npts:
+            raise ValueError(f'{var}: expected {vs.npts} points per cycle, got {npts}')
+        meta = {'trial': trial, 'context': context, 'eclipse_tag': eclipse_tag}
+        for field, val in meta.items():
+            vals = [val] * ncycles if isinstance(val, str) else list(val)
+            if len(vals) != ncycles:
+                raise ValueError(f'{var}: need {ncycles} values for {field}')
+            vs.str_meta[field].extend(vals)
+        duration = np.broadcast_to(np.asarray(duration, dtype=float), (ncycles,))
+        vs.data.extend(data)
+        vs.duration.extend(duration)
+        vs.start.extend(np.broadcast_to(np.asarray(start, dtype=int), (ncycles,)))
+
+    def finalize(self):
+        """Return the stored data as contiguous arrays.
+
+        Returns
+        -------
+        tuple
+            A tuple of (data, meta). data is a dict of (ncycles x npoints)
+            arrays keyed by variable. meta is a dict keyed by variable, whose
+            values are dicts of per-cycle metadata arrays (see META_FIELDS).
+        """
+        data = dict()
+        meta = dict()
+        for var, vs in self._vars.items():
+            data[var] = vs.data.to_array()
+            meta[var] = {field: np.array(vals, dtype=str) for field, vals in vs.str_meta.items()}
+            meta[var]['duration'] = vs.duration.to_array()
+            meta[var]['start'] = vs.start.to_array()
+        return data, meta
@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+"""
+Lazily computed derived variables for normalized cycle data.
+
+Derived variables (time derivatives, integrals, sums and differences of model
+or EMG variables) are declared once in a DerivedVars registry. Binding the
+registry to cycle data gives a mapping that computes each derived variable on
+first access, vectorized over all cycles, and memoizes it:
+
+    derived = DerivedVars()
+    derived.derivative('RSoleLength')  # declares RSoleLength_dt
+    derived.difference('RKneeAnglesX', 'RAnkleAnglesX', 'RKneeMinusAnkle')
+    cvars = derived.bind(data, meta)  # e.g. from CycleStore.finalize()
+    cvars['RSoleLength_dt']  # computed on first access
+
+The time scale of each cycle comes from its real duration (the 'duration'
+metadata, in seconds), so the results stay aligned with the cycles. Variables
+computed from several inputs (sums, differences) require that the inputs have
+the same cycles, i.e. identical per-cycle metadata (trial, context, cycle
+start frame etc.). In addition to the declared variables, any variable name
+with a '_dt' or '_int' suffix resolves to the derivative or integral of the
+base variable.
+
+Time derivatives are forward differences by default, with one point less
+than the input (as in the earlier MATLAB exports); central differences, which
+keep the number of points, can be declared with derivative(var,
+central=True).
+
+requires: numpy
+"""
+
+from collections.abc import Mapping
+import numpy as np
+
+
+def _sample_interval(data, duration):
+    """Per-cycle sample interval (seconds) as a column vector"""
+    npts = data.shape[1]
+    return (np.asarray(duration, dtype=float) / (npts - 1))[:, np.newaxis]
+
+
+def time_derivative(data, duration):
+    """Time derivative of (ncycles x npoints) cycle data.
+
+    Uses forward differences (np.diff), so the result has npoints - 1 points.
+    The sample interval is taken as duration / npoints, which is what the
+    earlier MATLAB exports used; keep it that way for compatibility.
+    """
+    dt = (np.asarray(duration, dtype=float) / data.shape[1])[:, np.newaxis]
+    return np.diff(data, axis=1) / dt
+
+
+def time_derivative_central(data, duration):
+    """Time derivative of (ncycles x npoints) cycle data.
+
+    Uses central differences (np.gradient), so the number of points is
+    preserved.
+    """
+    dt = _sample_interval(data, duration)
+    return np.gradient(data, axis=1) / dt
+
+
+def time_integral(data, duration):
+    """Cumulative time integral (trapezoidal) of (ncycles x npoints) cycle data"""
+    dt = _sample_interval(data, duration)
+    areas = (data[:, 1:] + data[:, :-1]) / 2 * dt
+    return np.concatenate([np.zeros((len(data), 1)), np.cumsum(areas, axis=1)], axis=1)
+
+
+# derived variables that are available for any variable, by suffix
+SUFFIX_RULES = {
+    '_dt': time_derivative,
+    '_int': time_integral,
+}
+
+
+class DerivedVars:
+    """Registry of derived variable definitions"""
+
+    def __init__(self):
+        # name -> (func, inputs, uses_duration)
+        self._defs = dict()
+
+    def __contains__(self, name):
+        return name in self._defs
+
+    def names(self):
+        """Return the names of the declared variables"""
+        return list(self._defs)
+
+    def define(self, name, func, inputs, uses_duration=False):
+        """Declare a derived variable.
+
+        Parameters
+        ----------
+        name : str
+            Name of the derived variable.
+        func : callable
+            Function computing the variable from the (ncycles x npoints)
+            input arrays, in order. If uses_duration is True, the cycle
+            durations are passed as the last argument.
+        inputs : list
+            Names of the input variables (which may be derived too).
+        uses_duration : bool
+            Whether func needs the cycle durations.
+        """
+        self._defs[name] = (func, list(inputs), uses_duration)
+        return name
+
+    def derivative(self, var, name=None, central=False):
+        """Declare the time derivative of var (default name var_dt).
+
+        By default, forward differences are used (one point less than var);
+        with central=True, central differences (same number of points).
+        """
+        func = time_derivative_central if central else time_derivative
+        return self.define(name or var + '_dt', func, [var], uses_duration=True)
+
+    def integral(self, var, name=None):
+        """Declare the cumulative time integral of var (default name var_int)"""
+        return self.define(name or var + '_int', time_integral, [var], uses_duration=True)
+
+    def sum(self, var1, var2, name):
+        """Declare the sum of two variables"""
+        return self.define(name, np.add, [var1, var2])
+
+    def difference(self, var1, var2, name):
+        """Declare the difference var1 - var2"""
+        return self.define(name, np.subtract, [var1, var2])
+
+    def _resolve(self, name):
+        """Return the definition of name, or None if it cannot be derived"""
+        if name in self._defs:
+            return self._defs[name]
+        for suffix, func in SUFFIX_RULES.items():
+            if name.endswith(suffix) and len(name) > len(suffix):
+                return func, [name[: -len(suffix)]], True
+        return None
+
+    def bind(self, data, meta):
+        """Bind the definitions to cycle data.
+
+        Parameters
+        ----------
+        data : dict
+            The (ncycles x npoints) arrays of the base variables.
+        meta : dict
+            The per-cycle metadata for each variable; must include 'duration'
+            (see CycleStore.finalize()).
+
+        Returns
+        -------
+        CycleVars
+            Mapping of all the base and derived variables.
+        """
+        return CycleVars(self, data, meta)
+
+
+class CycleVars(Mapping):
+    """Base and lazily computed derived variables for a set of cycles.
+
+    Use DerivedVars.bind() to create instances.
+    """
+
+    def __init__(self, registry, data, meta):
+        self._registry = registry
+        self._data = data
+        self._meta = meta
+        self._memo = dict()
+        self._memo_meta = dict()
+
+    def __getitem__(self, name):
+        if name in self._data:
+            return self._data[name]
+        if name not in self._memo:
+            self._memo[name] = self._compute(name)
+        return self._memo[name]
+
+    def _compute(self, name):
+        if (definition := self._registry._resolve(name)) is None:
+            raise KeyError(name)
+        func, inputs, uses_duration = definition
+        args = [self[var] for var in inputs]
+        self._check_aligned(name, inputs)
+        # the derived variable has the cycles (and metadata) of its first input
+        self._memo_meta[name] = self.meta(inputs[0])
+        if uses_duration:
+            args.append(self._memo_meta[name]['duration'])
+        return func(*args)
+
+    def _check_aligned(self, name, inputs):
+        """Check that the inputs have the same cycles (identical metadata)"""
+        meta0 = self.meta(inputs[0])
+        for var in inputs[1:]:
+            meta = self.meta(var)
+            if len(meta0['duration']) != len(meta['duration']):
+                raise ValueError(
+                    f'{name}: inputs {inputs[0]} and {var} have different numbers of cycles'
+                )
+            for field in meta0.keys() & meta.keys():
+                vals0, vals = np.asarray(meta0[field]), np.asarray(meta[field])
+                equal_nan = vals0.dtype.kind == 'f' and vals.dtype.kind == 'f'
+                if not np.array_equal(vals0, vals, equal_nan=equal_nan):
+                    raise ValueError(
+                        f'{name}: inputs {inputs[0]} and {var} have different cycles '
+                        f'({field} differs)'
+                    )
+
+    def meta(self, name):
+        """Return the per-cycle metadata of a variable"""
+        if name in self._meta:
+            return self._meta[name]
+        if name not in self._memo_meta:
+            self[name]
+        return self._memo_meta[name]
+
+    def can_compute(self, name):
+        """Whether name is available (as base variable or derivable from them)"""
+        if name in self._data or name in self._memo:
+            return True
+        definition = self._registry._resolve(name)
+        return definition is not None and all(self.can_compute(var) for var in definition[1])
+
+    def derived(self):
+        """Return dict of all the declared variables that can be computed"""
+        return {
+            name: self[name] for name in self._registry.names() if self.can_compute(name)
+        }
+
+    def __iter__(self):
+        yield from self._data
+        yield from (
+            name
+            for name in self._registry.names()
+            if name not in self._data and self.can_compute(name)
+        )
+
+    def __len__(self):
+        return len(list(iter(self)))
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+"""
+Replay a c3d file through the streaming (causal) EMG envelope, as if the data
+were arriving live during capture.
+
+Reports the per-chunk processing time and compares the streamed envelope
+(with and without the zero-phase correction) against the offline zero-phase
+envelope from linear_envelope().
+
+requires: gaitutils, numpy, scipy
+"""
+
+import sys
+import time
+import numpy as np
+
+from emg_envelope import StreamingEnvelope, linear_envelope, read_emg_c3d, replay_c3d
+
+# analog samples per chunk; e.g. 200 samples = 100 ms at 2 kHz
+CHUNK_SIZE = 200
+
+
+def replay(c3dfile, chunk_size=CHUNK_SIZE):
+    """Replay c3dfile through StreamingEnvelope and print statistics"""
+    emg, emgrate, nframes = read_emg_c3d(c3dfile)
+    samples_per_frame = round(emg.data.shape[1] / nframes)
+    stream = StreamingEnvelope(emg.chnames, emgrate, samples_per_frame)
+    times = list()
+    for chunk in replay_c3d(c3dfile, chunk_size=chunk_size):
+        t0 = time.perf_counter()
+        stream.process(chunk)
+        times.append(time.perf_counter() - t0)
+    times = 1e3 * np.array(times)
+    print(f'{len(times)} chunks of {chunk_size} samples ({1e3 * chunk_size / emgrate:.0f} ms)')
+    print(f'processing time per chunk: mean {times.mean():.3f} ms, max {times.max():.3f} ms')
+
+    env_offline = linear_envelope(emg, emgrate, nframes)
+    for zero_phase in (False, True):
+        env = stream.finish(zero_phase=zero_phase)
+        n = min(env.data.shape[1], env_offline.data.shape[1])
+        print(f'zero_phase={zero_phase}:')
+        for ch in env.chnames:
+            r = np.corrcoef(env[ch][:n], env_offline[ch][:n])[0, 1]
+            print(f'  {ch}: correlation with offline envelope {r:.3f}')
+
+
+if __name__ == '__main__':
+    replay(sys.argv[1])
@@ -8,7 +8,6 @@ compute foot speed at n frames before foot strike
 """
 
 from time import localtime, strftime
-from openpyxl import Workbook
 import numpy as np
 import glob
 import os.path as op
@@ -16,18 +15,8 @@ import os.path as op
 import gaitutils
 from gaitutils import read_data
 
-
-def write_workbook_rows(results, filename, first_col=1, first_row=1):
-    """Write results into .xlsx file (filename). results must be a list of
-    lists which represent the rows to write. first_col and first_row
-    specify the column and row where to start writing (1-based) """
-    wb = Workbook()
-    ws1 = wb.active
-    ws1.title = "Foot speed analysis"
-    for j, row in enumerate(results):
-        for k, val in enumerate(row):
-            ws1.cell(column=k+1+first_col, row=j+1+first_row, value=val)
-    wb.save(filename=filename)
+from batch import run_batch
+from table_output import write_rows
 
 
 # name files according to script start time
@@ -37,6 +26,8 @@ rootdir = u'Z:/siirto/Running/'
 outfile = op.join(rootdir, 'foot_speed_%s.xlsx' % timestr_)
 glob_ = '*.c3d'
 files = glob.glob(op.join(rootdir + glob_))
+# number of worker processes; None = use all cores, 1 = no multiprocessing
+NWORKERS = None
 
 # how many frames before strike to include
 nframes = 4
@@ -54,15 +45,22 @@ def _get_comp_values(c3dfile):
     vel[mdata['RTIO_gaps']] = np.nan
 
     strikes = np.array(tr.rstrikes) - tr.offset
-    print c3dfile
+    print(c3dfile)
 
     for k, strike in enumerate(strikes):
         frames = np.arange(strike-nframes, strike)
         yield [c3dfile, 'strike %d' % (k+1)] + list(vel_conv * vel[frames])
 
 
-results = list()
-for c3dfile in files:
-    results.extend(list(_get_comp_values(c3dfile)))
+def _get_comp_rows(c3dfile):
+    """Return result rows for a c3d file"""
+    return list(_get_comp_values(c3dfile))
+
+
+if __name__ == '__main__':
+    results = list()
+    file_results, _ = run_batch(_get_comp_rows, files, nworkers=NWORKERS)
+    for c3dfile, rows in file_results:
+        results.extend(rows)
 
-write_workbook_rows(results, outfile)
+    write_rows(outfile, results, title='Foot speed analysis', first_row=1, first_col=1)
@@ -12,34 +12,21 @@ running analysis
 """
 
 from time import localtime, strftime
-from openpyxl import Workbook
 import numpy as np
 from numpy.linalg import norm
 import glob
 import os.path as op
 import logging
 
-import gaitutils
-from gaitutils import read_data
+from batch import run_batch
+from table_output import write_rows
+from trial_loader import load_trial
 
 
 # name files according to script start time
 timestr_ = strftime("%Y_%m_%d-%H%M%S", localtime())
 
 
-def write_workbook_rows(results, filename, first_col=1, first_row=1):
-    """Write results into .xlsx file (filename). results must be a list of
-    lists which represent the rows to write. first_col and first_row
-    specify the column and row where to start writing (1-based) """
-    wb = Workbook()
-    ws1 = wb.active
-    ws1.title = "Running compression analysis"
-    for j, row in enumerate(results):
-        for k, val in enumerate(row):
-            ws1.cell(column=k+1+first_col, row=j+1+first_row, value=val)
-    wb.save(filename=filename)
-
-
 # Excel header row (variable titles)
 header = ['filename', 'gait cycle', 'frame of max compression',
           'max. compression (mm)', 'forceplate id',
@@ -54,6 +41,8 @@ outfile = op.join(rootdir, 'foot_force_at_max_compression_%s.xlsx' % timestr_)
 glob_ = '*.c3d'
 context = 'R'
 files = glob.glob(op.join(rootdir + glob_))
+# number of worker processes; None = use all cores, 1 = no multiprocessing
+NWORKERS = None
 
 
 def _stringify(v):
@@ -67,8 +56,10 @@ def _get_comp_values(c3dfile):
 
     hip_ctr = context+'FEP'
     ank_ctr = context+'TIO'
-    mdata = read_data.get_marker_data(c3dfile, [hip_ctr, ank_ctr])
-    tr = gaitutils.Trial(c3dfile)
+    # markers, cycles and forceplate data from a single parse of the c3d file
+    loaded = load_trial(c3dfile)
+    mdata = loaded.marker_data([hip_ctr, ank_ctr])
+    tr = loaded.trial
 
     # ankle joint - hip joint distance
     jnt_vec = mdata[hip_ctr+'_P'] - mdata[ank_ctr+'_P']
@@ -102,12 +93,23 @@ def _get_comp_values(c3dfile):
                norm(fvec_at_min_comp), norm(fproj), fx, fy, fz)
 
 
+def _get_comp_rows(c3dfile):
+    """Return stringified result rows for a c3d file"""
+    return [[_stringify(v) for v in vals] for vals in _get_comp_values(c3dfile)]
+
+
 if __name__ == '__main__':
     logging.basicConfig(level=logging.DEBUG)
     results = list()
-    results.append(header)
-    for c3dfile in files:
-        for vals in _get_comp_values(c3dfile):
-            results.append([_stringify(v) for v in vals])
-
-    write_workbook_rows(results, outfile)
+    file_results, _ = run_batch(_get_comp_rows, files, nworkers=NWORKERS)
+    for c3dfile, rows in file_results:
+        results.extend(rows)
+
+    write_rows(
+        outfile,
+        results,
+        title='Running compression analysis',
+        columns=header,
+        first_row=1,
+        first_col=1,
+    )
@@ -11,11 +11,9 @@ once (for a single subject).
 import os
 from pathlib import Path
 import shutil
-import numpy as np
 import time
 import logging
 import datetime
-import sqlite3
 
 
 import gaitutils
@@ -24,15 +22,15 @@ from gaitutils import (
     nexus,
     cfg,
     autoprocess,
-    trial,
-    videos,
     GaitDataError,
 )
-from gaitutils.report import web, pdf
 from ulstools.num import check_hetu
 
-# how many trials to tag per context
-MAX_TAGS_PER_CONTEXT = 3
+from autoproc_stages import run_stages
+from patient_db import PatientDB
+from review_sessions import review_sessions
+from session_copy import check_report
+
 # root dir for copy destination
 DEST_ROOT = Path(r'Y:\Userdata_Vicon_Server')
 # diag-specific subdirs
@@ -48,45 +46,6 @@ DIAGS_DIRS = {
 #logging.basicConfig(level=logging.DEBUG)
 
 
-def _count_fp_contacts(trial):
-    """Return n of valid forceplate contacts"""
-    return len(trial.fp_events['L_strikes']) + len(trial.fp_events['R_strikes'])
-
-
-def _gait_direction(enffile):
-    """Quick and dirty gait direction from enffile, after autoprocessing.
-
-    XXX: fragile, relies on certain description string.
-    """
-    keys = gaitutils.eclipse.get_eclipse_keys(enffile, 'Description')
-    thedesc = keys['DESCRIPTION']
-    for dir in 'ET':
-        if dir in thedesc:
-            return dir
-    return None
-
-
-def _autotag(sessiondir):
-    """Automatically tag trials in a session dir"""
-    c3dfiles = gaitutils.sessionutils.get_c3ds(sessiondir, trial_type='dynamic')
-    trials = [trial.Trial(c3dfile) for c3dfile in c3dfiles]
-    enffiles = [tr.enfpath for tr in trials]
-
-    for direction in 'ET':
-        enfs_thisdir = [
-            (k, enffile)
-            for (k, enffile) in enumerate(enffiles)
-            if _gait_direction(enffile) == direction
-        ]
-        n_contacts = [_count_fp_contacts(trials[k]) for k, _ in enfs_thisdir]
-        best_inds = np.argsort(-np.array(n_contacts))
-        bestfiles = [enfs_thisdir[k][1] for k in best_inds]
-        for k, enffile in enumerate(bestfiles[:MAX_TAGS_PER_CONTEXT], 1):
-            gaitutils.eclipse.set_eclipse_keys(
-                enffile, {'NOTES': direction + str(k)}, update_existing=True
-            )
-
-
 def _get_patient_dir():
     """Get patient dir (session root). Must currently be in a session."""
     if not (cwd := gaitutils.nexus.get_sessionpath()):
@@ -176,8 +135,8 @@ print('*** autoproc complete')
 
 # %%
 # 3: autotag all
-for p in session_dirs:
-    _autotag(p)
+# Nexus is not needed, so the sessions are processed in parallel
+run_stages(['autotag'], session_dirs)
 print('*** autotag complete')
 
 
@@ -185,12 +144,13 @@ print('*** autotag complete')
 # %%
 # 4: review the data
 REVIEW_BACKEND = 'plotly'
+# each session is loaded only once for all the layouts
+review_figs = review_sessions(
+    session_dirs, cfg.plot.review_layouts, backend=REVIEW_BACKEND
+)
 for p in session_dirs:
     for lout in cfg.plot.review_layouts:
-        fig = gaitutils.viz.plots._plot_sessions(
-            p, layout=lout, backend=REVIEW_BACKEND, figtitle=p.name
-        )
-        gaitutils.viz.plot_misc.show_fig(fig)
+        gaitutils.viz.plot_misc.show_fig(review_figs[p][lout])
 
 
 # %%
@@ -223,15 +183,13 @@ print('*** Finished postprocessing pipelines')
 
 db_file = Path(r'Z:\gaitbase\patients.db')
 
-conn = sqlite3.connect(db_file)
-conn.execute('PRAGMA foreign_keys = ON;')
-p = list(conn.execute(f"SELECT * from patients WHERE patient_code='{patient_code}'"))
-conn.close()
+with PatientDB(db_file) as db:
+    patient = db.find_patient(patient_code)
 
-if p:
-    print(f'found patient in database: {p[0]}')
-    _, firstname, lastname, hetu, _, _ = p[0]
-    patient_name = f'{firstname} {lastname}'
+if patient:
+    print(f'found patient in database: {dict(patient)}')
+    patient_name = f"{patient['firstname']} {patient['lastname']}"
+    hetu = patient['ssn']
 else:
     patient_name = input('Please enter patient name:')
     prompt = 'Please enter hetu:'
@@ -247,37 +205,16 @@ for d in session_dirs:
 
 # 7: generate reports
 for sessiondir in session_dirs:
-
     info = {
         'fullname': patient_name,
         'hetu': hetu,
         'session_description': session_desc[sessiondir],
     }
     sessionutils.save_info(sessiondir, info)
-    if not (
-        vidfiles := videos._collect_session_videos(sessiondir, tags=cfg.eclipse.tags)
-    ):
-        raise RuntimeError(f'Cannot find any video files for session {sessiondir}')
-
-    if not videos.convert_videos(vidfiles, check_only=True):
-        # need to convert
-        if not (procs := videos.convert_videos(vidfiles=vidfiles)):
-            raise RuntimeError('video converter processes could not be started')
-
-        # wait in a sleep loop until all converter processes have finished
-        completed = False
-        _n_complete = -1
-        while not completed:
-            n_complete = len([p for p in procs if p.poll() is not None])
-            prog_txt = f'Converting videos: {n_complete} of {len(procs)} files done'
-            if _n_complete != n_complete:
-                print(prog_txt)
-                _n_complete = n_complete
-            time.sleep(1)
-            completed = n_complete == len(procs)
-
-    web.dash_report(sessions=[sessiondir], info=info, recreate_plots=True)
-    pdf.create_report(sessiondir, info, write_extracted=True, write_timedist=True)
+
+# video conversion and reports for all sessions in parallel; the reports read
+# the patient info saved above
+run_stages(['videos', 'reports'], session_dirs)
 
 print('*** Finished reports')
 
@@ -289,14 +226,10 @@ print('*** Finished reports')
 nexus._kill_nexus()
 
 copy_done = False
-for sessiondir in session_dirs:
-    destdir = destdir_patient / sessiondir.name
-    print(f'copying {sessiondir} -> {destdir}...')
-    shutil.copytree(sessiondir, destdir)
-    assert destdir.is_dir()
-copy_done = True
+run_stages(['copy'], session_dirs, dest_root=destdir_patient)
+# the copies are verified against the copy manifests (see session_copy.py)
+copy_done = all(check_report(sessiondir) for sessiondir in session_dirs)
 
-# FIXME: should assert that copy really worked?
 print('*** Finished copying')
 
 
@@ -305,6 +238,8 @@ print('*** Finished copying')
 # set ALLOW_DELETE manually
 if copy_done and ALLOW_DELETE:
     assert rootdir.parent == Path('D:/ViconData/Clinical')
+    # require a verified copy report that still matches the local data
+    assert all(check_report(sessiondir) for sessiondir in session_dirs)
     shutil.rmtree(rootdir)
 
 
@@ -312,25 +247,6 @@ if copy_done and ALLOW_DELETE:
 
 REDO_ALL = True  # force conversion even if target files exist
 
-for sessiondir in session_dirs:
-    vidfiles = videos._collect_session_videos(sessiondir, tags=cfg.eclipse.tags)
-    if not vidfiles:
-        raise RuntimeError(f'Cannot find any video files for session {sessiondir}')
-
-    if REDO_ALL or not videos.convert_videos(vidfiles, check_only=True):
-        procs = videos.convert_videos(vidfiles=vidfiles)
-        if not procs:
-            raise RuntimeError('Video converter processes could not be started')
-        # wait in sleep loop until all converter processes have finished
-        completed = False
-        _n_complete = -1
-        while not completed:
-            n_complete = len([p for p in procs if p.poll() is not None])
-            prog_txt = f'Converting videos: {n_complete} of {len(procs)} files done'
-            if _n_complete != n_complete:
-                print(prog_txt)
-                _n_complete = n_complete
-            time.sleep(1)
-            completed = n_complete == len(procs)
+run_stages(['videos'], session_dirs, redo_videos=REDO_ALL)
 
 print('*** Finished video conversion')
@@ -10,7 +10,6 @@ distance hip joint center - ankle joint center
 """
 
 from time import localtime, strftime
-from openpyxl import Workbook
 import numpy as np
 import glob
 import os.path as op
@@ -18,28 +17,20 @@ import os.path as op
 import gaitutils
 from gaitutils import read_data
 
+from batch import run_batch
+from table_output import write_rows
+
 
 # name files according to script start time
 timestr_ = strftime("%Y_%m_%d-%H%M%S", localtime())
 
 
-def write_workbook_rows(results, filename, first_col=1, first_row=1):
-    """Write results into .xlsx file (filename). results must be a list of
-    lists which represent the rows to write. first_col and first_row
-    specify the column and row where to start writing (1-based) """
-    wb = Workbook()
-    ws1 = wb.active
-    ws1.title = "Running compression analysis"
-    for j, row in enumerate(results):
-        for k, val in enumerate(row):
-            ws1.cell(column=k+1+first_col, row=j+1+first_row, value=val)
-    wb.save(filename=filename)
-
-
 rootdir = u'Z:/siirto/Running/'
 outfile = op.join(rootdir, 'foot_compression_%s.xlsx' % timestr_)
 glob_ = '*.c3d'
 files = glob.glob(op.join(rootdir + glob_))
+# number of worker processes; None = use all cores, 1 = no multiprocessing
+NWORKERS = None
 
 
 def _get_comp_values(c3dfile):
@@ -55,7 +46,7 @@ def _get_comp_values(c3dfile):
     strikes = np.array(tr.rstrikes) - tr.offset
     toeoffs = np.array(tr.rtoeoffs) - tr.offset
 
-    print c3dfile
+    print(c3dfile)
 
     lens = list()
     for strike in strikes:
@@ -66,13 +57,17 @@ def _get_comp_values(c3dfile):
         toeoff = toeoff_cands[0]
         min_len = dist[strike:toeoff].min()
         strike_len = dist[strike]
-        print strike, toeoff, strike_len, min_len
+        print(strike, toeoff, strike_len, min_len)
         lens.append(strike_len - min_len)
     return lens
 
 
-results = list()
-for c3dfile in files:
-    results.append([c3dfile] + _get_comp_values(c3dfile))
+if __name__ == '__main__':
+    results = list()
+    file_results, _ = run_batch(_get_comp_values, files, nworkers=NWORKERS)
+    for c3dfile, lens in file_results:
+        results.append([c3dfile] + lens)
 
-write_workbook_rows(results, outfile)
+    write_rows(
+        outfile, results, title='Running compression analysis', first_row=1, first_col=1
+    )
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming computation of EMG reference (e.g. MVC) values.
+
+The reference value of a channel is the maximum of the sliding window mean of
+its envelope over all the reference trials. Trials are consumed one at a time
+and only the running maxima are kept, so the reference data is never held in
+memory all at once. Each trial is windowed separately, so the windows do not
+span the seams between trials.
+
+Usage:
+
+    mvc = MVCReference(win_len=2, margin=2)
+    for trial in mvc_trials:
+        mvc.add_trial({ch: trial.get_emg_data(ch, envelope=True)[1] for ch in chs},
+                      trial.emg.sfrate)
+    emg_mvc_max = mvc.maxima()
+
+requires: numpy
+"""
+
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def max_window_mean(data, win):
+    """Return the maximum of the sliding window mean of data.
+
+    Computed from cumulative sums, so the cost does not depend on the window
+    length. Only full windows are considered; returns None if the data is
+    shorter than the window.
+    """
+    data = np.asarray(data, dtype=float)
+    if win < 1 or len(data) < win:
+        return None
+    csum = np.concatenate(([0.0], np.cumsum(data)))
+    return (csum[win:] - csum[:-win]).max() / win
+
+
+class MVCReference:
+    """Running maxima of the sliding window mean, per channel.
+
+    Parameters
+    ----------
+    win_len : float
+        Length of the averaging window (seconds).
+    margin : float
+        Length of data to discard from the beginning and end of each trial
+        (seconds).
+    """
+
+    def __init__(self, win_len, margin=0):
+        self.win_len = win_len
+        self.margin = margin
+        self.sfrate = None
+        self.ntrials = 0
+        self._max = dict()
+
+    def add_trial(self, emg_data, sfrate):
+        """Update the maxima with data from one trial.
+
+        Parameters
+        ----------
+        emg_data : dict
+            The EMG envelope data for each channel (1-D arrays).
+        sfrate : float
+            The sampling rate. All trials must have the same sampling rate.
+        """
+        if self.sfrate is None:
+            self.sfrate = sfrate
+        elif sfrate != self.sfrate:
+            raise ValueError(f'sampling rate mismatch: {sfrate} vs {self.sfrate}')
+        marg = round(self.margin * sfrate)
+        win = round(self.win_len * sfrate)
+        for ch, data in emg_data.items():
+            data = data[marg : len(data) - marg]
+            if (val := max_window_mean(data, win)) is None:
+                logger.warning(f'{ch}: trial too short for the averaging window, skipping')
+                continue
+            self._max[ch] = max(self._max.get(ch, -np.inf), val)
+        self.ntrials += 1
+
+    def maxima(self):
+        """Return the reference values as a dict of channel: value"""
+        return dict(self._max)
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""
+Read-through cache for the Nexus SDK data accessors.
+
+Every Nexus SDK call is a slow cross-process round trip. CachedNexus wraps a
+ViconNexus instance and fetches each piece of data (model outputs,
+trajectories, device data etc.) only once per trial:
+
+    vicon = CachedNexus(nexus.viconnexus())
+    vicon.open_trial(c3dfile)  # also clears the cache
+    nums, exists = vicon.GetModelOutput(subj, var)  # fetched from Nexus
+    nums, exists = vicon.GetModelOutput(subj, var)  # from cache
+    print(vicon.hits, vicon.misses)
+
+Calls to Get* and Has* methods are cached by their arguments (positional and
+keyword); calls with unhashable arguments are passed through uncached. Writes through
+SetModelOutput / CreateModelOutput invalidate the affected entries, and any
+other call (OpenTrial, RunPipeline etc.) clears the whole cache, since it may
+change the data. Cached values are shared between callers and must not be
+modified in place.
+
+The wrapper can be passed to the gaitutils.nexus helper functions (e.g.
+_get_emg_data, _get_metadata), but not to Trial, which expects a real
+ViconNexus instance.
+
+requires: gaitutils
+"""
+
+import functools
+import logging
+
+logger = logging.getLogger(__name__)
+
+# prefixes of SDK methods that only read data
+_READ_PREFIXES = ('Get', 'Has')
+
+
+class CachedNexus:
+    """Read-through cache around a ViconNexus instance.
+
+    Parameters
+    ----------
+    vicon : ViconNexus
+        The Nexus SDK object.
+    """
+
+    def __init__(self, vicon):
+        self._vicon = vicon
+        self._cache = dict()
+        self.hits = 0
+        self.misses = 0
+
+    def clear(self):
+        """Clear the cache"""
+        self._cache.clear()
+
+    def open_trial(self, trialpath):
+        """Open a trial in Nexus and clear the cache"""
+        from gaitutils import nexus
+
+        self.clear()
+        nexus._open_trial(trialpath)
+
+    def _invalidate(self, method, *args):
+        """Delete cached entries of method whose arguments start with args"""
+        for key in [key for key in self._cache if key[0] == method]:
+            if key[1][: len(args)] == args:
+                del self._cache[key]
+
+    def _cached_call(self, method, *args, **kwargs):
+        key = (method, args, tuple(sorted(kwargs.items())))
+        try:
+            result = self._cache[key]
+            self.hits += 1
+        except KeyError:
+            result = getattr(self._vicon, method)(*args, **kwargs)
+            self._cache[key] = result
+            self.misses += 1
+        except TypeError:  # unhashable arguments
+            logger.debug(f'{method}: unhashable arguments, not cached')
+            result = getattr(self._vicon, method)(*args, **kwargs)
+            self.misses += 1
+        return result
+
+    def SetModelOutput(self, subj, var, *args):
+        self._invalidate('GetModelOutput', subj, var)
+        return self._vicon.SetModelOutput(subj, var, *args)
+
+    def CreateModelOutput(self, subj, var, *args):
+        self._invalidate('GetModelOutputNames', subj)
+        self._invalidate('GetModelOutputDetails', subj, var)
+        return self._vicon.CreateModelOutput(subj, var, *args)
+
+    def __getattr__(self, name):
+        attr = getattr(self._vicon, name)
+        if not callable(attr):
+            return attr
+        if name.startswith(_READ_PREFIXES):
+            return functools.partial(self._cached_call, name)
+
+        @functools.wraps(attr)
+        def _uncached(*args, **kwargs):
+            logger.debug(f'{name} called, clearing Nexus cache')
+            self.clear()
+            return attr(*args, **kwargs)
+
+        return _uncached
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""
+Access to the gaitbase patient database (patients.db).
+
+PatientDB keeps a single read-only connection open and uses parameterized
+queries only (sqlite3 caches the prepared statements per connection). The
+database belongs to the gaitbase application, so it is never modified by
+PatientDB. The birth date derived from the hetu (ssn column) is available in
+queries as the birth_date column of the temporary view patients_v (ISO
+format, e.g. '2012-06-30'). The view only exists for the connection. Age-window
+cohort selection runs in SQL:
+
+    with PatientDB(DB_FILE) as db:
+        patient = db.find_patient('H123')
+        df = db.select_cohort(6, 15, '120625', '010925', code_types=['H', 'C'])
+
+The queries are faster with indexes on patient_code and on the birth date.
+These can be created once, when gaitbase is not in use, by calling
+create_indexes() or from the command line:
+
+    python patient_db.py DB_FILE --create-indexes
+
+requires: pandas (for select_cohort)
+"""
+
+import argparse
+import datetime
+import logging
+import sqlite3
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# birth date (YYYY-MM-DD) from a hetu DDMMYYCZZZQ; the century sign C is '+'
+# for 1800s, '-' (or Y, X, W, V, U) for 1900s and A (or B-F) for 2000s
+BIRTH_DATE_SQL = """(
+    CASE
+        WHEN substr(ssn, 7, 1) = '+' THEN '18'
+        WHEN substr(ssn, 7, 1) IN ('-', 'Y', 'X', 'W', 'V', 'U') THEN '19'
+        WHEN substr(ssn, 7, 1) IN ('A', 'B', 'C', 'D', 'E', 'F') THEN '20'
+    END
+    || substr(ssn, 5, 2) || '-' || substr(ssn, 3, 2) || '-' || substr(ssn, 1, 2)
+)"""
+
+
+def _age_sql(ref_param):
+    """SQL expression for the age in full years at the date given by a named parameter"""
+    return f"""(
+        CAST(substr(:{ref_param}, 1, 4) AS INTEGER)
+        - CAST(substr(birth_date, 1, 4) AS INTEGER)
+        - (substr(:{ref_param}, 6, 5) < substr(birth_date, 6, 5))
+    )"""
+
+
+def _iso_date(date):
+    """Convert a date (date object or DDMMYY string) into ISO format"""
+    if isinstance(date, str):
+        date = datetime.datetime.strptime(date, '%d%m%y')
+    return date.strftime('%Y-%m-%d')
+
+
+def _years_before(iso_date, years):
+    """Subtract years from an ISO date string (keeps month and day, even 02-29)"""
+    return f'{int(iso_date[:4]) - years:04d}{iso_date[4:]}'
+
+
+def create_indexes(db_file):
+    """Create the indexes used by PatientDB, if missing.
+
+    This modifies the schema of the database (but not the data), so it
+    should be done once, not on every use.
+    """
+    with sqlite3.connect(db_file) as conn:
+        conn.execute(
+            'CREATE INDEX IF NOT EXISTS idx_patients_patient_code ON patients(patient_code)'
+        )
+        conn.execute(
+            f'CREATE INDEX IF NOT EXISTS idx_patients_birth_date ON patients({BIRTH_DATE_SQL})'
+        )
+    conn.close()
+
+
+class PatientDB:
+    """Gaitbase patient database, opened read-only.
+
+    Parameters
+    ----------
+    db_file : str
+        The database file.
+    """
+
+    def __init__(self, db_file):
+        self.db_file = db_file
+        uri = Path(db_file).absolute().as_uri() + '?mode=ro'
+        self.conn = sqlite3.connect(uri, uri=True)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute(
+            f'CREATE TEMP VIEW IF NOT EXISTS patients_v AS '
+            f'SELECT *, {BIRTH_DATE_SQL} AS birth_date FROM patients'
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.conn.close()
+
+    def query(self, sql, params=()):
+        """Run a query, returning list of rows (sqlite3.Row)"""
+        return self.conn.execute(sql, params).fetchall()
+
+    def find_patient(self, patient_code):
+        """Return the patient with the given code (sqlite3.Row), or None"""
+        return self.conn.execute(
+            'SELECT * FROM patients_v WHERE patient_code = ?', (patient_code,)
+        ).fetchone()
+
+    def select_cohort(
+        self, age_min, age_max, ref_date_min, ref_date_max, code_types=None
+    ):
+        """Select patients by age.
+
+        Selects the patients who are age_min years old or older at
+        ref_date_min and younger than age_max at ref_date_max.
+
+        Parameters
+        ----------
+        age_min, age_max : int
+            The age limits in full years.
+        ref_date_min, ref_date_max : date | str
+            The reference dates, as date objects or DDMMYY strings.
+        code_types : list, optional
+            Accepted first letters of the patient code (e.g. ['H', 'C', 'D']).
+
+        Returns
+        -------
+        DataFrame
+            The patients, with columns for the ages at the reference dates.
+        """
+        import pandas as pd
+
+        ref_min, ref_max = _iso_date(ref_date_min), _iso_date(ref_date_max)
+        # the age limits as a birth date range: age at ref >= n is the same as
+        # birth_date <= ref minus n years (ISO dates compare as strings)
+        params = {
+            'ref_min': ref_min,
+            'ref_max': ref_max,
+            'born_after': _years_before(ref_max, age_max),
+            'born_by': _years_before(ref_min, age_min),
+        }
+        sql = f"""
+            SELECT *,
+            {_age_sql('ref_min')} AS age_ref_min,
+            {_age_sql('ref_max')} AS age_ref_max
+            FROM patients_v
+            WHERE birth_date > :born_after AND birth_date <= :born_by
+        """
+        if code_types:
+            code_params = {f'code{k}': code for k, code in enumerate(code_types)}
+            params.update(code_params)
+            sql += ' AND substr(patient_code, 1, 1) IN (%s)' % ', '.join(
+                f':{key}' for key in code_params
+            )
+        return pd.read_sql_query(sql, self.conn, params=params)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Gaitbase patient database')
+    parser.add_argument('db_file', help='the database file')
+    parser.add_argument(
+        '--create-indexes', action='store_true', help='create the indexes, if missing'
+    )
+    args = parser.parse_args()
+    if args.create_indexes:
+        create_indexes(args.db_file)
+        print(f'created indexes in {args.db_file}')
@@ -16,20 +16,23 @@ import os.path as op
 import numpy as np
 import scipy
 import logging
-import openpyxl
-from openpyxl.styles import Font
 import matplotlib.pyplot as plt
 
 from gaitutils import nexus, sessionutils, cfg, trial
 
+from cycle_norm import normalize_cycles
+from emg_envelope import resample
+from nexus_cache import CachedNexus
+from table_output import open_table_writer
+
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
 
-def _compute_emg_envelope():
+def _compute_emg_envelope(vicon):
     """Compute EMG linear envelope and rectified signal for currently open Nexus trial.
 
-    Write as model outputs.
+    Write as model outputs. vicon may be a CachedNexus instance.
     """
 
     # define parameters
@@ -38,7 +41,6 @@ def _compute_emg_envelope():
     BUTTER_ORDER = 4  # filter order
 
     # read EMG data
-    vicon = nexus.viconnexus()
     emgdata = nexus._get_emg_data(vicon)['data']
     meta = nexus._get_metadata(vicon)
     emgrate = meta['analograte']
@@ -68,17 +70,17 @@ def _compute_emg_envelope():
 
     # downsample
     emg_rectified_ds = {
-        chname + '_Rectified': scipy.signal.resample(chdata, nframes)
+        chname + '_Rectified': resample(chdata, nframes)[0]
         for chname, chdata in emg_rectified.items()
     }
     emg_linearenvelope_ds = {
-        chname + '_LinearEnvelope': scipy.signal.resample(chdata, nframes)
+        chname + '_LinearEnvelope': resample(chdata, nframes)[0]
         for chname, chdata in emg_rectified_lpf.items()
     }
 
     # create the new model outputs in Nexus
     existing_outputs = vicon.GetModelOutputNames(subject)
-    new_outputs = emg_rectified_ds.keys() + emg_linearenvelope_ds.keys()
+    new_outputs = list(emg_rectified_ds) + list(emg_linearenvelope_ds)
     for output in set(new_outputs) - set(existing_outputs):
         logger.debug('creating model output %s' % output)
         vicon.CreateModelOutput(
@@ -119,13 +121,6 @@ def _get_model_output(vicon, subj, var):
     return data
 
 
-def _bold_cell(ws, **cell_params):
-    """Write a bold-styled cell into worksheet ws"""
-    boldfont = Font(bold=True)
-    _cell = ws.cell(**cell_params)
-    _cell.font = boldfont
-
-
 def _guess_emg_devname(vicon):
     """Try to guess the EMG device name"""
     devnames = ['Myon EMG', 'Noraxon Ultium']  # the candidates
@@ -143,7 +138,8 @@ def _guess_emg_devname(vicon):
 if __name__ == '__main__':
     # loop through session c3d files, compute envelopes and save into c3ds and xlsx
     cfg.autoproc.nexus_forceplate_devnames = []  # read all forceplates
-    vicon = nexus.viconnexus()
+    # cache Nexus reads, so each variable is fetched only once per trial
+    vicon = CachedNexus(nexus.viconnexus())
     subj = nexus.get_subjectnames()
     emg_devname = _guess_emg_devname(vicon)
     if emg_devname is None:
@@ -154,50 +150,56 @@ if __name__ == '__main__':
     c3ds = sessionutils.get_c3ds(sp, tags=['XXX'])
     norm_data = dict()
     fname_xls = op.join(sp, op.split(sp)[-1] + '.xlsx')
-    wb = openpyxl.Workbook()
+    writer = open_table_writer(fname_xls)
     for n, c3dfile in enumerate(c3ds[:2]):
         ncycles = dict()
         logger.debug('opening %s' % c3dfile)
-        nexus._open_trial(c3dfile)
+        vicon.open_trial(c3dfile)
         # compute the envelopes into Nexus model vars; names are returned
-        modelvars = _compute_emg_envelope()
+        modelvars = _compute_emg_envelope(vicon)
         tr = trial.nexus_trial()
         for ctxt in 'LR':
             this_cycles = tr.get_cycles({ctxt: 'all'})
             if ctxt not in ncycles:
                 ncycles[ctxt] = len(this_cycles)
             this_vars = [var for var in modelvars if var[0] == ctxt]
-            for var in this_vars:
-                norm_data[var] = list()
-                for cyc in this_cycles:
-                    this_data = _get_model_output(vicon, subj, var)
-                    this_data_norm = cyc.normalize(this_data)[1]
-                    norm_data[var].append(this_data_norm)
-                norm_data[var] = np.array(norm_data[var])
+            if not this_vars:
+                continue
+            this_data = np.array(
+                [_get_model_output(vicon, subj, var) for var in this_vars]
+            )
+            # normalize all variables and cycles in one go
+            this_data_norm = normalize_cycles(this_data, this_cycles)
+            for k, var in enumerate(this_vars):
+                norm_data[var] = this_data_norm[:, k, :]
         avg_data = dict()
         std_data = dict()
         for var in modelvars:
             avg_data[var] = norm_data[var].mean(axis=0)
             std_data[var] = norm_data[var].std(axis=0)
-        ws = wb.active if n == 0 else wb.create_sheet()
-        ws.title = op.splitext(op.split(c3dfile)[-1])[0]
         # write some metadata
-        _bold_cell(ws, column=1, row=2, value='Subject:')
-        _bold_cell(ws, column=1, row=3, value='Trial:')
-        _bold_cell(ws, column=1, row=4, value='Averaged cycles left:')
-        _bold_cell(ws, column=1, row=5, value='Averaged cycles right:')
-        ws.cell(column=2, row=2, value=subj)
-        ws.cell(column=2, row=3, value=op.split(c3dfile)[-1])
-        ws.cell(column=2, row=4, value=ncycles['L'])
-        ws.cell(column=2, row=5, value=ncycles['R'])
-        # write channel avg and std data
-        for col, var in enumerate(sorted(modelvars), 3):
-            _bold_cell(ws, column=2 * col, row=2, value=var + ' mean')  # col header
-            _bold_cell(
-                ws, column=2 * col + 1, row=2, value=var + ' stddev'
-            )  # col header
-            for row, x in enumerate(avg_data[var], 3):
-                ws.cell(column=2 * col, row=row, value=x)
-            for row, x in enumerate(std_data[var], 3):
-                ws.cell(column=2 * col + 1, row=row, value=x)
-    wb.save(filename=fname_xls)
+        meta = [
+            ('Subject:', subj),
+            ('Trial:', op.split(c3dfile)[-1]),
+            ('Averaged cycles left:', ncycles['L']),
+            ('Averaged cycles right:', ncycles['R']),
+        ]
+        col_headers = ['']
+        for var in sorted(modelvars):
+            col_headers.extend([var + ' mean', var + ' stddev'])
+        table = writer.add_table(
+            op.splitext(op.split(c3dfile)[-1])[0],
+            columns=col_headers,
+            meta=meta,
+            label_col=True,
+        )
+        # write channel avg and std data, one row per frame
+        for k in range(101):
+            row = ['frame %d' % k]
+            for var in sorted(modelvars):
+                row.extend([avg_data[var][k], std_data[var][k]])
+            table.append(row)
+    writer.close()
+    logger.info(
+        'Nexus cache: %d hits, %d misses (round trips)' % (vicon.hits, vicon.misses)
+    )
@@ -1,7 +1,13 @@
 # -*- coding: utf-8 -*-
 """
 
-Rectify EMG from c3d files. Average and write into XLSX.
+Rectify EMG from c3d files. Average and write into XLSX (or CSV/Parquet, see
+OUTPUT_FORMAT).
+
+Each c3d file is read only once: the first cell extracts the rectified
+signal, linear envelope and RMS envelope for all trials, normalized to gait
+cycles. The remaining cells write the workbooks from the extracted data.
+Trials are processed in parallel (see NWORKERS).
 
 @author: Jussi (jnu@iki.fi)
 
@@ -10,12 +16,11 @@ Rectify EMG from c3d files. Average and write into XLSX.
 # %% init
 
 import enum
+import os
 import os.path as op
 import numpy as np
 import scipy
 import logging
-import openpyxl
-from openpyxl.styles import Font
 import matplotlib.pyplot as plt
 from collections import defaultdict
 import gaitutils
@@ -24,116 +29,75 @@ from gaitutils.envutils import GaitDataError
 from gaitutils.numutils import _isint
 from gaitutils import c3d, nexus, sessionutils, cfg, trial, read_data
 
+from emg_envelope import read_emg_c3d, extract_emg_features
+from batch import run_batch
+from c3d_catalog import C3DCatalog
+from cycle_norm import normalize_cycles
+from result_cache import ResultCache, cfg_params
+from table_output import open_table_writer
+from trial_loader import load_trial
+
 logging.basicConfig(level=logging.WARNING)
 logger = logging.getLogger(__name__)
 
+session_root = r'C:\Users\hus20664877\Downloads\C3D files'
 
-def _bold_cell(ws, **cell_params):
-    """Write a bold-styled cell into worksheet ws"""
-    boldfont = Font(bold=True)
-    _cell = ws.cell(**cell_params)
-    _cell.font = boldfont
-
-
-def _compute_rms_envelope_c3d(c3dfile):
-    """Compute RMS-based envelope"""
-    # define parameters
-    HPF = 20  # high pass frequency
-    BUTTER_ORDER = 4  # filter order
-    RMS_WIN = 31
-
-    # read EMG data
-    emgdata = read_data.get_emg_data(c3dfile)['data']
-    meta = read_data.get_metadata(c3dfile)
-    emgrate = meta['analograte']
-    nframes = meta['length']
-
-    # strip Voltage. prefix that Nexus inserts
-    emgdata = {
-        (chname[8:] if chname.find('Voltage') == 0 else chname): data
-        for chname, data in emgdata.items()
-    }
-
-    # apply hpf
-    b_HPF, a_HPF = scipy.signal.butter(
-        BUTTER_ORDER, HPF * 2 / emgrate, 'high', analog=False
-    )
+# number of worker processes; None = use all cores, 1 = no multiprocessing
+NWORKERS = None
 
-    emg_hpf = {
-        chname: scipy.signal.filtfilt(b_HPF, a_HPF, chdata)
-        for chname, chdata in emgdata.items()
-    }
+# output format for the tables: 'xlsx', 'csv' or 'parquet'
+OUTPUT_FORMAT = 'xlsx'
 
-    # RMS
-    emg_rms = {chname: gaitutils.numutils.rms(chdata, RMS_WIN) for chname, chdata in emg_hpf.items()}
+# cache for the extracted trial data, so that reruns only process new or
+# changed trials; set to None to disable. Increase CACHE_VERSION when changing
+# the extraction code. To clear: python result_cache.py CACHE_DIR --clear
+CACHE_DIR = op.join(session_root, '.emg_cache')
+CACHE_VERSION = 1
 
-    # downsample
-    emg_rms_ds = {
-        chname + '_RMS': scipy.signal.resample(chdata, nframes)
-        for chname, chdata in emg_rms.items()
-    }
-
-    return emg_rms_ds
+# trial catalog (see c3d_catalog.py); if set, the c3d files are found from the
+# catalog instead of walking session_root, and only dynamic trials are read
+CATALOG_DB = None
 
+# gaitutils settings; these are set at module level, so that they also apply
+# in the worker processes
+cfg.autoproc.nexus_forceplate_devnames = []  # read all forceplates
 
-def _compute_emg_envelope_c3d(c3dfile):
-    """Compute EMG linear envelope and rectified signal for a c3d file"""
+# be more tolerant about toeoffs
+cfg.trial.no_toeoff = 'reject'
+cfg.trial.multiple_toeoffs = 'reject'
 
-    # define parameters
-    HPF = 5  # high pass frequency
-    LPF = 10  # envelope low pass frequency
-    BUTTER_ORDER = 4  # filter order
 
-    # read EMG data
-    emgdata = read_data.get_emg_data(c3dfile)['data']
-    meta = read_data.get_metadata(c3dfile)
-    emgrate = meta['analograte']
-    nframes = meta['length']
+# EMG processing parameters
+EMG_PARAMS = {
+    'envelope_hpf': 5,  # high pass frequency (rectified & linear envelope)
+    'lpf': 10,  # envelope low pass frequency
+    'rms_hpf': 20,  # high pass frequency (RMS)
+    'order': 4,  # filter order
+    'rms_win': 31,  # RMS window (samples)
+    'rms_win_ms': None,  # RMS window (ms); if set, overrides rms_win
+}
 
-    # strip Voltage. prefix that Nexus inserts
-    emgdata = {
-        (chname[8:] if chname.find('Voltage') == 0 else chname): data
-        for chname, data in emgdata.items()
-    }
 
-    # apply hpf
-    b_HPF, a_HPF = scipy.signal.butter(
-        BUTTER_ORDER, HPF * 2 / emgrate, 'high', analog=False
-    )
-    emg_hpf = {
-        chname: scipy.signal.filtfilt(b_HPF, a_HPF, chdata)
-        for chname, chdata in emgdata.items()
-    }
+def _compute_emg_features_c3d(c3dfile):
+    """Compute rectified EMG, linear envelope and RMS envelope for a c3d file"""
+    emg, emgrate, nframes = read_emg_c3d(c3dfile)
+    return extract_emg_features(emg, emgrate, nframes, **EMG_PARAMS)
 
-    # rectify
-    emg_rectified = {chname: np.abs(chdata) for chname, chdata in emg_hpf.items()}
 
-    # apply lpf
-    b_LPF, a_LPF = scipy.signal.butter(
-        BUTTER_ORDER, LPF * 2 / emgrate, 'low', analog=False
-    )
-    emg_rectified_lpf = {
-        chname: scipy.signal.filtfilt(b_LPF, a_LPF, chdata)
-        for chname, chdata in emg_rectified.items()
-    }
+# emg1-6 oikea, paitsi Vilma emg1-6 vasen
+# Noraxon-specific mapping from ch index to context
+def _idx_mapper(idx):
+    return 'R' if idx <= 6 else 'L'
 
-    # downsample
-    emg_rectified_ds = {
-        chname + '_Rectified': scipy.signal.resample(chdata, nframes)
-        for chname, chdata in emg_rectified.items()
-    }
-    emg_linearenvelope_ds = {
-        chname + '_LinearEnvelope': scipy.signal.resample(chdata, nframes)
-        for chname, chdata in emg_rectified_lpf.items()
-    }
 
-    return emg_linearenvelope_ds
+def _idx_mapper_reverse(idx):
+    return 'L' if idx <= 6 else 'R'
 
 
 def _channel_context(chname, idx_mapper):
     """Try to figure out channel context.
 
-    idx_mapper must be a dict that maps channel index to context.
+    idx_mapper must be a function that maps channel index to context.
     """
     if chname[0] in 'LR':  # Myon naming
         return chname[0]
@@ -148,303 +112,140 @@ def _channel_context(chname, idx_mapper):
         return None
 
 
-def _auto_adjust(ws):
-    dims = {}
-    for row in ws.rows:
-        for cell in row:
-            if cell.value:
-                dims[cell.column_letter] = max(
-                    (dims.get(cell.column_letter, 0), len(str(cell.value)))
-                )
-    for col, value in dims.items():
-        ws.column_dimensions[col].width = value
-
-
-# %% read through EMG, compute envelopes, save averaged data into XLSX
-
-# emg1-6 oikea, paitsi Vilma emg1-6 vasen
+def _extract_trial(c3dfile):
+    """Read a c3d file, compute EMG features and normalize them to gait cycles.
 
-# Noraxon-specific mapping from ch index to context
-idx_mapper = lambda idx: 'R' if idx <= 6 else 'L'
-idx_mapper_reverse = lambda idx: 'L' if idx <= 6 else 'R'
-
-cfg.autoproc.nexus_forceplate_devnames = []  # read all forceplates
-
-session_root = r'C:\Users\hus20664877\Downloads\C3D files'
-
-fname_xls = op.join(session_root, 'emg_envelopes.xlsx')
-
-norm_data = dict()
-wb = openpyxl.Workbook()
-
-# be more tolerant about toeoffs
-cfg.trial.no_toeoff = 'reject'
-cfg.trial.multiple_toeoffs = 'reject'
-
-# get the c3ds
-allfiles = list()
-for d0, dirs, files in os.walk(session_root):
-    allfiles.extend(op.join(d0, fn) for fn in files if '.c3d' in fn.lower())
-
-# compute envelopes, normalize to cycles (for matching context) and average (one per trial)
-for n, c3dfile in enumerate(sorted(allfiles)):
-    try:
-        lenv = _compute_emg_envelope_c3d(c3dfile)
-    except GaitDataError:
-        logger.warning('cannot read EMG from %s, skipping' % c3dfile)
-        continue
-    tr = trial.Trial(c3dfile)
-    this_cycles = tr.get_cycles('all')
-    # count L/R cycles
-    ncycles = {
-        ctxt: len([c for c in this_cycles if c.context == ctxt]) for ctxt in 'LR'
-    }
+    Channels are normalized to the cycles of the matching context. Returns a
+    dict with the trial info and the normalized data for each feature.
+    """
     # for Vilma, we have a different channel mapping
-    _idx_mapper = idx_mapper_reverse if 'VILMA' in c3dfile.upper() else idx_mapper
-    norm_data = dict()
-    chs_valid = [ch for ch in lenv if _channel_context(ch, _idx_mapper) is not None]
-    for chname in chs_valid:
-        chdata = lenv[chname]
-        ctxt_this = _channel_context(chname, idx_mapper)
-        norm_data[chname] = list()
-        for cyc in this_cycles:
-            if ctxt_this != cyc.context:
-                continue
-            chdata_norm = cyc.normalize(chdata)[1]
-            norm_data[chname].append(chdata_norm)
-        norm_data[chname] = np.array(norm_data[chname])
-
-    avg_data = dict()
-    std_data = dict()
-    for chname in chs_valid:
-        avg_data[chname] = norm_data[chname].mean(axis=0)
-        std_data[chname] = norm_data[chname].std(axis=0)
-
-    # one trial per sheet
-    ws = wb.active if n == 0 else wb.create_sheet()
-    ws.title = op.splitext(op.split(c3dfile)[-1])[0][:31]
-
-    # write some metadata
-    _bold_cell(ws, column=1, row=2, value='Trial name:')
-    _bold_cell(ws, column=1, row=3, value='N of cycles right:')
-    _bold_cell(ws, column=1, row=4, value='N of cycles left:')
-
-    ws.cell(column=2, row=2, value=op.split(c3dfile)[-1])
-    ws.cell(column=2, row=3, value=ncycles['L'])
-    ws.cell(column=2, row=4, value=ncycles['R'])
-
-    col_headers = [''] + ['frame %d' % k for k in range(101)]
-
-    for col, txt in enumerate(col_headers, 1):
-        _bold_cell(ws, column=col, row=5, value=txt)
-
-    # write channel avg and std data
-    for _row, chname in enumerate(sorted(chs_valid), 3):
-
-        # average
-        _bold_cell(ws, column=1, row=_row * 2, value='%s / average' % chname)
-        for col, val in enumerate(avg_data[chname], 2):
-            ws.cell(column=col, row=_row * 2, value=val)
-
-        # stddev
-        _bold_cell(ws, column=1, row=_row * 2 + 1, value='%s / stddev' % chname)
-        for col, val in enumerate(std_data[chname], 2):
-            ws.cell(column=col, row=_row * 2 + 1, value=val)
-
-    _auto_adjust(ws)
-
-wb.save(filename=fname_xls)
-
-
-# %% read through EMG, compute envelopes, save complete (not averaged) cycle
-# data into XLSX
-
-# emg1-6 oikea, paitsi Vilma emg1-6 vasen
-
-# Noraxon-specific mapping from ch index to context
-idx_mapper = lambda idx: 'R' if idx <= 6 else 'L'
-idx_mapper_reverse = lambda idx: 'L' if idx <= 6 else 'R'
-
-cfg.autoproc.nexus_forceplate_devnames = []  # read all forceplates
-
-session_root = r'C:\Users\hus20664877\Downloads\C3D files'
-
-fname_xls = op.join(session_root, 'emg_envelopes_individual.xlsx')
-
-norm_data = dict()
-wb = openpyxl.Workbook()
-
-# be more tolerant about toeoffs
-cfg.trial.no_toeoff = 'reject'
-cfg.trial.multiple_toeoffs = 'reject'
-
-# get the c3ds
-allfiles = list()
-for d0, dirs, files in os.walk(session_root):
-    allfiles.extend(op.join(d0, fn) for fn in files if '.c3d' in fn.lower())
-
-# compute envelopes, normalize to cycles (for matching context) and average (one per trial)
-for n, c3dfile in enumerate(sorted(allfiles)):
-    try:
-        lenv = _compute_emg_envelope_c3d(c3dfile)
-    except GaitDataError:
-        logger.warning('cannot read EMG from %s, skipping' % c3dfile)
-        continue
-    tr = trial.Trial(c3dfile)
+    idx_mapper = _idx_mapper_reverse if 'VILMA' in c3dfile.upper() else _idx_mapper
+    # the c3d file is parsed only once for EMG, metadata and cycles
+    features = _compute_emg_features_c3d(c3dfile)
+    tr = load_trial(c3dfile).trial
     this_cycles = tr.get_cycles('all')
     # count L/R cycles
     ncycles = {
         ctxt: len([c for c in this_cycles if c.context == ctxt]) for ctxt in 'LR'
     }
-    # for Vilma, we have a different channel mapping
-    _idx_mapper = idx_mapper_reverse if 'VILMA' in c3dfile.upper() else idx_mapper
     norm_data = dict()
-    chs_valid = [ch for ch in lenv if _channel_context(ch, _idx_mapper) is not None]
     ctxts = dict()  # context for each channel
-    for chname in chs_valid:
-        chdata = lenv[chname]
-        ctxt_this = _channel_context(chname, idx_mapper)
-        ctxts[chname] = ctxt_this
-        norm_data[chname] = list()
-        for cyc in this_cycles:
-            if ctxt_this != cyc.context:
+    for feature, chdata_all in features.items():
+        norm_data[feature] = dict()
+        for chname in chdata_all:
+            ctxt_this = _channel_context(chname, idx_mapper)
+            if ctxt_this is not None:
+                ctxts[chname] = ctxt_this
+        # normalize all channels of a context in one go
+        for ctxt in 'LR':
+            chnames = [ch for ch in chdata_all if ctxts.get(ch) == ctxt]
+            if not chnames:
                 continue
-            chdata_norm = cyc.normalize(chdata)[1]
-            norm_data[chname].append(chdata_norm)
-        norm_data[chname] = np.array(norm_data[chname])
-
-    avg_data = dict()
-    std_data = dict()
-    for chname in chs_valid:
-        avg_data[chname] = norm_data[chname].mean(axis=0)
-        std_data[chname] = norm_data[chname].std(axis=0)
-
-    # one trial per sheet
-    ws = wb.active if n == 0 else wb.create_sheet()
-    ws.title = op.splitext(op.split(c3dfile)[-1])[0][:31]
-
-    # write some metadata
-    _bold_cell(ws, column=1, row=2, value='Trial name:')
-    _bold_cell(ws, column=1, row=3, value='N of cycles right:')
-    _bold_cell(ws, column=1, row=4, value='N of cycles left:')
+            cycles = [cyc for cyc in this_cycles if cyc.context == ctxt]
+            chdata = np.array([chdata_all[ch] for ch in chnames])
+            ndata = normalize_cycles(chdata, cycles)  # cycles x channels x 101
+            for k, chname in enumerate(chnames):
+                norm_data[feature][chname] = ndata[:, k, :]
+    return {
+        'c3dfile': c3dfile,
+        'ncycles': ncycles,
+        'ctxts': ctxts,
+        'norm_data': norm_data,
+    }
 
-    ws.cell(column=2, row=2, value=op.split(c3dfile)[-1])
-    ws.cell(column=2, row=3, value=ncycles['R'])
-    ws.cell(column=2, row=4, value=ncycles['L'])
 
+def _add_trial_table(writer, trial_data):
+    """Start a new table for a trial, with trial metadata and column headers"""
+    fname = op.split(trial_data['c3dfile'])[-1]
+    meta = [
+        ('Trial name:', fname),
+        ('N of cycles right:', trial_data['ncycles']['R']),
+        ('N of cycles left:', trial_data['ncycles']['L']),
+    ]
     col_headers = [''] + ['frame %d' % k for k in range(101)]
+    return writer.add_table(
+        op.splitext(fname)[0], columns=col_headers, meta=meta, label_col=True
+    )
 
-    for col, txt in enumerate(col_headers, 1):
-        _bold_cell(ws, column=col, row=5, value=txt)
-
-    # loop over channels
-    row = 7
-    for ch_ind, chname in enumerate(sorted(chs_valid), 3):
-        chdata = norm_data[chname]
-        for curve_ind, curve in enumerate(chdata, 1):
-            _bold_cell(ws, column=1, row=row, value='%s (context=%s), cycle %d' % (chname, ctxts[chname], curve_ind))
-            for col, val in enumerate(curve, 2):
-                ws.cell(column=col, row=row, value=val)
-            row += 1
-
-    _auto_adjust(ws)
-
-wb.save(filename=fname_xls)
-
-
-# %% read through EMG, compute RMS envelopes, save complete (not averaged) cycle
-# data into XLSX
-
-# emg1-6 oikea, paitsi Vilma emg1-6 vasen
-
-# Noraxon-specific mapping from ch index to context
-idx_mapper = lambda idx: 'R' if idx <= 6 else 'L'
-idx_mapper_reverse = lambda idx: 'L' if idx <= 6 else 'R'
-
-cfg.autoproc.nexus_forceplate_devnames = []  # read all forceplates
-
-session_root = r'C:\Users\hus20664877\Downloads\C3D files'
-
-fname_xls = op.join(session_root, 'emg_rms_individual.xlsx')
-
-norm_data = dict()
-wb = openpyxl.Workbook()
-
-# be more tolerant about toeoffs
-cfg.trial.no_toeoff = 'reject'
-cfg.trial.multiple_toeoffs = 'reject'
-
-# get the c3ds
-allfiles = list()
-for d0, dirs, files in os.walk(session_root):
-    allfiles.extend(op.join(d0, fn) for fn in files if '.c3d' in fn.lower())
-
-# compute envelopes, normalize to cycles (for matching context) and average (one per trial)
-for n, c3dfile in enumerate(sorted(allfiles)):
-    try:
-        lenv = _compute_rms_envelope_c3d(c3dfile)
-    except GaitDataError:
-        logger.warning('cannot read EMG from %s, skipping' % c3dfile)
-        continue
-    tr = trial.Trial(c3dfile)
-    this_cycles = tr.get_cycles('all')
-    # count L/R cycles
-    ncycles = {
-        ctxt: len([c for c in this_cycles if c.context == ctxt]) for ctxt in 'LR'
-    }
-    # for Vilma, we have a different channel mapping
-    _idx_mapper = idx_mapper_reverse if 'VILMA' in c3dfile.upper() else idx_mapper
-    norm_data = dict()
-    chs_valid = [ch for ch in lenv if _channel_context(ch, _idx_mapper) is not None]
-    ctxts = dict()  # context for each channel
-    for chname in chs_valid:
-        chdata = lenv[chname]
-        ctxt_this = _channel_context(chname, idx_mapper)
-        ctxts[chname] = ctxt_this
-        norm_data[chname] = list()
-        for cyc in this_cycles:
-            if ctxt_this != cyc.context:
-                continue
-            chdata_norm = cyc.normalize(chdata)[1]
-            norm_data[chname].append(chdata_norm)
-        norm_data[chname] = np.array(norm_data[chname])
-
-    avg_data = dict()
-    std_data = dict()
-    for chname in chs_valid:
-        avg_data[chname] = norm_data[chname].mean(axis=0)
-        std_data[chname] = norm_data[chname].std(axis=0)
 
-    # one trial per sheet
-    ws = wb.active if n == 0 else wb.create_sheet()
-    ws.title = op.splitext(op.split(c3dfile)[-1])[0][:31]
+def _write_averaged_workbook(trials_data, feature, fname_out):
+    """Write cycle averages and stddevs of a feature, one trial per sheet"""
+    with open_table_writer(fname_out) as writer:
+        for trial_data in trials_data:
+            table = _add_trial_table(writer, trial_data)
+            norm_data = trial_data['norm_data'][feature]
+            # write channel avg and std data
+            for chname in sorted(norm_data):
+                table.append(['%s / average' % chname] + list(norm_data[chname].mean(axis=0)))
+                table.append(['%s / stddev' % chname] + list(norm_data[chname].std(axis=0)))
+
+
+def _write_cycles_workbook(trials_data, feature, fname_out):
+    """Write individual cycles of a feature, one trial per sheet"""
+    with open_table_writer(fname_out) as writer:
+        for trial_data in trials_data:
+            table = _add_trial_table(writer, trial_data)
+            norm_data = trial_data['norm_data'][feature]
+            ctxts = trial_data['ctxts']
+            # keep an empty row between the headers and the cycles
+            table.append([])
+            # loop over channels
+            for chname in sorted(norm_data):
+                for curve_ind, curve in enumerate(norm_data[chname], 1):
+                    label = '%s (context=%s), cycle %d' % (chname, ctxts[chname], curve_ind)
+                    table.append([label] + list(curve))
+
+
+# %% read through EMG, compute envelopes and normalize to cycles (for matching context)
+
+if __name__ == '__main__':
+    # get the c3ds
+    if CATALOG_DB is not None:
+        with C3DCatalog(CATALOG_DB) as catalog:
+            catalog.refresh(session_root)
+            allfiles = catalog.select(rootdir=session_root, trial_type='dynamic')
+    else:
+        allfiles = list()
+        for d0, dirs, files in os.walk(session_root):
+            allfiles.extend(op.join(d0, fn) for fn in files if '.c3d' in fn.lower())
+
+    if CACHE_DIR is not None:
+        cache = ResultCache(CACHE_DIR)
+        cache_params = {
+            'version': CACHE_VERSION,
+            **EMG_PARAMS,
+            **cfg_params('emg', 'trial'),
+        }
+    else:
+        cache = cache_params = None
+
+    results, failures = run_batch(
+        _extract_trial,
+        allfiles,
+        nworkers=NWORKERS,
+        desc='Extracting EMG',
+        cache=cache,
+        cache_params=cache_params,
+    )
+    trials_data = [trial_data for _, trial_data in results]
 
-    # write some metadata
-    _bold_cell(ws, column=1, row=2, value='Trial name:')
-    _bold_cell(ws, column=1, row=3, value='N of cycles right:')
-    _bold_cell(ws, column=1, row=4, value='N of cycles left:')
 
-    ws.cell(column=2, row=2, value=op.split(c3dfile)[-1])
-    ws.cell(column=2, row=3, value=ncycles['R'])
-    ws.cell(column=2, row=4, value=ncycles['L'])
+# %% save averaged linear envelopes
 
-    col_headers = [''] + ['frame %d' % k for k in range(101)]
+if __name__ == '__main__':
+    fname_out = op.join(session_root, 'emg_envelopes.' + OUTPUT_FORMAT)
+    _write_averaged_workbook(trials_data, 'LinearEnvelope', fname_out)
 
-    for col, txt in enumerate(col_headers, 1):
-        _bold_cell(ws, column=col, row=5, value=txt)
 
-    # loop over channels
-    row = 7
-    for ch_ind, chname in enumerate(sorted(chs_valid), 3):
-        chdata = norm_data[chname]
-        for curve_ind, curve in enumerate(chdata, 1):
-            _bold_cell(ws, column=1, row=row, value='%s (context=%s), cycle %d' % (chname, ctxts[chname], curve_ind))
-            for col, val in enumerate(curve, 2):
-                ws.cell(column=col, row=row, value=val)
-            row += 1
+# %% save complete (not averaged) linear envelope cycle data
 
-    _auto_adjust(ws)
+if __name__ == '__main__':
+    fname_out = op.join(session_root, 'emg_envelopes_individual.' + OUTPUT_FORMAT)
+    _write_cycles_workbook(trials_data, 'LinearEnvelope', fname_out)
 
-wb.save(filename=fname_xls)
 
+# %% save complete (not averaged) RMS envelope cycle data
 
+if __name__ == '__main__':
+    fname_out = op.join(session_root, 'emg_rms_individual.' + OUTPUT_FORMAT)
+    _write_cycles_workbook(trials_data, 'RMS', fname_out)
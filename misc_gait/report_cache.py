@@ -0,0 +1,362 @@
+# -*- coding: utf-8 -*-
+"""
+Session reports with cached figures.
+
+gaitutils web.dash_report(..., recreate_plots=True) and pdf.create_report()
+read all the tagged trials and render every figure on each run, even if only
+the patient info has changed. create_reports() fingerprints the session data
+(the c3d and enf files of the session), the report-related gaitutils
+settings and the patient age (which selects the normal data), and reuses the
+rendered figures and tables as long as the fingerprint matches:
+
+    create_reports(sessionpath, info)
+
+The figures of the pdf report are stored (pickled) in the session dir, in
+REPORT_CACHE_FILE. The title page and the page headers, which include the
+patient name and the session description, are always made anew, so e.g.
+fixing a typo in the description only takes a few seconds. For the web
+report, the fingerprint decides whether the figure data saved by gaitutils
+can be used (recreate_plots=False) or must be recreated.
+
+The pdf report is the same as made by pdf.create_report() with the default
+pages.
+
+requires: gaitutils
+"""
+
+import hashlib
+import io
+import logging
+import os
+import pickle
+from pathlib import Path
+
+from gaitutils import cfg, models, normaldata, sessionutils, stats, trial
+from gaitutils.report import web
+from gaitutils.report.pdf import _make_text_fig, _savefig
+from gaitutils.report.text import _curve_extracted_text, _session_analysis_text
+from gaitutils.report.translations import translate
+from gaitutils.viz import timedist
+from gaitutils.viz.plot_matplotlib import _plot_extracted_table_plotly
+from gaitutils.viz.plots import (
+    _plot_session_average,
+    _plot_sessions,
+    plot_trial_velocities,
+)
+from matplotlib.backends.backend_pdf import PdfPages
+from ulstools.num import age_from_hetu
+
+from result_cache import cfg_params
+
+logger = logging.getLogger(__name__)
+
+REPORT_CACHE_FILE = 'report_cache.pkl'
+# increase when the cached data changes
+CACHE_VERSION = 1
+# gaitutils settings that affect the reports
+REPORT_CFG_SECTIONS = [
+    'eclipse',
+    'emg',
+    'general',
+    'layouts',
+    'models',
+    'plot',
+    'plot_matplotlib',
+    'plot_plotly',
+    'report',
+    'trial',
+    'web_report',
+]
+# file types that the report data depends on
+DATA_SUFFIXES = {'.c3d', '.enf'}
+
+pdf_backend = 'matplotlib'
+
+
+def session_fingerprint(sessionpath, hetu=None):
+    """Fingerprint of the data and settings that the report figures depend on.
+
+    Parameters
+    ----------
+    sessionpath : Path
+        The session directory.
+    hetu : str, optional
+        The patient hetu. Only the age derived from it affects the figures
+        (via the normal data), so the fingerprint does not change with other
+        patient info.
+
+    Returns
+    -------
+    str
+        SHA1 hex digest.
+    """
+    sessionpath = Path(sessionpath)
+    h = hashlib.sha1(f'version {CACHE_VERSION}\n'.encode('utf-8'))
+    with os.scandir(sessionpath) as it:
+        entries = sorted(
+            (entry.name, entry.stat())
+            for entry in it
+            if entry.is_file() and Path(entry.name).suffix.lower() in DATA_SUFFIXES
+        )
+    for name, st in entries:
+        h.update(f'{name}\t{st.st_size}\t{st.st_mtime_ns}\n'.encode('utf-8'))
+    for key, val in sorted(cfg_params(*REPORT_CFG_SECTIONS).items()):
+        h.update(f'{key}={val}\n'.encode('utf-8'))
+    if hetu:
+        session_t = sessionutils.get_session_date(sessionpath)
+        # normal data is chosen by the current age, muscle length footer by
+        # the age at the session
+        ages = age_from_hetu(hetu), age_from_hetu(hetu, session_t)
+        h.update(f'ages {ages}\n'.encode('utf-8'))
+    return h.hexdigest()
+
+
+def _load_cache(sessionpath, fingerprint):
+    """Load the cached report data; returns an empty dict if not current"""
+    fname = Path(sessionpath) / REPORT_CACHE_FILE
+    if not fname.is_file():
+        return dict()
+    try:
+        with open(fname, 'rb') as f:
+            cached = pickle.load(f)
+    except Exception:  # e.g. saved with incompatible library versions
+        logger.warning(f'cannot load {fname}, recreating')
+        return dict()
+    if cached.get('fingerprint') != fingerprint:
+        logger.info('session data or settings changed, recreating report figures')
+        return dict()
+    return cached
+
+
+def _save_cache(sessionpath, cached):
+    fname = Path(sessionpath) / REPORT_CACHE_FILE
+    tmpname = fname.with_name(fname.name + '.tmp')
+    with open(tmpname, 'wb') as f:
+        pickle.dump(cached, f, protocol=-1)
+    os.replace(tmpname, fname)
+
+
+def _make_data_figures(sessionpath, age):
+    """Make the pdf report figures that do not depend on the patient info.
+
+    Returns a tuple of (figs, texts): dict of page: (figure, footer) in page
+    order, and dict of the text reports.
+    """
+    sessionpath = Path(sessionpath)
+    sessiondir = sessionpath.name
+    tagged_trials = sessionutils._get_tagged_dynamic_c3ds_from_sessions(
+        [sessionpath], tags=cfg.eclipse.tags
+    )
+    trials = (trial.Trial(t) for t in tagged_trials)
+    has_kinetics = any(c.on_forceplate for t in trials for c in t.cycles)
+    model_normaldata = normaldata._read_session_normaldata(sessionpath)
+    musclelen_ndata = normaldata._find_normaldata_for_age(age)
+    footer_musclelen = (
+        f" {translate('Normal data')}: {musclelen_ndata}" if musclelen_ndata else ''
+    )
+    # legends are disabled (there are typically too many cycles)
+    cons_opts = dict(
+        color_by=cfg.report.color_by,
+        style_by=cfg.report.style_by,
+        backend=pdf_backend,
+        legend_type=cfg.report.legend_type,
+        legend=False,
+    )
+
+    figs = dict()
+    logger.debug('creating velocity plot')
+    figs['TrialVelocity'] = (
+        plot_trial_velocities(sessionpath, backend=pdf_backend),
+        None,
+    )
+    logger.debug('creating time-distance plot')
+    figs['TimeDistAverage'] = (
+        timedist.plot_session_average(sessionpath, backend=pdf_backend),
+        None,
+    )
+    logger.debug('creating kinematics consistency plot')
+    figs['KinematicsCons'] = (
+        _plot_sessions(
+            sessions=[sessionpath],
+            layout='lb_kinematics',
+            model_normaldata=model_normaldata,
+            figtitle=f'Kinematics consistency for {sessiondir}',
+            **cons_opts,
+        ),
+        None,
+    )
+    logger.debug('creating torso kinematics consistency plot')
+    figs['TorsoKinematicsCons'] = (
+        _plot_sessions(
+            sessions=[sessionpath],
+            layout='torso',
+            model_normaldata=model_normaldata,
+            figtitle=f'Torso kinematics consistency for {sessiondir}',
+            **cons_opts,
+        ),
+        None,
+    )
+    if has_kinetics:
+        logger.debug('creating kinetics consistency plot')
+        figs['KineticsCons'] = (
+            _plot_sessions(
+                sessions=[sessionpath],
+                layout='lb_kinetics_web',
+                model_normaldata=model_normaldata,
+                figtitle=f'Kinetics consistency for {sessiondir}',
+                **cons_opts,
+            ),
+            None,
+        )
+    logger.debug('creating muscle length consistency plot')
+    figs['MuscleLenCons'] = (
+        _plot_sessions(
+            sessions=[sessionpath],
+            layout='musclelen',
+            model_normaldata=model_normaldata,
+            figtitle=f'Muscle length consistency for {sessiondir}',
+            **cons_opts,
+        ),
+        footer_musclelen,
+    )
+    logger.debug('creating EMG consistency plot')
+    figs['EMGCons'] = (
+        _plot_sessions(
+            sessions=[sessionpath],
+            layout='std_emg',
+            figtitle=f'EMG consistency for {sessiondir}',
+            **cons_opts,
+        ),
+        None,
+    )
+    figs['KinAverage'] = (
+        _plot_session_average(
+            sessionpath, model_normaldata=model_normaldata, backend=pdf_backend
+        ),
+        None,
+    )
+
+    # tables of curve extracted values
+    vardefs_dict = dict(cfg.report.vardefs)
+    allvars = [vardef[0] for vardefs in vardefs_dict.values() for vardef in vardefs]
+    from_models = set(models.model_from_var(var) for var in allvars)
+    curve_vals = {
+        sessiondir: stats._trials_extract_values(tagged_trials, from_models=from_models)
+    }
+    logger.debug('plotting curve extracted values')
+    for k, (title, vardefs) in enumerate(vardefs_dict.items()):
+        fig = _plot_extracted_table_plotly(curve_vals, vardefs)
+        fig.tight_layout()
+        fig.set_dpi(300)
+        fig.suptitle(f'Curve extracted values: {title}')
+        figs[f'Extracted{k}'] = fig, None
+
+    texts = {
+        'time_distance': _session_analysis_text(sessionpath),
+        'curve_values': '\n'.join(_curve_extracted_text(curve_vals, vardefs_dict)),
+    }
+    return figs, texts
+
+
+def _title_text(sessionpath, info, age):
+    """Text for the pdf title page"""
+    sessiondir = sessionpath.name
+    session_t = sessionutils.get_session_date(sessionpath)
+    title_txt = f'{cfg.report.laboratory_name}\n'
+    title_txt += f"{translate('Results of gait analysis')}\n"
+    title_txt += '\n'
+    title_txt += f"{translate('Name')}: {info['fullname'] or ''}\n"
+    title_txt += '%s: %s\n' % (
+        translate('Social security number'),
+        info['hetu'] if info['hetu'] else translate('unknown'),
+    )
+    age_str = '%d %s' % (age, translate('years')) if age else translate('unknown')
+    title_txt += f"{translate('Age at time of measurement')}: {age_str}\n"
+    title_txt += f"{translate('Session')}: {sessiondir}\n"
+    if info['session_description']:
+        title_txt += f"{translate('Description')}: {info['session_description']}\n"
+    title_txt += '%s: %s\n' % (
+        translate('Session date'),
+        session_t.strftime('%d.%m.%Y'),
+    )
+    title_txt += f"{translate('Patient code')}: {sessionpath.parent.name}\n"
+    return title_txt
+
+
+def create_pdf_report(sessionpath, info, write_timedist=True, write_extracted=True):
+    """Create the pdf report, reusing cached figures if possible.
+
+    Parameters
+    ----------
+    sessionpath : Path
+        The session directory.
+    info : dict
+        The patient info (see gaitutils sessionutils.load_info()).
+    write_timedist, write_extracted : bool
+        Also write the time-distance parameters and curve extracted values
+        into text files (see gaitutils pdf.create_report()).
+
+    Returns
+    -------
+    bool
+        Whether cached figures were used.
+    """
+    sessionpath = Path(sessionpath)
+    sessiondir = sessionpath.name
+    hetu = info['hetu'] or ''
+    fingerprint = session_fingerprint(sessionpath, hetu)
+    age = age_from_hetu(hetu, sessionutils.get_session_date(sessionpath)) if hetu else None
+
+    cached = _load_cache(sessionpath, fingerprint)
+    if not (used_cache := 'pdf_figs' in cached):
+        figs, texts = _make_data_figures(sessionpath, age)
+        cached.update(fingerprint=fingerprint, pdf_figs=pickle.dumps(figs), pdf_texts=texts)
+        _save_cache(sessionpath, cached)
+    # unpickle also new figures, since adding the headers modifies them
+    figs, texts = pickle.loads(cached['pdf_figs']), cached['pdf_texts']
+
+    header = '%s: %s %s: %s' % (
+        translate('Name'),
+        info['fullname'] or '',
+        translate('Social security number'),
+        hetu,
+    )
+    pdfpath = sessionpath / f'{sessiondir}.pdf'
+    logger.debug(f'creating multipage pdf {pdfpath}')
+    with PdfPages(pdfpath) as pdf:
+        _savefig(pdf, _make_text_fig(_title_text(sessionpath, info, age)))
+        for fig, footer in figs.values():
+            _savefig(pdf, fig, header, footer)
+
+    for write, key in [(write_timedist, 'time_distance'), (write_extracted, 'curve_values')]:
+        if write:
+            txt_path = sessionpath / f'{sessiondir}_{key}.txt'
+            with io.open(txt_path, 'w', encoding='utf8') as f:
+                logger.debug(f'writing {txt_path}')
+                f.write(texts[key])
+    return used_cache
+
+
+def create_web_report(sessionpath, info):
+    """Create the web report, recreating the figures only if the fingerprint changed"""
+    sessionpath = Path(sessionpath)
+    fingerprint = session_fingerprint(sessionpath, info['hetu'])
+    cached = _load_cache(sessionpath, fingerprint)
+    recreate = not cached.get('web')
+    web.dash_report(sessions=[sessionpath], info=info, recreate_plots=recreate)
+    if recreate:
+        cached.update(fingerprint=fingerprint, web=True)
+        _save_cache(sessionpath, cached)
+    return not recreate
+
+
+def create_reports(sessionpath, info, write_timedist=True, write_extracted=True):
+    """Create the web and pdf reports for a session, reusing cached figures"""
+    web_cached = create_web_report(sessionpath, info)
+    pdf_cached = create_pdf_report(
+        sessionpath, info, write_timedist=write_timedist, write_extracted=write_extracted
+    )
+    print(
+        f'web report: {"cached" if web_cached else "new"} figures, '
+        f'pdf report: {"cached" if pdf_cached else "new"} figures'
+    )
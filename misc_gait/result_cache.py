@@ -0,0 +1,295 @@
+# -*- coding: utf-8 -*-
+"""
+On-disk cache for per-trial processing results.
+
+Entries are keyed by the identity of the source file (size + mtime by default,
+or a hash of the file contents), the identity of the files it depends on (by
+default, the Eclipse .enf file of the trial, which has e.g. the trial tag and
+the forceplate info) and by the processing parameters, so a batch rerun only
+processes trials (or parameter sets) that are new or have changed.
+Results flagged as failed (a true 'failed' item) are not stored, so the trial
+is processed again on the next run.
+Results must be dicts (possibly nested) of ndarrays, numbers and strings; they
+are stored as compressed .npz files. The cache is bounded in size, and the
+least recently used entries are evicted first.
+
+Usage:
+
+    cache = ResultCache(CACHE_DIR, max_size=2e9)
+    params = {'hpf': 5, 'lpf': 10, **cfg_params('emg', 'trial')}
+    result = cache.get_or_compute(c3dfile, _process_trial, params)
+
+To invalidate entries from the command line:
+
+    python result_cache.py CACHE_DIR --clear
+    python result_cache.py CACHE_DIR --invalidate file1.c3d file2.c3d
+    python result_cache.py CACHE_DIR --info
+
+requires: numpy
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import os.path as op
+import re
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# separator for flattened dict keys in the .npz files
+_SEP = '/'
+
+
+def _hash_file(fname, blocksize=2**20):
+    """Return SHA1 hash of file contents"""
+    h = hashlib.sha1()
+    with open(fname, 'rb') as f:
+        while block := f.read(blocksize):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _hash_str(s):
+    return hashlib.sha1(s.encode('utf-8')).hexdigest()
+
+
+def trial_enf_files(fname):
+    """Return the possible Eclipse .enf files of a trial file.
+
+    The names are the same that gaitutils Trial looks for: NAME.Trial.enf, or
+    the older style NAME.TrialNN.enf if the trial name ends with a number NN.
+    """
+    trialname = op.splitext(fname)[0]
+    enfs = [trialname + '.Trial.enf']
+    if m := re.search(r'(\d+)$', op.basename(trialname)):
+        enfs.append(f'{trialname}.Trial{m.group(1)}.enf')
+    return enfs
+
+
+def cfg_params(*sections):
+    """Return gaitutils cfg settings from given sections as a dict.
+
+    E.g. cfg_params('emg', 'trial') returns the items of cfg.emg and
+    cfg.trial. The values are converted to strings, so the result can be
+    used as cache parameters.
+    """
+    from gaitutils import cfg
+
+    params = dict()
+    for secname in sections:
+        sec = cfg[secname]
+        for itemname, _ in sec:
+            params[f'cfg.{secname}.{itemname}'] = repr(getattr(sec, itemname))
+    return params
+
+
+def _flatten(result, prefix=''):
+    """Flatten a nested dict into a dict of arrays with path-like keys"""
+    flat = dict()
+    for key, val in result.items():
+        key = str(key)
+        if _SEP in key:
+            raise ValueError(f'cannot cache dict key containing {_SEP}: {key}')
+        if isinstance(val, dict):
+            flat.update(_flatten(val, prefix + key + _SEP))
+            # mark (possibly empty) dicts, so they can be restored
+            flat[prefix + key + _SEP] = np.array(0)
+        else:
+            try:
+                arr = np.asarray(val)
+            except ValueError:  # e.g. ragged lists
+                arr = None
+            # object arrays (e.g. from None) would need pickling
+            if arr is None or arr.dtype.hasobject:
+                raise ValueError(
+                    f'cannot cache value of {prefix + key} (type {type(val).__name__}); '
+                    'values must be array-like, numbers or strings'
+                )
+            flat[prefix + key] = arr
+    return flat
+
+
+def _unflatten(flat):
+    """Inverse of _flatten()"""
+    result = dict()
+    for path in sorted(flat):
+        keys = path.split(_SEP)
+        d = result
+        for key in keys[:-1]:
+            d = d.setdefault(key, dict())
+        if keys[-1]:  # not a dict marker
+            val = flat[path]
+            d[keys[-1]] = val.item() if val.ndim == 0 else val
+    return result
+
+
+class ResultCache:
+    """On-disk cache of per-trial results.
+
+    Parameters
+    ----------
+    cachedir : str
+        Directory for the cache files. Created if necessary.
+    max_size : float
+        Maximum total size of the cache in bytes. When exceeded, least
+        recently used entries are deleted.
+    hash_content : bool
+        If True, identify source files by a hash of their contents. Otherwise
+        use the file size and modification time, which is much faster on
+        network drives.
+    dependencies : callable, optional
+        Function returning a list of other files that the result for a source
+        file depends on; these are identified in the same way as the source
+        file (missing files are allowed). By default, the trial .enf files.
+    """
+
+    def __init__(
+        self, cachedir, max_size=2e9, hash_content=False, dependencies=trial_enf_files
+    ):
+        self.cachedir = cachedir
+        self.max_size = max_size
+        self.hash_content = hash_content
+        self.dependencies = dependencies
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cachedir, exist_ok=True)
+
+    def _source_id(self, fname):
+        """Identifier for the source file path"""
+        return _hash_str(op.normcase(op.abspath(fname)))[:16]
+
+    def _file_key(self, fname):
+        """Identity of the file contents"""
+        if self.hash_content:
+            return _hash_file(fname)
+        st = os.stat(fname)
+        return f'{st.st_size}_{st.st_mtime_ns}'
+
+    def _entry_path(self, fname, params):
+        """Cache file path for given source file and parameters"""
+        file_key = self._file_key(fname)
+        if self.dependencies is not None:
+            for dep in self.dependencies(fname):
+                dep_key = self._file_key(dep) if op.isfile(dep) else 'missing'
+                file_key += f'\n{op.basename(dep)}:{dep_key}'
+        params_key = json.dumps(params, sort_keys=True, default=repr)
+        key = _hash_str(file_key + params_key)
+        return op.join(self.cachedir, f'{self._source_id(fname)}_{key}.npz')
+
+    def get(self, fname, params):
+        """Return cached result, or None if not found"""
+        path = self._entry_path(fname, params)
+        if not op.isfile(path):
+            self.misses += 1
+            return None
+        try:
+            with np.load(path, allow_pickle=False) as npz:
+                result = _unflatten(dict(npz))
+        except (OSError, ValueError) as e:
+            logger.warning(f'cannot read cache entry {path}: {e}')
+            self.misses += 1
+            return None
+        os.utime(path)  # mark as recently used
+        self.hits += 1
+        return result
+
+    def put(self, fname, params, result):
+        """Store a result in the cache. Failed results are not stored."""
+        if result.get('failed'):
+            logger.debug(f'not caching failed result for {fname}')
+            return
+        flat = _flatten(result)
+        path = self._entry_path(fname, params)
+        # write into a temp file that _entries() skips, then rename
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        try:
+            with open(tmp_path, 'wb') as f:
+                np.savez_compressed(f, **flat)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if op.isfile(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self.evict()
+
+    def get_or_compute(self, fname, func, params):
+        """Return cached result for fname, or compute it as func(fname).
+
+        params should contain all the settings that affect the result (e.g.
+        filter parameters and relevant cfg items, see cfg_params()).
+        """
+        result = self.get(fname, params)
+        if result is None:
+            result = func(fname)
+            self.put(fname, params, result)
+        return result
+
+    def _entries(self):
+        """Return list of (path, size, mtime) for cache entries"""
+        entries = list()
+        with os.scandir(self.cachedir) as it:
+            for entry in it:
+                if entry.is_file() and entry.name.endswith('.npz'):
+                    st = entry.stat()
+                    entries.append((entry.path, st.st_size, st.st_mtime))
+        return entries
+
+    def size(self):
+        """Total size of cache entries in bytes"""
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self):
+        """Delete least recently used entries until the cache fits max_size"""
+        entries = sorted(self._entries(), key=lambda e: e[2])
+        total = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if total <= self.max_size:
+                break
+            logger.debug(f'evicting {path}')
+            try:
+                os.remove(path)
+            except FileNotFoundError:  # already removed by another process
+                pass
+            total -= size
+
+    def invalidate(self, fname):
+        """Delete all entries for a given source file"""
+        prefix = self._source_id(fname) + '_'
+        n = 0
+        for path, _, _ in self._entries():
+            if op.basename(path).startswith(prefix):
+                os.remove(path)
+                n += 1
+        return n
+
+    def clear(self):
+        """Delete all entries"""
+        for path, _, _ in self._entries():
+            os.remove(path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Manage the result cache')
+    parser.add_argument('cachedir', help='cache directory')
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--clear', action='store_true', help='delete all entries')
+    group.add_argument(
+        '--invalidate', nargs='+', metavar='FILE', help='delete entries for FILE(s)'
+    )
+    group.add_argument('--info', action='store_true', help='print cache info')
+    args = parser.parse_args()
+
+    cache = ResultCache(args.cachedir)
+    if args.clear:
+        cache.clear()
+        print(f'cleared cache {args.cachedir}')
+    elif args.invalidate:
+        for fname in args.invalidate:
+            n = cache.invalidate(fname)
+            print(f'{fname}: deleted {n} entries')
+    else:
+        entries = cache._entries()
+        print(f'{len(entries)} entries, {cache.size() / 2**20:.1f} MB')
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""
+Review plotting of sessions with several layouts.
+
+gaitutils viz.plots._plot_sessions() creates new Trial instances on every
+call, so plotting a session with each of the review layouts reads and
+normalizes all the trials once per layout. ReviewSession loads the tagged
+trials of a session once, reads the data needed by the layouts up front and
+memoizes the normalized cycle data, and then builds all the layouts from the
+same trials:
+
+    rs = ReviewSession(sessionpath)
+    figs = rs.plot_layouts(cfg.plot.review_layouts, backend='plotly')
+
+review_sessions() does this for several sessions, loading them in parallel.
+
+requires: gaitutils
+"""
+
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from gaitutils import GaitDataError, cfg, models, sessionutils, trial
+from gaitutils.viz import layouts
+from gaitutils.viz.plots import plot_trials
+
+logger = logging.getLogger(__name__)
+
+# threads for loading sessions and building layouts
+NWORKERS = 4
+
+
+class ReviewTrial(trial.Trial):
+    """Trial that memoizes the (normalized) model and EMG data.
+
+    The plotting functions request the same variables and cycles for each
+    layout; the data is read and normalized only on first request.
+    """
+
+    def __init__(self, source):
+        self._normalized = dict()
+        super().__init__(source)
+
+    def _memoized(self, key, func):
+        if key not in self._normalized:
+            self._normalized[key] = func()
+        return self._normalized[key]
+
+    def get_model_data(self, var, cycle=None):
+        return self._memoized(
+            ('model', var, cycle),
+            lambda: super(ReviewTrial, self).get_model_data(var, cycle),
+        )
+
+    def get_emg_data(self, ch, cycle=None, envelope=False):
+        return self._memoized(
+            ('emg', ch, cycle, envelope),
+            lambda: super(ReviewTrial, self).get_emg_data(ch, cycle, envelope),
+        )
+
+
+def _layout_vars(layout_names):
+    """Return the variables used by the given layouts"""
+    return {
+        var
+        for lout in layout_names
+        for row in layouts.get_layout(lout)
+        for var in row
+        if var is not None
+    }
+
+
+class ReviewSession:
+    """Tagged trials of a session, loaded once for plotting.
+
+    Parameters
+    ----------
+    sessionpath : Path
+        The session directory.
+    tags : list, optional
+        Eclipse tags of the trials. If None, taken from cfg.
+    """
+
+    def __init__(self, sessionpath, tags=None):
+        self.sessionpath = Path(sessionpath)
+        if tags is None:
+            tags = cfg.eclipse.tags
+        c3ds = sessionutils._get_tagged_dynamic_c3ds_from_sessions(
+            [self.sessionpath], tags=tags
+        )
+        self.trials = [ReviewTrial(c3d) for c3d in c3ds]
+
+    def preload(self, layout_names):
+        """Read the model and EMG data needed by the layouts.
+
+        Reading the data up front means that the layouts can then be built
+        concurrently, without reading the same data in several threads.
+        """
+        allvars = _layout_vars(layout_names)
+        model_vars = {models.model_from_var(var): var for var in allvars}
+        model_vars.pop(None, None)
+        needs_emg = any(models.model_from_var(var) is None for var in allvars)
+        for tr in self.trials:
+            for var in model_vars.values():  # one var per model reads the model
+                try:
+                    tr._get_modelvar(var)
+                except GaitDataError:
+                    logger.debug(f'{tr.trialname}: no data for {var}')
+            if needs_emg:
+                try:
+                    tr.emg.data
+                except GaitDataError:
+                    logger.debug(f'{tr.trialname}: no EMG data')
+
+    def plot_layouts(self, layout_names, backend=None, concurrent=True):
+        """Plot the session with each of the given layouts.
+
+        Parameters
+        ----------
+        layout_names : list
+            The layouts.
+        backend : str, optional
+            The plotting backend ('plotly' or 'matplotlib').
+        concurrent : bool
+            Build the layouts in parallel threads.
+
+        Returns
+        -------
+        dict
+            Dict of layout name: figure.
+        """
+        self.preload(layout_names)
+
+        def _plot(lout):
+            return plot_trials(
+                self.trials,
+                layout=lout,
+                backend=backend,
+                figtitle=self.sessionpath.name,
+            )
+
+        if not concurrent:
+            return {lout: _plot(lout) for lout in layout_names}
+        with ThreadPoolExecutor(max_workers=NWORKERS) as executor:
+            return dict(zip(layout_names, executor.map(_plot, layout_names)))
+
+
+def review_sessions(sessions, layout_names, backend=None):
+    """Load sessions in parallel and plot each with the given layouts.
+
+    Returns
+    -------
+    dict
+        Dict of session: {layout name: figure}.
+    """
+
+    def _load_and_plot(session):
+        return ReviewSession(session).plot_layouts(
+            layout_names, backend=backend, concurrent=False
+        )
+
+    with ThreadPoolExecutor(max_workers=NWORKERS) as executor:
+        return dict(zip(sessions, executor.map(_load_and_plot, sessions)))
@@ -0,0 +1,314 @@
+# -*- coding: utf-8 -*-
+"""
+Verified, resumable parallel copying of session directories.
+
+copy_session() copies the files of a directory tree concurrently (a bounded
+thread pool helps a lot over SMB, where per-file latency dominates) and
+computes a SHA-256 checksum of each file while writing it, so the source is
+read only once. The checksums, sizes and modification times are kept in a
+manifest next to the source directory (SESSION.copy_manifest.json), which is
+updated as files complete. If the copy is interrupted, running it again
+copies only the files that are missing from the manifest or have changed.
+
+After the copy, the destination is verified against the manifest (by file
+existence and size, or with reread=True by reading the files back and
+comparing the checksums), and a verification report is written into the
+manifest. The report includes a plain SHA-256 digest over the manifest
+entries. It is not a signature, only a consistency check against a manifest
+that was partly written or edited after the report. check_report() confirms
+that the destination was verified and that the source has not changed since;
+the local data should be deleted only if it passes:
+
+    report = copy_session(sessiondir, destdir)
+    if check_report(sessiondir):
+        shutil.rmtree(sessiondir)
+
+requires: none
+"""
+
+import argparse
+import datetime
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# concurrent file copies
+NWORKERS = 8
+# read/write block size
+BLOCK_SIZE = 1024 * 1024
+# write the manifest after this many copied files (and at the end)
+MANIFEST_FLUSH_FILES = 20
+MANIFEST_SUFFIX = '.copy_manifest.json'
+PART_SUFFIX = '.copypart'
+
+
+def manifest_file(srcdir):
+    """Return the manifest filename for a source directory"""
+    srcdir = Path(srcdir)
+    return srcdir.parent / (srcdir.name + MANIFEST_SUFFIX)
+
+
+def _scan_tree(srcdir):
+    """Return (dirs, files) relative to srcdir; files as dict of relpath: stat"""
+    dirs, files = list(), dict()
+    stack = [Path(srcdir)]
+    while stack:
+        dir = stack.pop()
+        with os.scandir(dir) as it:
+            for entry in it:
+                relpath = Path(entry.path).relative_to(srcdir).as_posix()
+                if entry.is_dir(follow_symlinks=False):
+                    dirs.append(relpath)
+                    stack.append(Path(entry.path))
+                elif entry.is_file():
+                    files[relpath] = entry.stat()
+    return dirs, files
+
+
+def _file_sha256(fname):
+    sha = hashlib.sha256()
+    with open(fname, 'rb') as f:
+        while block := f.read(BLOCK_SIZE):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def _copy_file(src, dest):
+    """Copy a file, computing the checksum while writing.
+
+    The data is written into a temporary file, which is renamed when
+    complete, so an interrupted copy never leaves a truncated file in place.
+    Returns the SHA-256 checksum.
+    """
+    sha = hashlib.sha256()
+    part = dest.with_name(dest.name + PART_SUFFIX)
+    with open(src, 'rb') as fsrc, open(part, 'wb') as fdest:
+        while block := fsrc.read(BLOCK_SIZE):
+            sha.update(block)
+            fdest.write(block)
+    shutil.copystat(src, part)
+    os.replace(part, dest)
+    return sha.hexdigest()
+
+
+def _load_manifest(srcdir, destdir):
+    """Load the manifest; returns an empty one if missing or for another destination"""
+    fname = manifest_file(srcdir)
+    if fname.is_file():
+        with open(fname, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest.get('dest') == str(destdir):
+            return manifest
+        logger.warning(f'{fname} is for another destination, ignoring it')
+    return {'src': str(srcdir), 'dest': str(destdir), 'files': dict(), 'report': None}
+
+
+def _save_manifest(srcdir, manifest):
+    fname = manifest_file(srcdir)
+    tmpname = fname.with_name(fname.name + '.tmp')
+    with open(tmpname, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmpname, fname)
+
+
+def _manifest_digest(manifest):
+    """Digest over the source, destination and the file entries"""
+    sha = hashlib.sha256()
+    sha.update(f"{manifest['src']}\n{manifest['dest']}\n".encode('utf-8'))
+    for relpath in sorted(manifest['files']):
+        entry = manifest['files'][relpath]
+        sha.update(
+            f"{relpath}\t{entry['size']}\t{entry['mtime_ns']}\t{entry['sha256']}\n".encode(
+                'utf-8'
+            )
+        )
+    return sha.hexdigest()
+
+
+def _entry_matches(entry, st):
+    return (
+        entry is not None
+        and entry['size'] == st.st_size
+        and entry['mtime_ns'] == st.st_mtime_ns
+    )
+
+
+def verify_copy(srcdir, destdir, manifest, reread=False):
+    """Verify the destination against the manifest.
+
+    Checks that every source file is in the manifest with the current size
+    and modification time, and that the destination files exist with the
+    same size. With reread=True, also the checksums of the destination files
+    are computed and compared.
+
+    Returns
+    -------
+    dict
+        The problems found as relpath: description (empty if the copy is ok).
+    """
+    destdir = Path(destdir)
+    _, files = _scan_tree(srcdir)
+    errors = dict()
+    for relpath, st in files.items():
+        entry = manifest['files'].get(relpath)
+        if not _entry_matches(entry, st):
+            errors[relpath] = 'not copied, or changed after copying'
+            continue
+        dest = destdir / relpath
+        try:
+            dest_size = dest.stat().st_size
+        except FileNotFoundError:
+            errors[relpath] = 'missing from destination'
+            continue
+        if dest_size != entry['size']:
+            errors[relpath] = 'size differs on destination'
+        elif reread and _file_sha256(dest) != entry['sha256']:
+            errors[relpath] = 'checksum differs on destination'
+    for relpath in set(manifest['files']) - set(files):
+        errors[relpath] = 'in manifest but not in source'
+    return errors
+
+
+def copy_session(srcdir, destdir, nworkers=NWORKERS, reread=False):
+    """Copy a directory tree with verification.
+
+    Parameters
+    ----------
+    srcdir : Path
+        The source directory.
+    destdir : Path
+        The destination directory; created if needed. If it exists, e.g. from
+        an interrupted copy, only missing or changed files are copied.
+    nworkers : int
+        Number of concurrent file copies.
+    reread : bool
+        If True, verify the destination files by reading them back and
+        comparing the checksums (otherwise, by existence and size).
+
+    Returns
+    -------
+    dict
+        The copy report (also stored in the manifest).
+
+    Raises
+    ------
+    RuntimeError
+        If the verification fails.
+    """
+    srcdir, destdir = Path(srcdir), Path(destdir)
+    manifest = _load_manifest(srcdir, destdir)
+    manifest['report'] = None
+    dirs, files = _scan_tree(srcdir)
+    destdir.mkdir(parents=True, exist_ok=True)
+    for dir in dirs:
+        (destdir / dir).mkdir(exist_ok=True)
+
+    todo = {
+        relpath: st
+        for relpath, st in files.items()
+        if not (
+            _entry_matches(manifest['files'].get(relpath), st)
+            and (destdir / relpath).is_file()
+        )
+    }
+    nbytes = sum(st.st_size for st in todo.values())
+    print(
+        f'copying {srcdir} -> {destdir}: {len(todo)} of {len(files)} files, '
+        f'{nbytes / 1e6:.1f} MB'
+    )
+    t0 = time.perf_counter()
+    # save the manifest also on errors, so an interrupted copy can be resumed
+    try:
+        with ThreadPoolExecutor(max_workers=nworkers) as executor:
+            futures = {
+                executor.submit(_copy_file, srcdir / relpath, destdir / relpath): relpath
+                for relpath in todo
+            }
+            for n, future in enumerate(as_completed(futures), 1):
+                relpath = futures[future]
+                st = todo[relpath]
+                manifest['files'][relpath] = {
+                    'size': st.st_size,
+                    'mtime_ns': st.st_mtime_ns,
+                    'sha256': future.result(),
+                }
+                if n % MANIFEST_FLUSH_FILES == 0:
+                    _save_manifest(srcdir, manifest)
+    finally:
+        _save_manifest(srcdir, manifest)
+    elapsed = time.perf_counter() - t0
+    # drop entries of files that were removed from the source
+    manifest['files'] = {
+        relpath: entry for relpath, entry in manifest['files'].items() if relpath in files
+    }
+
+    errors = verify_copy(srcdir, destdir, manifest, reread=reread)
+    # failed files will be copied again on the next run
+    for relpath in errors:
+        manifest['files'].pop(relpath, None)
+    errors = [f'{relpath}: {problem}' for relpath, problem in errors.items()]
+    report = {
+        'verified': not errors,
+        'reread': reread,
+        'errors': errors,
+        'nfiles': len(manifest['files']),
+        'nbytes': sum(entry['size'] for entry in manifest['files'].values()),
+        'copied_files': len(todo),
+        'copy_time': elapsed,
+        'finished': datetime.datetime.now().isoformat(timespec='seconds'),
+        'digest': _manifest_digest(manifest),
+    }
+    manifest['report'] = report
+    _save_manifest(srcdir, manifest)
+    if errors:
+        raise RuntimeError(f'copy of {srcdir} failed verification: {errors[:10]}')
+    rate = nbytes / elapsed / 1e6 if elapsed > 0 else 0
+    print(f'copied and verified {srcdir} in {elapsed:.1f} s ({rate:.1f} MB/s)')
+    return report
+
+
+def check_report(srcdir):
+    """Check that a source directory was copied and verified.
+
+    Returns True only if the manifest has a successful verification report
+    whose digest matches the manifest entries (an unkeyed checksum, so this
+    only guards against inconsistent manifests), and the source files still
+    match the manifest (nothing was added or modified after the copy).
+    """
+    fname = manifest_file(srcdir)
+    if not fname.is_file():
+        logger.warning(f'no copy manifest for {srcdir}')
+        return False
+    with open(fname, 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    report = manifest.get('report')
+    if not report or not report['verified']:
+        logger.warning(f'copy of {srcdir} was not verified')
+        return False
+    if report['digest'] != _manifest_digest(manifest):
+        logger.warning(f'copy manifest of {srcdir} does not match its report')
+        return False
+    _, files = _scan_tree(srcdir)
+    if files.keys() != manifest['files'].keys() or not all(
+        _entry_matches(manifest['files'][relpath], st) for relpath, st in files.items()
+    ):
+        logger.warning(f'{srcdir} has changed after the copy')
+        return False
+    return True
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Verified copy of a directory tree')
+    parser.add_argument('srcdir', help='source directory')
+    parser.add_argument('destdir', help='destination directory')
+    parser.add_argument('--workers', type=int, default=NWORKERS, help='concurrent copies')
+    parser.add_argument('--reread', action='store_true', help='verify by reading back')
+    args = parser.parse_args()
+    copy_session(args.srcdir, args.destdir, nworkers=args.workers, reread=args.reread)
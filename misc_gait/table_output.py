@@ -0,0 +1,313 @@
+# -*- coding: utf-8 -*-
+"""
+Output layer for writing tables (e.g. gait cycle data) into XLSX, CSV or
+Parquet files.
+
+Usage:
+
+    with open_table_writer('results.xlsx') as writer:
+        table = writer.add_table('trial 1', columns, meta=[('Trial name:', fn)])
+        for row in rows:
+            table.append(row)
+
+Each table goes to its own sheet (XLSX) or its own file (CSV/Parquet, written
+into a directory named after the output file). If a title is already used, a
+numeric suffix is added to it, e.g. 'trial 1 (2)'.
+
+CSV rows are written to the file as they are appended. XLSX and Parquet rows
+are buffered until the table is finished by the next add_table() or close():
+the XLSX column widths must be set before the first row is written, and
+Parquet is a columnar format. Only the current table is kept in memory. The
+XLSX output uses the openpyxl write-only mode with shared styles.
+
+requires: openpyxl; pandas and pyarrow for Parquet output
+"""
+
+import csv
+import os
+import os.path as op
+import openpyxl
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font
+from openpyxl.utils import get_column_letter
+
+# shared style for headers
+BOLD_FONT = Font(bold=True)
+
+
+class Table:
+    """A table that is being written.
+
+    Use TableWriter.add_table() to create tables.
+    """
+
+    def __init__(
+        self, writer, title, columns=None, meta=None, label_col=False, first_row=0, first_col=0
+    ):
+        self.writer = writer
+        self.title = title
+        self.columns = list(columns) if columns is not None else None
+        self.meta = list(meta) if meta is not None else list()
+        self.label_col = label_col
+        self.first_row = first_row
+        self.first_col = first_col
+        self.nrows = 0
+        self.widths = dict()  # column index -> width
+        self._rows = list()
+        for row in self.meta:
+            self._update_widths(row)
+        if self.columns is not None:
+            self._update_widths(self.columns)
+
+    def _update_widths(self, row):
+        for k, val in enumerate(row):
+            if val:
+                self.widths[k] = max(self.widths.get(k, 0), len(str(val)))
+
+    def append(self, row):
+        """Append a row of values"""
+        row = list(row)
+        self._update_widths(row)
+        self.writer._append_row(self, row)
+        self.nrows += 1
+
+    def _pop_rows(self):
+        """Return the buffered rows and clear the buffer"""
+        rows, self._rows = self._rows, list()
+        return rows
+
+
+class TableWriter:
+    """Base class for table writers"""
+
+    # max. length of table titles, None for no limit
+    max_title_len = None
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._table = None
+        self._titles = set()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def add_table(
+        self, title, columns=None, meta=None, label_col=False, first_row=0, first_col=0
+    ):
+        """Start a new table. The previous table is finished.
+
+        Parameters
+        ----------
+        title : str
+            Title of the table (sheet name or file name). A numeric suffix is
+            added if the title is already used by another table.
+        columns : list, optional
+            The column headers.
+        meta : list, optional
+            List of (key, value) tuples to write before the table (e.g. trial
+            info). Some formats store these separately from the table data.
+        label_col : bool
+            Whether the first column contains row labels (written in bold in
+            XLSX output).
+        first_row, first_col : int
+            Number of empty rows and columns before the table (XLSX output
+            only; other formats ignore these).
+
+        Returns
+        -------
+        Table
+            The new table. Rows can be appended using Table.append().
+        """
+        self._finish_table()
+        self._table = Table(
+            self,
+            self._unique_title(title),
+            columns=columns,
+            meta=meta,
+            label_col=label_col,
+            first_row=first_row,
+            first_col=first_col,
+        )
+        self._start_table(self._table)
+        return self._table
+
+    def _unique_title(self, title):
+        """Return the title, with a suffix added if it is already used"""
+        title = str(title)[: self.max_title_len]
+        unique, n = title, 1
+        # compare case-insensitively, like Excel and Windows file names
+        while unique.lower() in self._titles:
+            n += 1
+            suffix = ' (%d)' % n
+            maxlen = self.max_title_len - len(suffix) if self.max_title_len else None
+            unique = title[:maxlen] + suffix
+        self._titles.add(unique.lower())
+        return unique
+
+    def _finish_table(self):
+        if self._table is not None:
+            self._write_table(self._table)
+            self._table = None
+
+    def _start_table(self, table):
+        """Called when a table is added"""
+        pass
+
+    def _append_row(self, table, row):
+        """Called for each appended row; the default is to buffer the rows"""
+        table._rows.append(row)
+
+    def _write_table(self, table):
+        """Called when a table is finished"""
+        raise NotImplementedError
+
+    def close(self):
+        self._finish_table()
+
+
+class XlsxTableWriter(TableWriter):
+    """Write tables into a XLSX workbook, one table per sheet.
+
+    The workbook is written in openpyxl write-only mode, so finished sheets
+    are not held in memory.
+    """
+
+    max_title_len = 31
+
+    def __init__(self, filename):
+        super().__init__(filename)
+        self.wb = openpyxl.Workbook(write_only=True)
+
+    def _bold(self, ws, val):
+        cell = WriteOnlyCell(ws, value=val)
+        cell.font = BOLD_FONT
+        return cell
+
+    def _write_table(self, table):
+        ws = self.wb.create_sheet(title=table.title)
+        # column widths must be set before any rows are written
+        for k, width in table.widths.items():
+            ws.column_dimensions[get_column_letter(k + 1 + table.first_col)].width = width
+        indent = [None] * table.first_col
+        for _ in range(table.first_row):
+            ws.append([])
+        if table.meta:
+            ws.append([])
+            for key, val in table.meta:
+                ws.append(indent + [self._bold(ws, key), val])
+        if table.columns is not None:
+            ws.append(indent + [self._bold(ws, val) for val in table.columns])
+        for row in table._pop_rows():
+            if table.label_col and row:
+                row[0] = self._bold(ws, row[0])
+            ws.append(indent + row)
+
+    def close(self):
+        super().close()
+        if not self.wb.worksheets:
+            self.wb.create_sheet()
+        self.wb.save(self.filename)
+
+
+class CsvTableWriter(TableWriter):
+    """Write tables into CSV files, one file per table.
+
+    The files are written into a directory named after the output file. Table
+    metadata is written as key, value rows before the header. Rows are written
+    as they are appended.
+    """
+
+    def __init__(self, filename):
+        super().__init__(filename)
+        self.outdir = op.splitext(filename)[0]
+        os.makedirs(self.outdir, exist_ok=True)
+        self._file = None
+        self._writer = None
+
+    def _start_table(self, table):
+        fname = op.join(self.outdir, table.title + '.csv')
+        self._file = open(fname, 'w', newline='', encoding='utf-8')
+        self._writer = csv.writer(self._file)
+        for key, val in table.meta:
+            self._writer.writerow([key, val])
+        if table.columns is not None:
+            self._writer.writerow(table.columns)
+
+    def _append_row(self, table, row):
+        self._writer.writerow(row)
+
+    def _write_table(self, table):
+        self._file.close()
+        self._file = self._writer = None
+
+
+class ParquetTableWriter(TableWriter):
+    """Write tables into Parquet files, one file per table.
+
+    The files are written into a directory named after the output file. Table
+    metadata is stored as key-value metadata in the Parquet schema. Empty rows
+    (used as spacers in the XLSX layout) are dropped.
+    """
+
+    def __init__(self, filename):
+        try:
+            import pandas  # noqa: F401
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise RuntimeError('Parquet output requires pandas and pyarrow')
+        super().__init__(filename)
+        self.outdir = op.splitext(filename)[0]
+        os.makedirs(self.outdir, exist_ok=True)
+
+    def _write_table(self, table):
+        import pandas as pd
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        rows = [row for row in table._pop_rows() if row]
+        if table.columns is not None:
+            columns = list(table.columns)
+        else:
+            columns = [None] * max((len(row) for row in rows), default=0)
+        if table.label_col and columns and not columns[0]:
+            columns[0] = 'label'
+        # parquet needs unique string column names
+        columns = [str(col) if col else 'col%d' % k for k, col in enumerate(columns)]
+        df = pd.DataFrame(rows, columns=columns)
+        pa_table = pa.Table.from_pandas(df, preserve_index=False)
+        meta = dict(pa_table.schema.metadata or {})
+        meta.update({str(key).encode(): str(val).encode() for key, val in table.meta})
+        pa_table = pa_table.replace_schema_metadata(meta)
+        pq.write_table(pa_table, op.join(self.outdir, table.title + '.parquet'))
+
+
+TABLE_WRITERS = {
+    '.xlsx': XlsxTableWriter,
+    '.csv': CsvTableWriter,
+    '.parquet': ParquetTableWriter,
+}
+
+
+def open_table_writer(filename):
+    """Return a table writer according to the file extension"""
+    ext = op.splitext(filename)[1].lower()
+    if ext not in TABLE_WRITERS:
+        raise ValueError('Unsupported output format: %s' % ext)
+    return TABLE_WRITERS[ext](filename)
+
+
+def write_rows(filename, rows, title='Sheet', columns=None, first_row=0, first_col=0):
+    """Write a list of rows into a single table.
+
+    first_row and first_col specify the number of empty rows and columns
+    before the table (XLSX output only).
+    """
+    with open_table_writer(filename) as writer:
+        table = writer.add_table(
+            title, columns=columns, first_row=first_row, first_col=first_col
+        )
+        for row in rows:
+            table.append(row)
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for nexus_cache.py, using a fake Nexus SDK object.
+
+requires: pytest
+"""
+
+from nexus_cache import CachedNexus
+
+
+class FakeNexus:
+    """Records the SDK calls that reach 'Nexus'"""
+
+    def __init__(self):
+        self.calls = list()
+        self.outputs = {('Subj', 'LGas_Rectified'): [[1.0, 2.0]]}
+
+    def GetModelOutput(self, subj, var):
+        self.calls.append(('GetModelOutput', subj, var))
+        return self.outputs.get((subj, var), []), [True, True]
+
+    def GetDeviceDetails(self, id_, **kwargs):
+        self.calls.append(('GetDeviceDetails', id_, kwargs))
+        return ('Myon EMG', kwargs)
+
+    def SetModelOutput(self, subj, var, data, exists):
+        self.calls.append(('SetModelOutput', subj, var))
+        self.outputs[(subj, var)] = data
+
+    def RunPipeline(self, name):
+        self.calls.append(('RunPipeline', name))
+
+
+def test_repeated_reads_cached():
+    fake = FakeNexus()
+    vicon = CachedNexus(fake)
+    for _ in range(3):
+        nums, _ = vicon.GetModelOutput('Subj', 'LGas_Rectified')
+    assert nums == [[1.0, 2.0]]
+    assert fake.calls == [('GetModelOutput', 'Subj', 'LGas_Rectified')]
+    assert (vicon.hits, vicon.misses) == (2, 1)
+
+
+def test_kwargs_are_part_of_key():
+    fake = FakeNexus()
+    vicon = CachedNexus(fake)
+    vicon.GetDeviceDetails(1, full=True)
+    vicon.GetDeviceDetails(1, full=True)
+    vicon.GetDeviceDetails(1, full=False)
+    vicon.GetDeviceDetails(1)
+    assert len(fake.calls) == 3
+    assert vicon.hits == 1
+
+
+def test_unhashable_args_not_cached():
+    fake = FakeNexus()
+    vicon = CachedNexus(fake)
+    for _ in range(2):
+        assert vicon.GetDeviceDetails(1, opts=[1, 2])[1] == {'opts': [1, 2]}
+    assert len(fake.calls) == 2
+    assert vicon.hits == 0
+
+
+def test_write_invalidates():
+    fake = FakeNexus()
+    vicon = CachedNexus(fake)
+    vicon.GetModelOutput('Subj', 'LGas_Rectified')
+    vicon.GetDeviceDetails(1)
+    vicon.SetModelOutput('Subj', 'LGas_Rectified', [[3.0, 4.0]], [True, True])
+    nums, _ = vicon.GetModelOutput('Subj', 'LGas_Rectified')
+    assert nums == [[3.0, 4.0]]
+    vicon.GetDeviceDetails(1)  # not affected by the write
+    assert vicon.hits == 1
+
+
+def test_other_calls_clear_cache():
+    fake = FakeNexus()
+    vicon = CachedNexus(fake)
+    vicon.GetModelOutput('Subj', 'LGas_Rectified')
+    vicon.RunPipeline('Dynamic')
+    vicon.GetModelOutput('Subj', 'LGas_Rectified')
+    assert vicon.misses == 2
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for session_copy.py, copying between two local directories.
+
+requires: pytest
+"""
+
+import json
+import os
+
+import pytest
+
+import session_copy
+from session_copy import check_report, copy_session, manifest_file
+
+
+@pytest.fixture
+def session(tmp_path):
+    """A small session dir with a subdirectory"""
+    srcdir = tmp_path / 'src' / '2024_01_01_session'
+    (srcdir / 'sub').mkdir(parents=True)
+    for k in range(5):
+        (srcdir / f'trial{k}.c3d').write_bytes(os.urandom(10000 + k))
+    (srcdir / 'sub' / 'video.avi').write_bytes(os.urandom(50000))
+    return srcdir, tmp_path / 'dest' / srcdir.name
+
+
+def _read_tree(root):
+    return {
+        p.relative_to(root).as_posix(): p.read_bytes() for p in root.rglob('*') if p.is_file()
+    }
+
+
+def test_copy_and_check(session):
+    srcdir, destdir = session
+    report = copy_session(srcdir, destdir, nworkers=3)
+    assert report['verified'] and report['nfiles'] == 6
+    assert _read_tree(destdir) == _read_tree(srcdir)
+    assert check_report(srcdir)
+    # a source file modified after the copy invalidates the report
+    (srcdir / 'trial0.c3d').write_bytes(b'changed')
+    assert not check_report(srcdir)
+
+
+def test_new_file_invalidates_report(session):
+    srcdir, destdir = session
+    copy_session(srcdir, destdir)
+    (srcdir / 'new.enf').write_text('x')
+    assert not check_report(srcdir)
+    report = copy_session(srcdir, destdir)
+    assert report['copied_files'] == 1
+    assert check_report(srcdir)
+
+
+def test_resume_after_interruption(session, monkeypatch):
+    srcdir, destdir = session
+    copy_file = session_copy._copy_file
+    ncopied = 0
+
+    def _failing_copy(src, dest):
+        nonlocal ncopied
+        if ncopied == 3:
+            raise OSError('network error')
+        ncopied += 1
+        return copy_file(src, dest)
+
+    monkeypatch.setattr(session_copy, '_copy_file', _failing_copy)
+    with pytest.raises(OSError):
+        copy_session(srcdir, destdir, nworkers=1)
+    assert not check_report(srcdir)
+    # the completed files were recorded, so only the rest is copied
+    with open(manifest_file(srcdir), encoding='utf-8') as f:
+        assert len(json.load(f)['files']) == 3
+    monkeypatch.setattr(session_copy, '_copy_file', copy_file)
+    report = copy_session(srcdir, destdir)
+    assert report['copied_files'] == 3
+    assert _read_tree(destdir) == _read_tree(srcdir)
+    assert check_report(srcdir)
+
+
+def test_reread_detects_corruption(session):
+    srcdir, destdir = session
+    copy_session(srcdir, destdir)
+    dest = destdir / 'trial1.c3d'
+    data = bytearray(dest.read_bytes())
+    data[0] ^= 0xFF
+    dest.write_bytes(bytes(data))  # same size, different contents
+    with pytest.raises(RuntimeError, match='checksum differs'):
+        copy_session(srcdir, destdir, reread=True)
+    assert not check_report(srcdir)
+    # the corrupted file is copied again on the next run
+    report = copy_session(srcdir, destdir, reread=True)
+    assert report['copied_files'] == 1
+    assert (destdir / 'trial1.c3d').read_bytes() == (srcdir / 'trial1.c3d').read_bytes()
+
+
+def test_edited_manifest_fails_check(session):
+    srcdir, destdir = session
+    copy_session(srcdir, destdir)
+    fname = manifest_file(srcdir)
+    with open(fname, encoding='utf-8') as f:
+        manifest = json.load(f)
+    manifest['files']['trial2.c3d']['sha256'] = '0' * 64
+    with open(fname, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+    assert not check_report(srcdir)
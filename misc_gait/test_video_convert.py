@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for video_convert.py, using a fake converter command.
+
+requires: pytest
+"""
+
+import os
+import sys
+import time
+
+import pytest
+
+from video_convert import convert_videos, is_up_to_date
+
+# fake converter: logs its start and end times, then writes the output file
+FAKE_CONVERTER = r"""
+import sys, time
+log, vidfile = sys.argv[1], sys.argv[2]
+with open(log, 'a') as f:
+    f.write(f'{time.time()} 1\n')
+time.sleep(0.2)
+if 'broken' not in vidfile:
+    with open(vidfile[:-4] + '.ogv', 'w') as f:
+        f.write('converted')
+with open(log, 'a') as f:
+    f.write(f'{time.time()} -1\n')
+"""
+
+
+def _make_videos(dirpath, n):
+    vidfiles = list()
+    for k in range(n):
+        vidfile = dirpath / f'video{k}.avi'
+        vidfile.write_bytes(b'x' * 1000)
+        vidfiles.append(vidfile)
+    return vidfiles
+
+
+def _max_concurrent(log):
+    """Max. number of converters running at the same time, from the log"""
+    events = sorted(
+        (float(t), int(d)) for t, d in (line.split() for line in log.read_text().splitlines())
+    )
+    running = maxrunning = 0
+    for _, delta in events:
+        running += delta
+        maxrunning = max(maxrunning, running)
+    return maxrunning
+
+
+@pytest.fixture
+def fake_cmd(tmp_path):
+    script = tmp_path / 'fake_converter.py'
+    script.write_text(FAKE_CONVERTER)
+    log = tmp_path / 'converter.log'
+    return [sys.executable, str(script), str(log)], log
+
+
+def test_concurrency_is_bounded(tmp_path, fake_cmd):
+    cmd, log = fake_cmd
+    vidfiles = _make_videos(tmp_path, 6)
+    results = convert_videos(vidfiles, cmd=cmd, nworkers=2)
+    assert sorted(results) == sorted(vidfiles)
+    assert all(code == 0 for code in results.values())
+    assert all(is_up_to_date(f) for f in vidfiles)
+    assert _max_concurrent(log) == 2
+
+
+def test_up_to_date_files_are_skipped(tmp_path, fake_cmd):
+    cmd, log = fake_cmd
+    vidfiles = _make_videos(tmp_path, 3)
+    convert_videos(vidfiles, cmd=cmd, nworkers=3)
+    log.unlink()
+    assert convert_videos(vidfiles, cmd=cmd) == dict()
+    assert not log.exists()
+    # a newer source file is converted again
+    vidfiles[0].write_bytes(b'y' * 1000)
+    future = time.time() + 10
+    os.utime(vidfiles[0], (future, future))
+    assert list(convert_videos(vidfiles, cmd=cmd)) == [vidfiles[0]]
+    # with redo, all the files are converted
+    assert len(convert_videos(vidfiles, cmd=cmd, redo=True)) == 3
+
+
+def test_missing_output_raises(tmp_path, fake_cmd):
+    cmd, _ = fake_cmd
+    vidfiles = _make_videos(tmp_path, 2)
+    broken = tmp_path / 'broken.avi'
+    broken.write_bytes(b'x')
+    with pytest.raises(RuntimeError, match='broken.avi'):
+        convert_videos(vidfiles + [broken], cmd=cmd, nworkers=2)
+    # the other files were converted
+    assert all(is_up_to_date(f) for f in vidfiles)
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""
+Single-read trial loader for c3d files.
+
+The gaitutils readers read the c3d file again for every call:
+read_data.get_emg_data(), read_data.get_metadata() and trial.Trial() each
+read the whole file and extract their data from it. load_trial() returns a
+LoadedTrial that serves metadata, markers, EMG, forceplate data and gait
+cycles from a single parse, extracting each only once:
+
+    tr = load_trial(c3dfile)
+    emg = tr.emg_data['data']
+    mdata = tr.marker_data(['RFEP', 'RTIO'])
+    cycles = tr.trial.get_cycles('all')
+    print(parse_counts())
+
+The loaded trials are kept in a small per-process LRU cache, keyed by the
+file path, size and modification time, so loading the same file again within
+a batch run costs nothing. The c3d parsing itself is cached by gaitutils (by
+the md5 digest of the file), so the readers used by LoadedTrial and any other
+gaitutils c3d reads in the same process (e.g. inside Trial) reuse the same
+parse. parse_counts() reports the actual parses from the gaitutils cache
+statistics.
+
+requires: gaitutils
+"""
+
+import functools
+import logging
+import os
+import os.path as op
+from collections import OrderedDict
+
+from gaitutils import c3d, read_data, trial
+
+logger = logging.getLogger(__name__)
+
+# max. number of loaded trials kept in memory per process
+CACHE_SIZE = 4
+
+_trial_cache = OrderedDict()
+
+
+def _file_key(c3dfile):
+    """Cache key for a file: the path, size and modification time"""
+    st = os.stat(c3dfile)
+    return op.normcase(op.abspath(c3dfile)), st.st_size, st.st_mtime_ns
+
+
+def _lru_get(cache, key, func):
+    """Get value from a LRU cache (OrderedDict), or compute as func()"""
+    if key in cache:
+        cache.move_to_end(key)
+        return cache[key]
+    val = cache[key] = func()
+    while len(cache) > CACHE_SIZE:
+        cache.popitem(last=False)
+    return val
+
+
+def _parse_cache():
+    """Return the lru_cache of the gaitutils c3d parser, or None if not found.
+
+    gaitutils wraps c3d._get_c3dacq with envutils.lru_cache_checkfile, which
+    keeps the lru_cache function in the closure of the wrapper.
+    """
+    for cell in getattr(c3d._get_c3dacq, '__closure__', None) or ():
+        if hasattr(cell.cell_contents, 'cache_info'):
+            return cell.cell_contents
+    return None
+
+
+def parse_counts():
+    """Return the numbers of c3d parses and reused parses (for benchmarking).
+
+    Returns
+    -------
+    dict
+        Dict with keys 'parsed' and 'reused', or None if the gaitutils parser
+        cache statistics are not available.
+    """
+    if (cache := _parse_cache()) is None:
+        return None
+    info = cache.cache_info()
+    return {'parsed': info.misses, 'reused': info.hits}
+
+
+def clear_cache():
+    """Clear the caches (including the gaitutils c3d cache) and the counts"""
+    _trial_cache.clear()
+    if (cache := _parse_cache()) is not None:
+        cache.cache_clear()
+
+
+class LoadedTrial:
+    """Data of a single c3d trial, read from a single parse.
+
+    Use load_trial() to create instances. All the data is read lazily on first
+    access and then kept.
+    """
+
+    def __init__(self, c3dfile):
+        self.c3dfile = c3dfile
+        self._marker_data = dict()
+
+    @functools.cached_property
+    def metadata(self):
+        """Trial metadata, see gaitutils read_data.get_metadata()"""
+        return read_data.get_metadata(self.c3dfile)
+
+    @functools.cached_property
+    def emg_data(self):
+        """EMG data, see gaitutils read_data.get_emg_data()"""
+        return read_data.get_emg_data(self.c3dfile)
+
+    @functools.cached_property
+    def forceplate_data(self):
+        """Forceplate data, see gaitutils read_data.get_forceplate_data()"""
+        return read_data.get_forceplate_data(self.c3dfile)
+
+    @functools.cached_property
+    def trial(self):
+        """The gaitutils Trial instance (for cycles etc.)"""
+        return trial.Trial(self.c3dfile)
+
+    @property
+    def cycles(self):
+        """All gait cycles of the trial"""
+        return self.trial.cycles
+
+    def marker_data(self, markers, ignore_missing=False):
+        """Marker data, see gaitutils read_data.get_marker_data()"""
+        key = (tuple(markers), ignore_missing)
+        if key not in self._marker_data:
+            self._marker_data[key] = read_data.get_marker_data(
+                self.c3dfile, list(markers), ignore_missing=ignore_missing
+            )
+        return self._marker_data[key]
+
+
+def load_trial(c3dfile):
+    """Return a LoadedTrial for a c3d file"""
+    return _lru_get(_trial_cache, _file_key(c3dfile), lambda: LoadedTrial(c3dfile))
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""
+Bounded concurrent video conversion.
+
+gaitutils videos.convert_videos() starts a converter process for every file
+at once, which oversubscribes the CPU for sessions with dozens of videos.
+convert_videos() here runs at most nworkers converters at a time (by default,
+one per core), starts the next queued file as soon as a converter exits, and
+skips files whose converted output is up to date:
+
+    results = convert_videos(vidfiles)
+
+The converter command defaults to the one configured in gaitutils
+(cfg.general.videoconv_path and videoconv_opts); the video file is appended
+as the last argument and the converter is expected to write the output next
+to it, with the target suffix. Any command can be given instead, e.g. a fake
+converter for testing:
+
+    fake = [sys.executable, '-c',
+            'import sys, shutil; shutil.copy(sys.argv[1], sys.argv[1][:-4] + ".ogv")']
+    convert_videos(vidfiles, cmd=fake, nworkers=2)
+
+requires: gaitutils (for the default converter command)
+"""
+
+import argparse
+import ctypes
+import logging
+import os
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# extension for converted files
+TARGET_SUFFIX = '.ogv'
+
+
+def _target_file(vidfile, target_suffix=TARGET_SUFFIX):
+    return Path(vidfile).with_suffix(target_suffix)
+
+
+def is_up_to_date(vidfile, target_suffix=TARGET_SUFFIX):
+    """Whether the converted file exists and is newer than the video file"""
+    target = _target_file(vidfile, target_suffix)
+    try:
+        st = target.stat()
+    except FileNotFoundError:
+        return False
+    return st.st_size > 0 and st.st_mtime >= Path(vidfile).stat().st_mtime
+
+
+def _default_cmd():
+    """Return the converter command configured in gaitutils"""
+    from gaitutils import cfg
+
+    vidconv_bin = Path(cfg.general.videoconv_path)
+    if not (vidconv_bin.is_file() and os.access(vidconv_bin, os.X_OK)):
+        raise RuntimeError(f'Invalid configured video converter: {vidconv_bin}')
+    return [str(vidconv_bin)] + cfg.general.videoconv_opts.split()
+
+
+def _run_converter(cmd, vidfile):
+    """Run the converter for a file; returns the exit code"""
+    # on Windows, do not open consoles
+    creationflags = subprocess.CREATE_NO_WINDOW if os.name == 'nt' else 0
+    proc = subprocess.run(
+        list(cmd) + [str(vidfile)],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        creationflags=creationflags,
+    )
+    return proc.returncode
+
+
+def _format_progress(n_done, n_total, bytes_done, bytes_total, elapsed):
+    txt = f'Converting videos: {n_done} of {n_total} files done'
+    if elapsed > 0 and bytes_done > 0:
+        rate = bytes_done / elapsed
+        eta = (bytes_total - bytes_done) / rate
+        txt += f', {rate / 1e6:.1f} MB/s, ETA {eta:.0f} s'
+    return txt
+
+
+def convert_videos(vidfiles, cmd=None, nworkers=None, redo=False, target_suffix=TARGET_SUFFIX):
+    """Convert video files, running at most nworkers converters at a time.
+
+    Parameters
+    ----------
+    vidfiles : list
+        The video files.
+    cmd : list, optional
+        The converter command (without the file argument). By default, the
+        converter configured in gaitutils.
+    nworkers : int, optional
+        Max. number of concurrent converter processes. By default, the number
+        of cores.
+    redo : bool
+        If True, convert also the files that are up to date.
+    target_suffix : str
+        Suffix of the converted files.
+
+    Returns
+    -------
+    dict
+        Dict of video file: converter exit code, for the files that were
+        converted.
+
+    Raises
+    ------
+    RuntimeError
+        If any of the converted files is missing after the conversion.
+    """
+    vidfiles = [Path(vidfile) for vidfile in vidfiles]
+    todo = [f for f in vidfiles if redo or not is_up_to_date(f, target_suffix)]
+    if len(todo) < len(vidfiles):
+        print(f'Skipping {len(vidfiles) - len(todo)} up to date videos')
+    if not todo:
+        return dict()
+    if cmd is None:
+        cmd = _default_cmd()
+    if os.name == 'nt':
+        # XXX: this disables Windows protection fault dialogs
+        # needed since ffmpeg2theora may crash after conversion is complete (?)
+        SEM_NOGPFAULTERRORBOX = 0x0002  # From MSDN
+        ctypes.windll.kernel32.SetErrorMode(SEM_NOGPFAULTERRORBOX)
+    if nworkers is None:
+        nworkers = os.cpu_count()
+    nworkers = max(min(nworkers, len(todo)), 1)
+
+    sizes = {f: f.stat().st_size for f in todo}
+    bytes_total = sum(sizes.values())
+    bytes_done = 0
+    results = dict()
+    t0 = time.perf_counter()
+    # the worker threads just wait for the converter processes, so the
+    # next file is started as soon as a converter exits
+    with ThreadPoolExecutor(max_workers=nworkers) as executor:
+        futures = {executor.submit(_run_converter, cmd, f): f for f in todo}
+        for future in as_completed(futures):
+            vidfile = futures[future]
+            results[vidfile] = future.result()
+            bytes_done += sizes[vidfile]
+            elapsed = time.perf_counter() - t0
+            print(_format_progress(len(results), len(todo), bytes_done, bytes_total, elapsed))
+
+    # the converter may crash after writing the output, so the exit code
+    # alone does not tell whether the conversion succeeded
+    failed = [f for f in todo if not _target_file(f, target_suffix).is_file()]
+    for vidfile, code in results.items():
+        if code != 0 and vidfile not in failed:
+            logger.warning(f'converter exited with {code} for {vidfile}')
+    if failed:
+        raise RuntimeError(f'Could not convert: {[str(f) for f in failed]}')
+    elapsed = time.perf_counter() - t0
+    print(f'Converted {len(todo)} videos in {elapsed:.1f} s ({nworkers} workers)')
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert trial videos')
+    parser.add_argument('vidfiles', nargs='+', help='video files')
+    parser.add_argument('--workers', type=int, help='max. concurrent converters')
+    parser.add_argument('--redo', action='store_true', help='convert also up to date files')
+    args = parser.parse_args()
+    convert_videos(args.vidfiles, nworkers=args.workers, redo=args.redo)